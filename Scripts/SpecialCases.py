@@ -1,8 +1,13 @@
 from discrete_model.logistic_growth_model import logistic_growth_model
+from discrete_model.ensemble_model import ensemble_logistic_growth_model
 from discrete_model.pandemic_functions import deterministic_pandemic_function, types_shift_model_deter_function
 from utils.DataSaver import *
 from utils.Plotter import Plotter
-from utils.Auxiliary import Params, MODEL_NAMES, Model, PARAM_NAMES, ParamName
+from utils.Auxiliary import Params, MODEL_NAMES, Model, PARAM_NAMES, ParamName, ParamBatch
+from utils.SimulationCache import SimulationCache, run_cached
+from utils.Instrumentation import print_report
+import os
+from dataclasses import replace
 import sys
 import numpy as np
 RESCUE_EFFECT = "rescue_effect"
@@ -10,26 +15,28 @@ DETER_STR = "Deterministic"
 TYPE_SHIFT_STR = "Type switch"
 EXTINCTION_DYNAMICS = "extinction_dynamics"
 SHIFT_FACTOR_RNG_COMP = "shift_factor_range_comparison"
+CACHE_DIR = "simulation_cache"
 
 
-def rescue_effect(dir_path: str, params: Params) -> None:
+def rescue_effect(dir_path: str, params: Params, cache: SimulationCache = None) -> None:
     """
     Comparing the deterministic model to the types shift model. The goal is to show that the types shift can help with
     the survival of the species in an extreme epidemic.
     :param dir_path: The directory in which the data is saved.
     :param params: Parameters for the simulation - the same for both models, only the 'type shift' model uses
     the 'type_shift' parameter.
+    :param cache: A cache of simulation results, the runs are simulated only if they are not cached.
     """
 
     new_dir_path = make_new_dir(dir_path, RESCUE_EFFECT)
 
     # Deterministic model run
-    colony_birds1, lone_birds1 = logistic_growth_model(params, deterministic_pandemic_function)
+    colony_birds1, lone_birds1 = run_cached(cache, logistic_growth_model, params, deterministic_pandemic_function)
     populations1 = BirdsPopulations(colony_birds1, lone_birds1)
     save_single_run(new_dir_path, params, populations1, MODEL_NAMES[Model.DETER])
 
     # Type Shift model run
-    colony_birds2, lone_birds2 = logistic_growth_model(params, types_shift_model_deter_function)
+    colony_birds2, lone_birds2 = run_cached(cache, logistic_growth_model, params, types_shift_model_deter_function)
     populations2 = BirdsPopulations(colony_birds2, lone_birds2)
     save_single_run(new_dir_path, params, populations2, MODEL_NAMES[Model.TYPE_SHIFT])
 
@@ -56,15 +63,13 @@ def extinction_dynamics(dir_path):
     # save_single_run(new_dir_path, params1, [colony_birds1, lone_birds1], MODEL_NAMES[Model.DETER])
 
     # Second scenario - Lone birds survive, lone death factor is lower
-    params2 = params1.copy()
-    params2.l_death_factor = 0.45
+    params2 = replace(params1, l_death_factor=0.45)
     colony_birds2, lone_birds2 = logistic_growth_model(params2, deterministic_pandemic_function)
     data_for_plots.append([colony_birds2, lone_birds2])
     # save_single_run(new_dir_path, params2, [colony_birds2, lone_birds2], MODEL_NAMES[Model.DETER])
 
     # Third scenario - Lone birds survive, selection coefficient is lower
-    params3 = params1.copy()
-    params3.selection_coefficient = 0.05
+    params3 = replace(params1, selection_coefficient=0.05)
     colony_birds3, lone_birds3 = logistic_growth_model(params3, deterministic_pandemic_function)
     data_for_plots.append([colony_birds3, lone_birds3])
     # save_single_run(new_dir_path, params3, [colony_birds3, lone_birds3], MODEL_NAMES[Model.DETER])
@@ -74,10 +79,11 @@ def extinction_dynamics(dir_path):
     Plotter.plot_scatter_subplots(3, 1, data_for_plots, subplot_titles)
 
 
-def type_shift_comparison(dir_path):
+def type_shift_comparison(dir_path, cache: SimulationCache = None):
     """
     The goal is to compare different shift factor rates, and to show how it helps the species to survive during
     pandemics.
+    :param cache: A cache of simulation results, the runs are simulated only if they are not cached.
     """
 
     shift_factor1, shift_factor2, shift_factor3, shift_factor4 = 0.001, 0.01, 0.05, 0.1
@@ -89,31 +95,32 @@ def type_shift_comparison(dir_path):
                      num_of_generations=1000, growth_rate=0.1, init_birds_num=3000, carrying_capacity=10000,
                      shift_factor=shift_factor1)
 
-    colony_birds1, lone_birds1 = logistic_growth_model(params1, types_shift_model_deter_function)
+    colony_birds1, lone_birds1 = run_cached(cache, logistic_growth_model, params1,
+                                            types_shift_model_deter_function)
     populations_1 = BirdsPopulations(colony_birds1, lone_birds1)
     data_for_plots.append(populations_1)
     # save_single_run(new_dir_path, params1, populations_1, MODEL_NAMES[Model.TYPE_SHIFT])
 
     # Scenario 2: Optimal shift factor
-    params2 = params1.copy()
-    params2.shift_factor = shift_factor2
-    colony_birds2, lone_birds2 = logistic_growth_model(params2, types_shift_model_deter_function)
+    params2 = replace(params1, shift_factor=shift_factor2)
+    colony_birds2, lone_birds2 = run_cached(cache, logistic_growth_model, params2,
+                                            types_shift_model_deter_function)
     populations_2 = BirdsPopulations(colony_birds2, lone_birds2)
     data_for_plots.append(populations_2)
     # save_single_run(new_dir_path, params2, populations_2, MODEL_NAMES[Model.TYPE_SHIFT])
 
     # Scenario 3: Sub-optimal shift factor
-    params3 = params1.copy()
-    params3.shift_factor = shift_factor3
-    colony_birds3, lone_birds3 = logistic_growth_model(params3, types_shift_model_deter_function)
+    params3 = replace(params1, shift_factor=shift_factor3)
+    colony_birds3, lone_birds3 = run_cached(cache, logistic_growth_model, params3,
+                                            types_shift_model_deter_function)
     populations_3 = BirdsPopulations(colony_birds3, lone_birds3)
     data_for_plots.append(populations_3)
     # save_single_run(new_dir_path, params3, populations_3, MODEL_NAMES[Model.TYPE_SHIFT])
 
     # Scenario 4: Shift factor permits the birds to barely survive
-    params4 = params1.copy()
-    params4.shift_factor = shift_factor4
-    colony_birds4, lone_birds4 = logistic_growth_model(params4, types_shift_model_deter_function)
+    params4 = replace(params1, shift_factor=shift_factor4)
+    colony_birds4, lone_birds4 = run_cached(cache, logistic_growth_model, params4,
+                                            types_shift_model_deter_function)
     populations_4 = BirdsPopulations(colony_birds4, lone_birds4)
     data_for_plots.append(populations_4)
     # save_single_run(new_dir_path, params4, populations_4, MODEL_NAMES[Model.TYPE_SHIFT])
@@ -131,20 +138,18 @@ def shift_factor_range_comparison(dir_path):
     100 generations, for each shift factor.
     """
     shift_factors = np.linspace(0, 0.2, 201)
-    avg_bird_numbers = []
 
     params = Params(pandemic_rate=0.1, selection_coefficient=0.1, c_death_factor=0.8, l_death_factor=0.5,
                     num_of_generations=1000, growth_rate=0.1, init_birds_num=3000, carrying_capacity=10000)
 
-    new_dir_path = make_new_dir(dir_path, SHIFT_FACTOR_RNG_COMP)
+    # All the shift factors are simulated together
+    batch = ParamBatch.zip(params, {ParamName.SHIFT_FACTOR: shift_factors})
+    colony_runs, lone_runs = ensemble_logistic_growth_model(batch, types_shift_model_deter_function, 1)
+    # avg_bird_numbers = np.average(colony_runs[:, 800:] + lone_runs[:, 800:], axis=1)
+    avg_bird_numbers = np.max(lone_runs[:, 200:], axis=1)
 
-    for shift_factor in shift_factors:
-
-        params.shift_factor = shift_factor
-        colony_birds, lone_birds = logistic_growth_model(params, types_shift_model_deter_function)
-        save_single_run(new_dir_path, params, BirdsPopulations(colony_birds, lone_birds), MODEL_NAMES[Model.TYPE_SHIFT])
-        # avg_bird_numbers.append(np.average(colony_birds[800:] + lone_birds[800:]))
-        avg_bird_numbers.append(np.max(lone_birds[200:]))
+    # All the runs are saved to a single file
+    mk_run_store(dir_path, SHIFT_FACTOR_RNG_COMP).append(list(batch), colony_runs, lone_runs)
 
     # Plotter.plot_bar_plot(shift_factors, avg_bird_numbers, PARAM_NAMES[ParamName.SHIFT_FACTOR],
     #                       "Number of birds", "Type Shift model")
@@ -154,16 +159,19 @@ def shift_factor_range_comparison(dir_path):
 
 def main():
     path = sys.argv[1]
+    cache = SimulationCache(os.path.join(path, CACHE_DIR))
     # rescue_effect(path, Params(pandemic_rate=0.1, selection_coefficient=0.1, c_death_factor=0.8, l_death_factor=0.48,
     #                 num_of_generations=1000, growth_rate=0.1, init_birds_num=3000, carrying_capacity=10000,
     #                 shift_factor=0.01))
     # extinction_dynamics(path)
-    type_shift_comparison(path)
+    type_shift_comparison(path, cache)
     # shift_factor_range_comparison(path)
 
 
 
 if __name__ == "__main__":
     main()
+    Plotter.finish_export()
+    print_report()
 
 
@@ -1,10 +1,12 @@
 import sys
+from dataclasses import replace
 from discrete_model.pandemic_functions import types_shift_model_deter_function, deterministic_pandemic_function
 from differential_model.logistic_growth_diff import logistic_growth_diff
 from discrete_model.logistic_growth_model import logistic_growth_model
 from utils.DataSaver import save_single_run, make_new_dir
 from utils.Plotter import Plotter
 from utils.Auxiliary import Params, BirdsPopulations, MODEL_NAMES, Model
+from utils.Instrumentation import print_report
 # Constant values of unchanging parameters
 INITIAL_NUM_OF_BIRDS = 3000
 CARRYING_CAPACITY = 10000
@@ -17,10 +19,8 @@ SHIFT_FACTOR = 0.01
 C_WIN_PARAMS = Params(pandemic_rate=RATE1, selection_coefficient=0.05, c_death_factor=0.5, shift_factor=SHIFT_FACTOR,
                       l_death_factor=0, num_of_generations=NUM_OF_GENERATIONS, growth_rate=GROWTH_RATE,
                       init_birds_num=INITIAL_NUM_OF_BIRDS, carrying_capacity=CARRYING_CAPACITY)
-L_WIN_PARAMS = C_WIN_PARAMS.copy()
-L_WIN_PARAMS.pandemic_rate = RATE2
-CO_EX_PARAMS = C_WIN_PARAMS.copy()
-CO_EX_PARAMS.pandemic_rate = RATE3
+L_WIN_PARAMS = replace(C_WIN_PARAMS, pandemic_rate=RATE2)
+CO_EX_PARAMS = replace(C_WIN_PARAMS, pandemic_rate=RATE3)
 
 TYPE_SHIFT = "TypeShift"
 
@@ -32,12 +32,9 @@ def run_single_types_shift_dynamics(dir_path):
     params1 = Params(pandemic_rate=0.1, selection_coefficient=0.1, c_death_factor=0.5, l_death_factor=0.5,
                     growth_rate=0.1, carrying_capacity=10000, init_birds_num=3000, shift_factor=0.01,
                     num_of_generations=1000)
-    params2 = params1.copy()
-    params2.c_death_factor = 0.7
-    params3 = params1.copy()
-    params3.c_death_factor = 0.8
-    params4 = params1.copy()
-    params4.c_death_factor = 0.95
+    params2 = replace(params1, c_death_factor=0.7)
+    params3 = replace(params1, c_death_factor=0.8)
+    params4 = replace(params1, c_death_factor=0.95)
 
     new_path = make_new_dir(dir_path, "types_shift_comparison")
 
@@ -66,8 +63,8 @@ def run_single_example(dir_path: str, params: Params):
     colony_birds, lone_birds = logistic_growth_diff(params, types_shift_model_deter_function)
     bird_populations = BirdsPopulations(colony_birds, lone_birds)
     # save_single_run(new_path, params, bird_populations, MODEL_NAMES[Model.TYPE_SHIFT])
-    Plotter.plot_birds_numbers_scatter_plot(bird_populations.colony_birds, bird_populations.lone_birds,
-                                            f"shift factor: {params.shift_factor}").show()
+    Plotter.show(Plotter.plot_birds_numbers_scatter_plot(bird_populations.colony_birds, bird_populations.lone_birds,
+                                                         f"shift factor: {params.shift_factor}"), "birds_numbers")
 
 
 def main():
@@ -79,3 +76,5 @@ def main():
 
 if __name__ == "__main__":
     main()
+    Plotter.finish_export()
+    print_report()
@@ -7,6 +7,7 @@ from discrete_model.pandemic_functions import deterministic_pandemic_function
 from functions_for_script import run_several_scenarios, run_heatmap_pr_df
 from utils.Plotter import Plotter
 from utils.Auxiliary import Params, Model, MODEL_NAMES, ParamName, PARAM_NAMES
+from utils.Instrumentation import print_report
 from typing import Tuple, Callable
 import sys
 import numpy as np
@@ -64,7 +65,7 @@ def deterministic_single_run(dir_path):
     colony_birds, lone_birds = logistic_growth_model(params, deterministic_pandemic_function)
     fig = Plotter.plot_birds_numbers_scatter_plot(colony_birds, lone_birds,
                                                   f"{PARAM_NAMES[ParamName.PANDEMIC_RATE]}: {RATE1}")
-    fig.show()
+    Plotter.show(fig, "birds_numbers")
 
 
 def main():
@@ -75,5 +76,7 @@ def main():
 
 if __name__ == "__main__":
     main()
+    Plotter.finish_export()
+    print_report()
 
 
@@ -1,19 +1,33 @@
 import numpy as np
 from utils.Auxiliary import Params, ParamName, PARAM_NAMES, BirdsPopulations, MODEL_NAMES, Model
 from discrete_model.logistic_growth_model import logistic_growth_model
+from discrete_model.ensemble_model import ensemble_outcome_fractions
+# Re-exported: MIN_FRAC_FOR_WIN used to be defined in this module
+from discrete_model.ensemble_model import MIN_FRAC_FOR_WIN  # noqa: F401
+from discrete_model.grid_model import grid_pr_df_colony_fraction
+from discrete_model.parallel_sweep import run_stoch_heatmap_parallel, run_adaptive_stoch_heatmap_parallel
+from discrete_model.adaptive_replicates import DEFAULT_MAX_RUNS
+from discrete_model.adaptive_grid import adaptive_heatmap, deterministic_point_evaluator, stochastic_point_evaluator, \
+    DEFAULT_MAX_LEVEL
+from discrete_model.boundary_finder import critical_death_factors, DEFAULT_TOLERANCE
+from discrete_model.period_map import period_map_pr_df_colony_fraction
 from typing import Tuple, Callable, List
 from utils.Plotter import Plotter
+from utils.Instrumentation import timed, SWEEP
+from utils.SimulationCache import SimulationCache, run_cached
 from utils.DataSaver import mk_dir_for_heatmap, save_heatmap_data, save_single_run, mk_dir_for_stoch_avg,\
     mk_heatmap_header
 FRAC_OF_COLONY_BIRDS_TITLE = "Fraction of colony birds"
 FRAC_OF_COLONY_WINS = "Fraction of colony birds wins"
 FRAC_OF_LONE_BIRDS_TITLE = "Fraction of lone birds"
 FRAC_OF_CO_EX_TITLE = "Fraction of coexistence"
+NUM_OF_RUNS_TITLE = "Number of runs"
 COLONY_WINS, LONE_WINS, COEXISTENCE = "Colony wins", "Lone wins", "Coexistence"
+CRITICAL_DEATH_FACTOR_TITLE = "Critical colony death factor"
 DETER_MODEL = "deterministic_model"
-MIN_FRAC_FOR_WIN = 0.95
 
 
+@timed(SWEEP)
 def run_several_scenarios(dir_path: str, pandemic_function: Callable, subplot_titles: Tuple,
                           params_arr: List[Params], model_name: str) -> None:
     """
@@ -35,31 +49,28 @@ def run_several_scenarios(dir_path: str, pandemic_function: Callable, subplot_ti
     Plotter.plot_scatter_subplots(len(params_arr), 1, data_for_plot, subplot_titles)
 
 
+@timed(SWEEP)
 def run_heatmap_pr_df(dir_path: str, pandemic_rates: np.ndarray, death_factors: np.ndarray, params: Params,
-                      pandemic_function: Callable) -> None:
+                      pandemic_function: Callable, cache: SimulationCache = None, use_period_map: bool = False) -> None:
     """
     Runs a given model on different combinations of pandemic rates and colony death factors, thus creating
     a matrix for a heatmap which expresses the fraction of colony birds from the total population.
+    All the (pandemic rate, colony death factor) cells are simulated together by the grid engine.
     :param dir_path: Path to a directory where to save the data
     :param pandemic_rates: Pandemic rate values
     :param death_factors: Colony death factor values
     :param params: The rest of the parameters
     :param pandemic_function: The model pandemic function
+    :param cache: A cache of simulation results, the matrix is simulated only if it's not cached
+    :param use_period_map: Whether to calculate the asymptotic fractions from the fixed points of the period map
+    instead of simulating all the generations. Only for the deterministic pandemic function.
     :return: None
     """
     # new_path = mk_dir_for_heatmap(dir_path, model_name=MODEL_NAMES[Model.DETER])
 
-    mat = np.empty(shape=(pandemic_rates.size, death_factors.size))
-    for i, rate in enumerate(pandemic_rates):
-        for j, factor in enumerate(death_factors):
-
-            params.pandemic_rate = rate
-            params.c_death_factor = factor
-
-            colony_birds, lone_birds = logistic_growth_model(params, pandemic_function)
-            # save_single_run(new_path, params, [colony_birds, lone_birds], MODEL_NAMES[Model.DETER])
-            total_last_100 = colony_birds[900:] + lone_birds[900:]
-            mat[i][j] = np.average(colony_birds[900:] / total_last_100)
+    engine = period_map_pr_df_colony_fraction if use_period_map else grid_pr_df_colony_fraction
+    mat = run_cached(cache, engine, params, pandemic_function, pandemic_rates=pandemic_rates,
+                     death_factors=death_factors)
 
     Plotter.plot_heatmap(mat, death_factors, pandemic_rates, xaxis_title=PARAM_NAMES[ParamName.C_DEATH_FACTOR],
                          yaxis_title=PARAM_NAMES[ParamName.PANDEMIC_RATE], legend_title=FRAC_OF_COLONY_BIRDS_TITLE)
@@ -67,44 +78,91 @@ def run_heatmap_pr_df(dir_path: str, pandemic_rates: np.ndarray, death_factors:
     # save_heatmap_data(new_path, death_factors, pandemic_rates, mat)
 
 
+@timed(SWEEP)
+def run_adaptive_heatmap_pr_df(pandemic_rates: np.ndarray, death_factors: np.ndarray, params: Params,
+                               pandemic_function: Callable, max_level: int = DEFAULT_MAX_LEVEL,
+                               num_of_runs: int = None, seed: int = 0) -> None:
+    """
+    Runs a heatmap of pandemic rates and colony death factors adaptively - starting from the given coarse values, only
+    the cells around the boundaries between colony wins, lone wins and coexistence are refined.
+    :param pandemic_rates: Coarse pandemic rate values
+    :param death_factors: Coarse colony death factor values
+    :param params: The rest of the parameters
+    :param pandemic_function: The model pandemic function
+    :param max_level: The maximal number of times a coarse cell is split in four
+    :param num_of_runs: The number of runs at each point of a stochastic model. If not given the model is considered
+    deterministic and the heatmap shows the fraction of colony birds, otherwise it shows the fraction of colony wins
+    :param seed: Seed for the random streams of the points of a stochastic model
+    :return: None
+    """
+    if num_of_runs is None:
+        evaluate = deterministic_point_evaluator(params, pandemic_function)
+        legend_title = FRAC_OF_COLONY_BIRDS_TITLE
+    else:
+        evaluate = stochastic_point_evaluator(params, pandemic_function, num_of_runs, seed)
+        legend_title = FRAC_OF_COLONY_WINS
+    heatmap = adaptive_heatmap(evaluate, pandemic_rates, death_factors, max_level)
+
+    Plotter.plot_heatmap(heatmap.rasterize(), heatmap.death_factors, heatmap.pandemic_rates,
+                         xaxis_title=PARAM_NAMES[ParamName.C_DEATH_FACTOR],
+                         yaxis_title=PARAM_NAMES[ParamName.PANDEMIC_RATE], legend_title=legend_title)
+
+
+@timed(SWEEP)
+def run_critical_death_factor_curve(pandemic_rates: np.ndarray, params: Params, pandemic_function: Callable,
+                                    tolerance: float = DEFAULT_TOLERANCE, num_of_runs: int = 1,
+                                    seed: int = None) -> np.ndarray:
+    """
+    Finds the critical colony death factor, above which the colony birds stop winning, for each pandemic rate,
+    and plots the boundary curve.
+    :param pandemic_rates: Pandemic rate values
+    :param params: The rest of the parameters
+    :param pandemic_function: The model pandemic function
+    :param tolerance: The precision of the critical death factors
+    :param num_of_runs: The number of runs at each point of a stochastic model
+    :param seed: Seed for the stochastic models
+    :return: The critical death factors
+    """
+    boundary = critical_death_factors(params, pandemic_function, pandemic_rates, tolerance=tolerance,
+                                      num_of_runs=num_of_runs, seed=seed)
+    Plotter.plot_line_plot(pandemic_rates, boundary, PARAM_NAMES[ParamName.PANDEMIC_RATE],
+                           CRITICAL_DEATH_FACTOR_TITLE, CRITICAL_DEATH_FACTOR_TITLE)
+    return boundary
+
+
+@timed(SWEEP)
 def run_stochastic_model_average(num_of_runs: int, pandemic_func: Callable, model_name: str,
-                                 params: Params, dir_path: str) -> Tuple[float, float, float]:
+                                 params: Params, dir_path: str,
+                                 rng: np.random.Generator = None) -> Tuple[float, float, float]:
     """
     Runs the stochastic model 'num_of_runs' times. At each run calculates the average fraction of colony birds
     in the last 100 generations. Then it checks what scenario has occurred: Colony birds overtook, Lone birds
     overtook, Coexistence. It returns the fraction of each of the scenarios from the total number of runs.
-    This function is used to run on a single set of parameters.
+    This function is used to run on a single set of parameters. All the runs are simulated together by the
+    ensemble engine.
     :param num_of_runs - The number of times to perform the stochastic simulation
     :param pandemic_func - The stochastic model function
     :param model_name - The stochastic model name
     :param params - Parameters for the simulation
     :param dir_path - path to a directory where to save the simulation data
+    :param rng - Random generator for the runs. A fresh one is created if not given.
     :return A tuple that contains three values: Fraction of wins of the colony birds,
      fraction of wins for the lone birds, fraction of coexistence wins.
     """
-    colony_wins, lone_wins, coexist_wins = 0, 0, 0
     # new_dir_path = mk_dir_for_stoch_avg(dir_path, params, model_name)
-
-    for i in range(num_of_runs):
-        colony_birds, lone_birds = logistic_growth_model(params, pandemic_func)
-        # save_single_run(new_dir_path, params, [colony_birds, lone_birds], model_type=model_name)
-        colony_last_100, lone_last_100 = colony_birds[900:], lone_birds[900:]
-        total_last_100 = colony_last_100 + lone_last_100
-        avg_frac = np.average(colony_last_100 / total_last_100)
-        if avg_frac > MIN_FRAC_FOR_WIN:
-            colony_wins += 1
-        elif avg_frac < (1 - MIN_FRAC_FOR_WIN):
-            lone_wins += 1
-        else:
-            coexist_wins += 1
-    return colony_wins / num_of_runs, lone_wins / num_of_runs, coexist_wins / num_of_runs
+    return ensemble_outcome_fractions(params, pandemic_func, num_of_runs, rng)
 
 
+@timed(SWEEP)
 def run_stoch_heatmaps_pr_df(num_of_runs: int, pandemic_func: Callable, model_name: str, pandemic_rates: np.ndarray,
-                             death_factors: np.ndarray, params: Params, dir_path: str) -> None:
+                             death_factors: np.ndarray, params: Params, dir_path: str, seed: int = None,
+                             num_of_workers: int = None, chunk_size: int = None,
+                             cache: SimulationCache = None, target_width: float = None,
+                             max_runs: int = DEFAULT_MAX_RUNS) -> None:
     """
     Runs simulations for a heatmap of a stochastic model. The result is a plot with three
     heatmaps showing the average fractions of colony birds, lone birds, coexistence.
+    The cells are split between worker processes.
     :param num_of_runs: The number of times to run the simulation on each (pandemic rate, colony death factor) pair.
     :param pandemic_func: The stochastic model function
     :param model_name:
@@ -112,30 +170,36 @@ def run_stoch_heatmaps_pr_df(num_of_runs: int, pandemic_func: Callable, model_na
     :param death_factors:
     :param params: The rest of the parameters
     :param dir_path: A path to a directory where to save the data
+    :param seed: Seed for the random streams of the cells, a fixed seed gives the same result for any number of workers
+    :param num_of_workers: The number of worker processes, defaults to the number of CPUs
+    :param chunk_size: The number of cells sent to a worker at once
+    :param cache: A cache of simulation results, used only when the seed is fixed
+    :param target_width: If given, each cell runs batches of 'num_of_runs' replicates until the confidence intervals
+    of its fractions are narrower than target_width, and a fourth heatmap shows the number of runs in each cell
+    :param max_runs: The maximal number of runs in a cell when target_width is given
     :return: None
     """
 
     # new_path = mk_dir_for_heatmap(dir_path, model_name)
     new_path = ""
 
-    colony_win_mat = np.empty(shape=(pandemic_rates.size, death_factors.size))
-    lone_win_mat = np.empty(shape=(pandemic_rates.size, death_factors.size))
-    coexist_mat = np.empty(shape=(pandemic_rates.size, death_factors.size))
-
-    for i, rate in enumerate(pandemic_rates):
-        for j, factor in enumerate(death_factors):
-            params.pandemic_rate = rate
-            params.c_death_factor = factor
-            colony_win_frac, lone_win_frac, coexist_frac = \
-                run_stochastic_model_average(num_of_runs, pandemic_func, model_name, params, new_path)
-            colony_win_mat[i][j] = colony_win_frac
-            lone_win_mat[i][j] = lone_win_frac
-            coexist_mat[i][j] = coexist_frac
-
-    subplot_titles = (FRAC_OF_COLONY_BIRDS_TITLE, FRAC_OF_LONE_BIRDS_TITLE, FRAC_OF_CO_EX_TITLE)
+    if target_width is None:
+        mats = run_cached(cache, run_stoch_heatmap_parallel, params, pandemic_func, seed, num_of_runs=num_of_runs,
+                          pandemic_rates=pandemic_rates, death_factors=death_factors, num_of_workers=num_of_workers,
+                          chunk_size=chunk_size)
+        subplot_titles = (FRAC_OF_COLONY_BIRDS_TITLE, FRAC_OF_LONE_BIRDS_TITLE, FRAC_OF_CO_EX_TITLE)
+    else:
+        mats = run_cached(cache, run_adaptive_stoch_heatmap_parallel, params, pandemic_func, seed,
+                          pandemic_rates=pandemic_rates, death_factors=death_factors, target_width=target_width,
+                          batch_size=num_of_runs, max_runs=max_runs, num_of_workers=num_of_workers,
+                          chunk_size=chunk_size)
+        subplot_titles = (FRAC_OF_COLONY_BIRDS_TITLE, FRAC_OF_LONE_BIRDS_TITLE, FRAC_OF_CO_EX_TITLE,
+                          NUM_OF_RUNS_TITLE)
+    colony_win_mat, lone_win_mat, coexist_mat = mats[:3]
+
     param_names = [PARAM_NAMES[ParamName.C_DEATH_FACTOR], PARAM_NAMES[ParamName.PANDEMIC_RATE]]
-    Plotter.plot_heatmap_subplots(1, 3, [colony_win_mat, lone_win_mat, coexist_mat], [death_factors, pandemic_rates],
-                                  subplot_titles, param_names)
+    Plotter.plot_heatmap_subplots(1, len(mats), list(mats), [death_factors, pandemic_rates], subplot_titles,
+                                  param_names)
     # mk_heatmap_header(new_path, model_name, COLONY_WINS)
     # mk_heatmap_header(new_path, model_name, LONE_WINS)
     # mk_heatmap_header(new_path, model_name, COEXISTENCE)
@@ -144,17 +208,14 @@ def run_stoch_heatmaps_pr_df(num_of_runs: int, pandemic_func: Callable, model_na
     # save_heatmap_data(new_path, death_factors, pandemic_rates, colony_win_mat, COEXISTENCE)
 
 
-def run_stoch_single_heatmap(num_of_runs, pandemic_function, model_name, pandemic_rates, death_factors, params, dir_path):
+@timed(SWEEP)
+def run_stoch_single_heatmap(num_of_runs, pandemic_function, model_name, pandemic_rates, death_factors, params,
+                             dir_path, seed=None, num_of_workers=None, chunk_size=None):
     new_path = mk_dir_for_heatmap(dir_path, model_name)
 
-    colony_win_mat = np.empty(shape=(pandemic_rates.size, death_factors.size))
-    for i, rate in enumerate(pandemic_rates):
-        for j, factor in enumerate(death_factors):
-            params.pandemic_rate = rate
-            params.c_death_factor = factor
-            colony_win_frac, lone_win_frac, coexist_frac = \
-                run_stochastic_model_average(num_of_runs, pandemic_function, model_name, params, new_path)
-            colony_win_mat[i][j] = colony_win_frac
+    colony_win_mat, _, _ = run_stoch_heatmap_parallel(num_of_runs, pandemic_function, pandemic_rates, death_factors,
+                                                      params, seed=seed, num_of_workers=num_of_workers,
+                                                      chunk_size=chunk_size)
     Plotter.plot_heatmap(colony_win_mat, death_factors, pandemic_rates,
                          xaxis_title=PARAM_NAMES[ParamName.C_DEATH_FACTOR],
                          yaxis_title=PARAM_NAMES[ParamName.PANDEMIC_RATE],
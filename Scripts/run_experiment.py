@@ -0,0 +1,99 @@
+# Runs an experiment described by a JSON or YAML spec, instead of editing the main() of a script. Example spec:
+# {
+#   "name": "stochastic3_pr_df",
+#   "model": "STOCHASTIC3",
+#   "axes": {"PANDEMIC_RATE": {"start": 0, "stop": 1, "num": 11}, "C_DEATH_FACTOR": [0, 0.25, 0.5, 0.75, 1]},
+#   "params": {"selection_coefficient": 0.05, "l_death_factor": 0, "num_of_generations": 1000, "growth_rate": 1.5,
+#              "init_birds_num": 3000, "carrying_capacity": 10000},
+#   "num_of_runs": 100,
+#   "seed": 1,
+#   "outputs": ["npz", "csv", "plot"]
+# }
+# The "table" output saves the results as a memory-mapped outcome table, queried with OutcomeTable.load.
+# Completed cells are checkpointed, so running the same spec again after an interruption resumes the sweep.
+# Usage: python run_experiment.py <spec file> <output directory> [--workers N] [--chunk-size N]
+# Across nodes, give the spec a seed and either run a static shard on each node and merge the shard directories:
+#   python run_experiment.py spec.json <shard directory> --shard 2/8
+#   python run_experiment.py spec.json <output directory> --merge <shard directory> ...
+# or let the nodes pull chunks from a work queue in a shared directory, and run without flags there at the end:
+#   python run_experiment.py spec.json <shared directory> --queue directory
+import os
+import argparse
+import numpy as np
+from discrete_model.experiment import ExperimentSpec, load_spec, run_experiment, NPZ_OUTPUT, CSV_OUTPUT, \
+    PLOT_OUTPUT, TABLE_OUTPUT, RESULTS_FILE_NAME
+from discrete_model.outcome_table import save_outcome_table
+from discrete_model.sharding import parse_shard, run_shard, merge_shards, run_queue, DirectoryQueue, SQLiteQueue
+from utils.Auxiliary import PARAM_NAMES, PARAM_FIELDS
+from utils.DataSaver import save_heatmap_data
+from utils.Plotter import Plotter
+from utils.Instrumentation import print_report
+
+QUEUE_TYPES = {"directory": DirectoryQueue, "sqlite": SQLiteQueue}
+
+
+def write_outputs(spec: ExperimentSpec, dir_path: str, results: np.ndarray) -> None:
+    """
+    Writes the outputs of an experiment to its directory.
+    :param spec: The experiment.
+    :param dir_path: The directory of the experiment.
+    :param results: The values of the cells, as returned by run_experiment.
+    """
+    axes_names, axes_values = list(spec.axes), list(spec.axes.values())
+    value_names = spec.value_names()
+
+    if NPZ_OUTPUT in spec.outputs:
+        np.savez(os.path.join(dir_path, RESULTS_FILE_NAME), results=results, value_names=np.array(value_names),
+                 **{PARAM_FIELDS[name]: values for name, values in spec.axes.items()})
+    if TABLE_OUTPUT in spec.outputs:
+        save_outcome_table(results, dir_path)
+    if CSV_OUTPUT in spec.outputs:
+        if len(axes_names) != 2:
+            raise ValueError("CSV output requires exactly two swept parameters")
+        for value, value_name in enumerate(value_names):
+            save_heatmap_data(dir_path, axes_values[1], axes_values[0], results[..., value], value_name)
+    if PLOT_OUTPUT in spec.outputs:
+        if len(axes_names) == 2:
+            Plotter.plot_heatmap_subplots(1, len(value_names), [results[..., value] for value in
+                                                                range(len(value_names))],
+                                          [axes_values[1], axes_values[0]], value_names,
+                                          [PARAM_NAMES[axes_names[1]], PARAM_NAMES[axes_names[0]]])
+        elif len(axes_names) == 1:
+            for value, value_name in enumerate(value_names):
+                Plotter.plot_line_plot(axes_values[0], results[:, value], PARAM_NAMES[axes_names[0]], value_name,
+                                       spec.name)
+        else:
+            raise ValueError("Plot output requires one or two swept parameters")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs an experiment described by a JSON or YAML spec.")
+    parser.add_argument("spec", help="The spec file.")
+    parser.add_argument("dir_path", help="The directory in which the directory of the experiment is created.")
+    parser.add_argument("--workers", type=int, default=None, help="The number of worker processes.")
+    parser.add_argument("--chunk-size", type=int, default=None, help="The number of cells in a checkpoint.")
+    parser.add_argument("--shard", default=None, help="Runs only shard i/N of the chunks.")
+    parser.add_argument("--queue", choices=list(QUEUE_TYPES), default=None,
+                        help="Pulls chunks from a work queue in the directory, shared with other nodes.")
+    parser.add_argument("--merge", nargs="+", default=None, metavar="SHARD_DIR",
+                        help="Merges the checkpoints of shards run in these directories and writes the outputs.")
+    args = parser.parse_args()
+
+    spec = load_spec(args.spec)
+    if args.shard is not None:
+        run_shard(spec, args.dir_path, *parse_shard(args.shard), args.workers, args.chunk_size)
+        return
+    if args.queue is not None:
+        run_queue(spec, args.dir_path, QUEUE_TYPES[args.queue], args.chunk_size)
+        return
+    if args.merge is not None:
+        results = merge_shards(spec, args.dir_path, args.merge, args.chunk_size)
+    else:
+        results = run_experiment(spec, args.dir_path, args.workers, args.chunk_size)
+    write_outputs(spec, os.path.join(args.dir_path, spec.name), results)
+
+
+if __name__ == "__main__":
+    main()
+    Plotter.finish_export()
+    print_report()
@@ -9,6 +9,7 @@ from utils.DataSaver import mk_dir_for_heatmap, save_single_run, save_heatmap_da
     mk_heatmap_header, data_extractor
 from utils.Auxiliary import Params, PARAM_NAMES, ParamName
 from utils.Plotter import Plotter
+from utils.Instrumentation import print_report
 import numpy as np
 MIN_FRAC_FOR_WIN = 0.95
 NUM_OF_RUNS = 100
@@ -65,7 +66,7 @@ def run_example_bird_population(dir_path, pandemic_function, model_name):
                     carrying_capacity=CARRYING_CAPACITY)
     colony_birds, lone_birds = logistic_growth_model(params, pandemic_function)
     fig = Plotter.plot_birds_numbers_scatter_plot(colony_birds, lone_birds, model_name)
-    fig.show()
+    Plotter.show(fig, "birds_numbers")
 
 
 def main():
@@ -82,3 +83,5 @@ def main():
 
 if __name__ == "__main__":
     main()
+    Plotter.finish_export()
+    print_report()
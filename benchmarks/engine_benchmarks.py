@@ -0,0 +1,287 @@
+# Benchmarks of the simulation engines. Each workload is timed over a range of sizes (generations, replicates or
+# grid cells), so the results are scaling curves. Run from the repository root:
+#   python -m benchmarks.engine_benchmarks --output results.json --baseline benchmarks/baseline.json
+# The run fails (exit code 1) when the throughput of a workload drops below the baseline by more than the threshold,
+# or when a module of the simulation path loads scipy, pandas, plotly or numba at import.
+# A baseline for the current machine is stored with --save-baseline. Without --baseline the comparison is skipped if
+# there is no baseline at the default path, while a --baseline that doesn't exist is an error (exit code 2).
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, replace
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+from unittest import mock
+import numpy as np
+from utils.Auxiliary import Params, Model, MODEL_NAMES, BirdsPopulations
+from utils.DataSaver import save_single_run
+from utils.Plotter import Plotter
+from discrete_model.logistic_growth_model import logistic_growth_model
+from discrete_model.pandemic_functions import deterministic_pandemic_function, stochastic_at_both_pandemic_function, \
+    MODEL_PANDEMIC_FUNCTIONS
+from Scripts.functions_for_script import run_stochastic_model_average, run_heatmap_pr_df, run_stoch_heatmaps_pr_df
+
+STOCHASTIC_MODELS = (Model.STOCHASTIC1, Model.STOCHASTIC2, Model.STOCHASTIC3)
+BASE_PARAMS = Params(pandemic_rate=1/15, c_death_factor=0.5, selection_coefficient=0.05, l_death_factor=0,
+                     num_of_generations=1000, growth_rate=1.5, init_birds_num=3000, carrying_capacity=10000,
+                     shift_factor=0.1)
+# Sizes of each workload, the full ones and the quick ones (--quick).
+GENERATIONS = (1000, 10000, 100000)
+QUICK_GENERATIONS = (1000, 10000)
+REPLICATES = (10, 100, 1000)
+QUICK_REPLICATES = (10, 100)
+DETER_GRID_SIZES = (10, 50, 200)
+QUICK_DETER_GRID_SIZES = (10, 50)
+STOCH_GRID_SIZES = (5, 10, 20)
+QUICK_STOCH_GRID_SIZES = (5, 10)
+STOCH_HEATMAP_RUNS = 10
+DEFAULT_REPEATS = 5
+DEFAULT_THRESHOLD = 0.2
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+SEED = 0
+# Modules of the simulation path, which must import only numpy of the heavy dependencies.
+CORE_MODULES = ("discrete_model.logistic_growth_model", "discrete_model.ensemble_model", "discrete_model.grid_model",
+                "discrete_model.parallel_sweep", "differential_model.logistic_growth_diff", "utils.Auxiliary")
+# Modules whose import is timed, the core ones and the ones the scripts import.
+IMPORTED_MODULES = CORE_MODULES + ("utils.DataSaver", "utils.Plotter", "Scripts.functions_for_script")
+HEAVY_MODULES = ("scipy", "pandas", "plotly", "numba")
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@dataclass
+class Benchmark:
+    """
+    A workload at a single size.
+    :param name: Unique name of the workload and size.
+    :param function: Runs the workload once.
+    :param work: The number of units of work, for the throughput.
+    :param unit: The unit of work - simulated generations (of all runs and cells), or imports.
+    """
+    name: str
+    function: Callable[[], object]
+    work: int
+    unit: str = "generations"
+
+
+def single_run_benchmarks(generations: Tuple[int, ...]) -> List[Benchmark]:
+    benchmarks = []
+    for model, pandemic_function in MODEL_PANDEMIC_FUNCTIONS.items():
+        for num_of_generations in generations:
+            params = replace(BASE_PARAMS, num_of_generations=num_of_generations)
+            benchmarks.append(Benchmark(f"single_run.{MODEL_NAMES[model]}.generations_{num_of_generations}",
+                                        _single_run(params, pandemic_function), num_of_generations))
+    return benchmarks
+
+
+def stochastic_average_benchmarks(replicates: Tuple[int, ...], dir_path: str) -> List[Benchmark]:
+    benchmarks = []
+    for model in STOCHASTIC_MODELS:
+        for num_of_runs in replicates:
+            benchmarks.append(Benchmark(f"stochastic_model_average.{MODEL_NAMES[model]}.runs_{num_of_runs}",
+                                        _stochastic_average(num_of_runs, model, dir_path),
+                                        num_of_runs * BASE_PARAMS.num_of_generations))
+    return benchmarks
+
+
+def heatmap_benchmarks(deter_grid_sizes: Tuple[int, ...], stoch_grid_sizes: Tuple[int, ...],
+                       dir_path: str) -> List[Benchmark]:
+    benchmarks = []
+    for size in deter_grid_sizes:
+        benchmarks.append(Benchmark(f"heatmap_pr_df.grid_{size}x{size}", _deter_heatmap(size, dir_path),
+                                    size * size * BASE_PARAMS.num_of_generations))
+    for size in stoch_grid_sizes:
+        benchmarks.append(Benchmark(f"stoch_heatmaps_pr_df.grid_{size}x{size}.runs_{STOCH_HEATMAP_RUNS}",
+                                    _stoch_heatmap(size, dir_path),
+                                    size * size * STOCH_HEATMAP_RUNS * BASE_PARAMS.num_of_generations))
+    return benchmarks
+
+
+def save_single_run_benchmarks(generations: Tuple[int, ...], dir_path: str) -> List[Benchmark]:
+    benchmarks = []
+    for num_of_generations in generations:
+        params = replace(BASE_PARAMS, num_of_generations=num_of_generations)
+        populations = BirdsPopulations(*logistic_growth_model(params, deterministic_pandemic_function))
+        benchmarks.append(Benchmark(f"save_single_run.generations_{num_of_generations}",
+                                    _save_run(dir_path, params, populations), num_of_generations))
+    return benchmarks
+
+
+def import_benchmarks() -> List[Benchmark]:
+    """
+    Times the import of each module in a fresh interpreter, as a script or a worker process starts.
+    """
+    return [Benchmark(f"import.{module}", _import_in_subprocess(module), 1, "imports") for module in IMPORTED_MODULES]
+
+
+def heavy_imports(module: str) -> List[str]:
+    """
+    :return: The heavy dependencies that importing the module loads, in a fresh interpreter.
+    """
+    code = f"import sys, json, {module}; print(json.dumps([name for name in {HEAVY_MODULES} if name in sys.modules]))"
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT_DIR, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout)
+
+
+def check_core_imports() -> List[str]:
+    """
+    :return: A description of every core module that loads a heavy dependency at import.
+    """
+    problems = []
+    for module in CORE_MODULES:
+        loaded = heavy_imports(module)
+        if loaded:
+            problems.append(f"import {module} loads {', '.join(loaded)}")
+    return problems
+
+
+def collect_benchmarks(dir_path: str, quick: bool = False) -> List[Benchmark]:
+    """
+    Creates all the workloads.
+    :param dir_path: A directory for the files the workloads write.
+    :param quick: Whether to use only the small sizes.
+    """
+    return (single_run_benchmarks(QUICK_GENERATIONS if quick else GENERATIONS) +
+            stochastic_average_benchmarks(QUICK_REPLICATES if quick else REPLICATES, dir_path) +
+            heatmap_benchmarks(QUICK_DETER_GRID_SIZES if quick else DETER_GRID_SIZES,
+                               QUICK_STOCH_GRID_SIZES if quick else STOCH_GRID_SIZES, dir_path) +
+            save_single_run_benchmarks(QUICK_GENERATIONS if quick else GENERATIONS, dir_path) + import_benchmarks())
+
+
+def time_benchmark(benchmark: Benchmark, repeats: int = DEFAULT_REPEATS) -> Dict[str, float]:
+    """
+    Times a workload. It's run once untimed first (imports, compilation and caches), then 'repeats' times.
+    :return: The minimal and median times in seconds, and the throughput in units of work per second of the
+    minimal time.
+    """
+    benchmark.function()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        benchmark.function()
+        times.append(time.perf_counter() - start)
+    return {"seconds_min": min(times), "seconds_median": float(np.median(times)),
+            "throughput": benchmark.work / min(times), "unit": f"{benchmark.unit}/s", "repeats": repeats}
+
+
+def run_benchmarks(benchmarks: List[Benchmark], repeats: int = DEFAULT_REPEATS) -> Dict:
+    """
+    Times all the workloads.
+    :return: The results, keyed by the workload names, with the metadata of the machine.
+    """
+    results = {}
+    for benchmark in benchmarks:
+        results[benchmark.name] = time_benchmark(benchmark, repeats)
+        print(f"{benchmark.name}: {results[benchmark.name]['seconds_min']:.4f}s "
+              f"({results[benchmark.name]['throughput']:.3g} {results[benchmark.name]['unit']})")
+    return {"metadata": {"date": datetime.now().isoformat(), "python": sys.version.split()[0],
+                         "numpy": np.__version__, "platform": platform.platform(),
+                         "processor": platform.processor()},
+            "results": results}
+
+
+def compare_to_baseline(results: Dict, baseline: Dict, threshold: float = DEFAULT_THRESHOLD) -> List[str]:
+    """
+    Compares the throughputs to the baseline. Workloads missing from one of them are skipped.
+    :param threshold: The allowed relative drop of the throughput.
+    :return: A description of every workload whose throughput dropped by more than the threshold.
+    """
+    regressions = []
+    for name, result in results["results"].items():
+        if name not in baseline["results"]:
+            continue
+        baseline_throughput = baseline["results"][name]["throughput"]
+        ratio = result["throughput"] / baseline_throughput
+        if ratio < 1 - threshold:
+            regressions.append(f"{name}: {result['throughput']:.3g} {result['unit']}, "
+                               f"{100 * (1 - ratio):.0f}% slower than the baseline ({baseline_throughput:.3g})")
+    return regressions
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks of the simulation engines.")
+    parser.add_argument("--output", help="A JSON file for the results.")
+    parser.add_argument("--baseline", default=None,
+                        help=f"The baseline JSON file to compare to, required to exist if given. Defaults to "
+                             f"{DEFAULT_BASELINE}, if it exists.")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the baseline.")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="The allowed relative drop of the throughput.")
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS)
+    parser.add_argument("--quick", action="store_true", help="Run only the small sizes.")
+    parser.add_argument("--filter", default="", help="Run only the workloads whose names contain this string.")
+    args = parser.parse_args(argv)
+    baseline_path = DEFAULT_BASELINE if args.baseline is None else args.baseline
+    if args.baseline is not None and not args.save_baseline and not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, store one with --save-baseline.")
+        return 2
+
+    with tempfile.TemporaryDirectory() as dir_path:
+        benchmarks = [benchmark for benchmark in collect_benchmarks(dir_path, args.quick)
+                      if args.filter in benchmark.name]
+        results = run_benchmarks(benchmarks, args.repeats)
+    import_problems = check_core_imports()
+    for problem in import_problems:
+        print(f"HEAVY IMPORT {problem}")
+
+    if args.output:
+        _write_json(args.output, results)
+    if args.save_baseline:
+        _write_json(baseline_path, results)
+        return 1 if import_problems else 0
+    if not os.path.exists(baseline_path):
+        print(f"No baseline at {baseline_path}, skipping the comparison.")
+        return 1 if import_problems else 0
+    with open(baseline_path) as f:
+        regressions = compare_to_baseline(results, json.load(f), args.threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions or import_problems else 0
+
+
+def _single_run(params: Params, pandemic_function: Callable) -> Callable[[], object]:
+    return lambda: logistic_growth_model(params, pandemic_function, np.random.default_rng(SEED))
+
+
+def _stochastic_average(num_of_runs: int, model: Model, dir_path: str) -> Callable[[], object]:
+    return lambda: run_stochastic_model_average(num_of_runs, MODEL_PANDEMIC_FUNCTIONS[model], MODEL_NAMES[model],
+                                                BASE_PARAMS, dir_path, np.random.default_rng(SEED))
+
+
+def _deter_heatmap(size: int, dir_path: str) -> Callable[[], object]:
+    def run():
+        # The figures are not shown, only the simulations are measured
+        with mock.patch.object(Plotter, "plot_heatmap"):
+            run_heatmap_pr_df(dir_path, np.linspace(0.01, 0.5, size), np.linspace(0, 1, size), BASE_PARAMS,
+                              deterministic_pandemic_function)
+    return run
+
+
+def _stoch_heatmap(size: int, dir_path: str) -> Callable[[], object]:
+    def run():
+        with mock.patch.object(Plotter, "plot_heatmap_subplots"):
+            run_stoch_heatmaps_pr_df(STOCH_HEATMAP_RUNS, stochastic_at_both_pandemic_function,
+                                     MODEL_NAMES[Model.STOCHASTIC3], np.linspace(0.01, 0.5, size),
+                                     np.linspace(0, 1, size), BASE_PARAMS, dir_path, seed=SEED, num_of_workers=1)
+    return run
+
+
+def _save_run(dir_path: str, params: Params, populations: BirdsPopulations) -> Callable[[], object]:
+    return lambda: save_single_run(dir_path, params, populations, MODEL_NAMES[Model.DETER])
+
+
+def _import_in_subprocess(module: str) -> Callable[[], object]:
+    return lambda: subprocess.run([sys.executable, "-c", f"import {module}"], cwd=ROOT_DIR, check=True)
+
+
+def _write_json(file_path: str, results: Dict) -> None:
+    with open(file_path, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1 @@
+# Makes the packages of the repository importable by the tests, when pytest is run from any directory.
@@ -0,0 +1,316 @@
+import numpy as np
+from dataclasses import dataclass
+from utils.Auxiliary import Params, ParamBatch, batch_params
+from typing import Callable, Tuple, Union
+from discrete_model.logistic_growth_model import EXTINCTION_THRESHOLD
+from discrete_model.pandemic_functions import DETERMINISTIC_PANDEMIC_FUNCTIONS, TYPE_SHIFT_PANDEMIC_FUNCTIONS
+from discrete_model.pandemic_schedule import PandemicSchedule, schedule_for, generate_pandemic_schedule
+from utils.Instrumentation import timed, count, SIMULATION, GENERATIONS
+
+RTOL = 1e-6
+ATOL = 1e-6
+# Step size control
+SAFETY, MIN_FACTOR, MAX_FACTOR = 0.9, 0.2, 10.
+ERROR_EXPONENT = -1 / 5
+# The number of bisections that locate an extinction threshold crossing inside a step
+EVENT_BISECTIONS = 40
+
+# The Dormand-Prince 5(4) pair, with the error coefficients and the dense output polynomials of scipy's RK45
+A = [np.array([]),
+     np.array([1 / 5]),
+     np.array([3 / 40, 9 / 40]),
+     np.array([44 / 45, -56 / 15, 32 / 9]),
+     np.array([19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729]),
+     np.array([9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656])]
+B = np.array([35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84])
+E = np.array([-71 / 57600, 0, 71 / 16695, -71 / 1920, 17253 / 339200, -22 / 525, 1 / 40])
+P = np.array([[1, -8048581381 / 2820520608, 8663915743 / 2820520608, -12715105075 / 11282082432],
+              [0, 0, 0, 0],
+              [0, 131558114200 / 32700410799, -68118460800 / 10900136933, 87487479700 / 32700410799],
+              [0, -1754552775 / 470086768, 14199869525 / 1410260304, -10690763975 / 1880347072],
+              [0, 127303824393 / 49829197408, -318862633887 / 49829197408, 701980252875 / 199316789632],
+              [0, -282668133 / 205662961, 2019193451 / 616988883, -1453857185 / 822651844],
+              [0, 40617522 / 29380423, -110615467 / 29380423, 69997945 / 29380423]])
+
+
+@dataclass
+class OdeSolution:
+    """
+    A dataclass that contains the result of the adaptive integration of a batch of runs.
+    colony_birds and lone_birds are of shape (num_of_runs, times.size). An extinction time is NaN if the population
+    didn't go extinct.
+    """
+    times: np.ndarray
+    colony_birds: np.ndarray
+    lone_birds: np.ndarray
+    colony_extinction_time: np.ndarray
+    lone_extinction_time: np.ndarray
+    num_of_steps: np.ndarray
+
+
+@timed(SIMULATION)
+def logistic_growth_ode(params: Params, pandemic_function: Callable, rtol: float = RTOL, atol: float = ATOL,
+                        rng: np.random.Generator = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Integrates the continuous colony / lone birds system of a single run with an adaptive Runge-Kutta method, see
+    ensemble_logistic_growth_ode.
+    :return colony_birds, lone_birds - Numpy arrays of the population of colony and lone birds at each generation,
+    like the ones of logistic_growth_model.
+    """
+    solution = ensemble_logistic_growth_ode(params, pandemic_function, 1, rng, rtol=rtol, atol=atol)
+    return solution.colony_birds[0], solution.lone_birds[0]
+
+
+@timed(SIMULATION)
+def ensemble_logistic_growth_ode(params: Union[Params, ParamBatch], pandemic_function: Callable,
+                                 num_of_runs: int = 1, rng: np.random.Generator = None, times: np.ndarray = None,
+                                 rtol: float = RTOL, atol: float = ATOL, max_step: float = np.inf) -> OdeSolution:
+    """
+    Integrates the continuous limit of the model equations,
+        dN/dt = growth_rate * N * (carrying_capacity - N) / carrying_capacity, with N = colony + lone,
+        d(colony fraction)/dt = selection_coefficient * colony fraction * (1 - colony fraction),
+    for a batch of runs at once, with the Dormand-Prince 5(4) method. Every run adapts its own step size to the
+    tolerances. Pandemics are impulses that multiply the populations by their survival factors at the generations
+    they hit - the steps end exactly at the pandemics of their run, so a step never straddles one. A population that
+    falls below the extinction threshold is set to 0 at the time of the crossing, located inside the step with the
+    dense output.
+    :param params: A dataclass containing all the relevant parameters, scalars or arrays with one value per run, or a
+    ParamBatch (num_of_runs runs of each of its parameter sets).
+    :param pandemic_function: The deterministic or a stochastic pandemic function (or their batched versions). The
+    pandemics of the stochastic ones are sampled in advance.
+    :param num_of_runs: The number of runs.
+    :param rng: Random generator for the stochastic pandemic functions. A fresh one is created if not given.
+    :param times: The increasing times at which the populations are returned, starting with the time of the initial
+    populations. Defaults to the generations 0, ..., num_of_generations - 1.
+    :param rtol: The relative tolerance of the local error.
+    :param atol: The absolute tolerance of the local error, in birds.
+    :param max_step: The maximal step size.
+    :return: The populations of every run at 'times', the extinction times and the number of steps of every run.
+    """
+    params, num_of_runs = batch_params(params, num_of_runs)
+    times = np.arange(params.num_of_generations, dtype=float) if times is None else np.asarray(times, dtype=float)
+    schedule = _pandemic_schedule(pandemic_function, params, num_of_runs, rng)
+    count(GENERATIONS, num_of_runs * params.num_of_generations)
+
+    growth_rate, carrying_capacity, selection_coefficient = (np.broadcast_to(np.asarray(value, dtype=float),
+                                                                             num_of_runs).copy()
+                                                             for value in (params.growth_rate,
+                                                                           params.carrying_capacity,
+                                                                           params.selection_coefficient))
+    extinction_level = carrying_capacity * EXTINCTION_THRESHOLD
+    impulse_times = _next_impulse_times(schedule, num_of_runs)
+    end_time = times[-1]
+
+    t = np.full(num_of_runs, times[0])
+    y = np.empty((num_of_runs, 2))
+    y[:] = np.broadcast_to(np.asarray(params.init_birds_num, dtype=float), num_of_runs)[:, None]
+    extinction_times = np.full((num_of_runs, 2), np.nan)
+    _apply_extinction(y, t, extinction_level, extinction_times, np.ones(num_of_runs, dtype=bool))
+    results = np.empty((num_of_runs, times.size, 2))
+    next_output = np.zeros(num_of_runs, dtype=int)
+    num_of_steps = np.zeros(num_of_runs, dtype=int)
+    rhs_args = (growth_rate, carrying_capacity, selection_coefficient)
+    f = _rhs(y, *rhs_args)
+    h = _initial_step(y, f, rtol, atol, max_step)
+
+    active = np.ones(num_of_runs, dtype=bool)
+    _write_outputs(results, times, next_output, active, t, y)
+    active &= t < end_time
+    while np.any(active):
+        runs = np.flatnonzero(active)
+        run_args = tuple(value[runs] for value in rhs_args)
+        t_run, y_run, f_run = t[runs], y[runs], f[runs]
+        next_impulse = _next_impulse(impulse_times, runs, t_run)
+        target = np.minimum(next_impulse, end_time)
+        step = np.minimum(h[runs], target - t_run)
+        reaches_target = step == target - t_run
+
+        stages = _stages(y_run, f_run, step, run_args)
+        y_new = y_run + step[:, None] * np.einsum('rsk,s->rk', stages[:, :6], B)
+        stages[:, 6] = _rhs(y_new, *run_args)
+        error = step[:, None] * np.einsum('rsk,s->rk', stages, E)
+        scale = atol + rtol * np.maximum(np.abs(y_run), np.abs(y_new))
+        error_norm = np.sqrt(np.mean((error / scale) ** 2, axis=1))
+        accepted = error_norm <= 1
+        with np.errstate(divide='ignore'):
+            factor = np.clip(SAFETY * error_norm ** ERROR_EXPONENT, MIN_FACTOR, MAX_FACTOR)
+        h[runs] = np.minimum(step * np.where(accepted, factor, np.minimum(factor, 1)), max_step)
+        if not np.any(accepted):
+            continue
+
+        runs, t_run, y_run, y_new, step, stages = runs[accepted], t_run[accepted], y_run[accepted], \
+            y_new[accepted], step[accepted], stages[accepted]
+        target, next_impulse, reaches_target = target[accepted], next_impulse[accepted], reaches_target[accepted]
+        num_of_steps[runs] += 1
+        # Extinction events end the step at the threshold crossing
+        fraction = _extinction_fractions(y_run, y_new, stages, step, extinction_level[runs])
+        crossed = fraction < 1
+        t_new = np.where(crossed, t_run + fraction * step, np.where(reaches_target, target, t_run + step))
+        y_new[crossed] = _dense_output(y_run[crossed], stages[crossed], step[crossed], fraction[crossed])
+
+        _write_dense_outputs(results, times, next_output, runs, t_run, y_run, stages, step, t_new)
+        t[runs], y[runs] = t_new, y_new
+        impulse = ~crossed & reaches_target & (target == next_impulse)
+        _apply_impulses(y, runs[impulse], t_new[impulse], schedule)
+        ended = np.zeros(num_of_runs, dtype=bool)
+        ended[runs] = True
+        _apply_extinction(y, t, extinction_level, extinction_times, ended)
+        f[runs] = _rhs(y[runs], *(value[runs] for value in rhs_args))
+        _write_outputs(results, times, next_output, ended, t, y)
+        active &= t < end_time
+
+    return OdeSolution(times, results[..., 0], results[..., 1], extinction_times[:, 0], extinction_times[:, 1],
+                       num_of_steps)
+
+
+def _rhs(y: np.ndarray, growth_rate: np.ndarray, carrying_capacity: np.ndarray,
+         selection_coefficient: np.ndarray) -> np.ndarray:
+    """
+    The derivatives of the colony and lone birds populations. Both extinct states are invariant.
+    """
+    colony_birds, lone_birds = y[:, 0], y[:, 1]
+    n_total = colony_birds + lone_birds
+    growth = growth_rate * (carrying_capacity - n_total) / carrying_capacity
+    with np.errstate(divide='ignore', invalid='ignore'):
+        selection = np.where(n_total > 0, selection_coefficient * colony_birds * lone_birds / n_total, 0.)
+    return np.stack([colony_birds * growth + selection, lone_birds * growth - selection], axis=1)
+
+
+def _stages(y: np.ndarray, f: np.ndarray, step: np.ndarray, rhs_args: Tuple) -> np.ndarray:
+    """
+    Calculates the Runge-Kutta stages of a step. The last stage, the derivative at the end of the step, is left to
+    the caller.
+    :return: An array of shape (runs, 7, 2).
+    """
+    stages = np.empty((y.shape[0], 7, 2))
+    stages[:, 0] = f
+    for stage in range(1, 6):
+        y_stage = y + step[:, None] * np.einsum('rsk,s->rk', stages[:, :stage], A[stage])
+        stages[:, stage] = _rhs(y_stage, *rhs_args)
+    return stages
+
+
+def _dense_output(y: np.ndarray, stages: np.ndarray, step: np.ndarray, fraction: np.ndarray) -> np.ndarray:
+    """
+    Interpolates the populations inside steps, at the given fractions of the steps.
+    """
+    fraction = np.asarray(fraction, dtype=float)
+    powers = np.cumprod(np.repeat(fraction[..., None], 4, axis=-1), axis=-1)
+    return y + step[:, None] * np.einsum('rsk,sp,rp->rk', stages, P, powers)
+
+
+def _extinction_fractions(y: np.ndarray, y_new: np.ndarray, stages: np.ndarray, step: np.ndarray,
+                          extinction_level: np.ndarray) -> np.ndarray:
+    """
+    Locates the first crossing of the extinction threshold by either population in each step, by bisection of the
+    dense output between the step ends.
+    :return: The fraction of each step at which a population crosses the threshold, 1 if none does.
+    """
+    fractions = np.ones(y.shape[0])
+    crossing = (y > 0) & (y_new < extinction_level[:, None])
+    runs = np.flatnonzero(np.any(crossing, axis=1))
+    if runs.size == 0:
+        return fractions
+    low, high = np.zeros(runs.size), np.ones(runs.size)
+    for _ in range(EVENT_BISECTIONS):
+        middle = (low + high) / 2
+        below = np.any(crossing[runs] & (_dense_output(y[runs], stages[runs], step[runs], middle) <
+                                         extinction_level[runs, None]), axis=1)
+        high, low = np.where(below, middle, high), np.where(below, low, middle)
+    fractions[runs] = high
+    return fractions
+
+
+def _apply_extinction(y: np.ndarray, t: np.ndarray, extinction_level: np.ndarray, extinction_times: np.ndarray,
+                      runs: np.ndarray) -> None:
+    """
+    Sets the populations of the given runs that are below the extinction threshold to 0, recording the time.
+    """
+    extinct = runs[:, None] & (y > 0) & (y < extinction_level[:, None])
+    y[extinct] = 0.
+    extinction_times[extinct & np.isnan(extinction_times)] = np.broadcast_to(t[:, None], y.shape)[
+        extinct & np.isnan(extinction_times)]
+
+
+def _initial_step(y: np.ndarray, f: np.ndarray, rtol: float, atol: float, max_step: float) -> np.ndarray:
+    """
+    A first guess of the step size of every run, from the scale of the populations and their derivatives.
+    """
+    scale = atol + rtol * np.abs(y)
+    d0 = np.sqrt(np.mean((y / scale) ** 2, axis=1))
+    d1 = np.sqrt(np.mean((f / scale) ** 2, axis=1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        step = np.where((d0 < 1e-5) | (d1 < 1e-5), 1e-6, 0.01 * d0 / d1)
+    return np.minimum(step, max_step)
+
+
+def _pandemic_schedule(pandemic_function: Callable, params: Params, num_of_runs: int,
+                       rng: np.random.Generator) -> PandemicSchedule:
+    schedule = schedule_for(pandemic_function, params, num_of_runs, rng)
+    if schedule is None and pandemic_function in DETERMINISTIC_PANDEMIC_FUNCTIONS:
+        schedule = generate_pandemic_schedule(params, num_of_runs, False, False, rng)
+        schedule.type_shift = pandemic_function in TYPE_SHIFT_PANDEMIC_FUNCTIONS
+    if schedule is None or schedule.type_shift:
+        raise ValueError(f"{pandemic_function.__name__} has no pandemic schedule for the adaptive integrator")
+    return schedule
+
+
+def _next_impulse_times(schedule: PandemicSchedule, num_of_runs: int) -> np.ndarray:
+    """
+    :return: For every run and generation g, the first generation >= g with a pandemic, or infinity.
+    """
+    hit = (schedule.colony_survival != 1) | (schedule.lone_survival != 1)
+    hit = np.broadcast_to(hit, (num_of_runs, hit.shape[-1]))
+    generations = np.where(hit, np.arange(hit.shape[-1], dtype=float), np.inf)
+    return np.minimum.accumulate(generations[:, ::-1], axis=1)[:, ::-1]
+
+
+def _next_impulse(impulse_times: np.ndarray, runs: np.ndarray, t: np.ndarray) -> np.ndarray:
+    """
+    :return: The time of the first pandemic after t of each run.
+    """
+    generation = np.floor(t).astype(int) + 1
+    inside = generation < impulse_times.shape[1]
+    next_times = np.full(t.shape, np.inf)
+    next_times[inside] = impulse_times[runs[inside], generation[inside]]
+    return next_times
+
+
+def _apply_impulses(y: np.ndarray, runs: np.ndarray, t: np.ndarray, schedule: PandemicSchedule) -> None:
+    generations = t.astype(int)
+    y[runs, 0] *= schedule.colony_survival[runs, generations]
+    y[runs, 1] *= schedule.lone_survival[runs, generations]
+
+
+def _write_outputs(results: np.ndarray, times: np.ndarray, next_output: np.ndarray, runs: np.ndarray,
+                   t: np.ndarray, y: np.ndarray) -> None:
+    """
+    Writes the current populations of the given runs (a mask) at the output times equal to their current time.
+    """
+    pending = runs & (next_output < times.size)
+    pending[pending] = times[next_output[pending]] <= t[pending]
+    while np.any(pending):
+        indices = np.flatnonzero(pending)
+        results[indices, next_output[indices]] = y[indices]
+        next_output[indices] += 1
+        pending[indices] = (next_output[indices] < times.size)
+        pending[indices] &= times[np.minimum(next_output[indices], times.size - 1)] <= t[indices]
+
+
+def _write_dense_outputs(results: np.ndarray, times: np.ndarray, next_output: np.ndarray, runs: np.ndarray,
+                         t: np.ndarray, y: np.ndarray, stages: np.ndarray, step: np.ndarray,
+                         t_new: np.ndarray) -> None:
+    """
+    Writes the populations at the output times strictly inside the steps of the given runs, from the dense output.
+    """
+    pending = (next_output[runs] < times.size)
+    pending[pending] = times[next_output[runs[pending]]] < t_new[pending]
+    while np.any(pending):
+        indices = np.flatnonzero(pending)
+        output = next_output[runs[indices]]
+        results[runs[indices], output] = _dense_output(y[indices], stages[indices], step[indices],
+                                                       (times[output] - t[indices]) / step[indices])
+        next_output[runs[indices]] += 1
+        output = next_output[runs[indices]]
+        pending[indices] = (output < times.size)
+        pending[indices] &= times[np.minimum(output, times.size - 1)] < t_new[indices]
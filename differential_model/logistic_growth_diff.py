@@ -2,12 +2,23 @@ import numpy as np
 from utils.Auxiliary import Params
 from typing import Callable, Tuple
 from discrete_model.logistic_growth_model import run_single_iteration
+from discrete_model.convergence import convergence_period, find_repeating_period, fill_converged
 
 DT = 1
 
 
-def logistic_growth_diff(params: Params, pandemic_function: Callable) -> Tuple[np.ndarray, np.ndarray]:
-
+def logistic_growth_diff(params: Params, pandemic_function: Callable,
+                         detect_convergence: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Integrates the differential model with steps of DT. Applies the pandemic function after each step.
+    :param params - A dataclass containing all the relevant parameters.
+    :param pandemic_function - A function that calculates whether a pandemic hits, and the losses from the pandemic.
+    :param detect_convergence - Whether to stop integrating once both populations went extinct, or once a
+    deterministic trajectory reached a fixed point or a periodic orbit. The rest of the steps are then filled
+    by repeating the converged trajectory.
+    :return colony_birds, lone_birds - Numpy arrays of the population of colony and lone birds in each step.
+    """
+    period = convergence_period(pandemic_function, params)
     steps = int(params.num_of_generations // DT)
     colony_birds, lone_birds = np.empty(steps), np.empty(steps)
     colony_birds[0], lone_birds[0] = params.init_birds_num, params.init_birds_num
@@ -22,6 +33,12 @@ def logistic_growth_diff(params: Params, pandemic_function: Callable) -> Tuple[n
         if lone_birds[i] < params.carrying_capacity * 0.001:
             lone_birds[i] = 0
 
+        if detect_convergence:
+            repeating_period = find_repeating_period(colony_birds, lone_birds, i, period, params)
+            if repeating_period is not None:
+                fill_converged(colony_birds, lone_birds, i, repeating_period)
+                break
+
     return colony_birds, lone_birds
 
 
@@ -0,0 +1,125 @@
+import numpy as np
+from dataclasses import dataclass, replace
+from utils.Auxiliary import Params
+from typing import Callable, Dict, List, Tuple
+from discrete_model.ensemble_model import reduce_ensemble, ensemble_outcome_fractions, classify_colony_fraction, \
+    LAST_GENERATIONS
+from discrete_model.reducers import TrailingMean
+
+DEFAULT_MAX_LEVEL = 4
+
+
+@dataclass
+class QuadtreeHeatmap:
+    """
+    The result of an adaptive heatmap sweep. The points lie on a fine lattice that refines the coarse axes
+    'max_level' times - lattice point (i, j) is (pandemic_rates[i], death_factors[j]). Only some of the points were
+    evaluated. Each cell is (i, j, size) - the lattice square between (i, j) and (i + size, j + size).
+    """
+    pandemic_rates: np.ndarray
+    death_factors: np.ndarray
+    values: Dict[Tuple[int, int], float]
+    classes: Dict[Tuple[int, int], int]
+    cells: List[Tuple[int, int, int]]
+
+    def rasterize(self) -> np.ndarray:
+        """
+        Converts the sparse cells to a dense matrix over the lattice, for Plotter.plot_heatmap. Points inside a cell
+        that weren't evaluated are bilinearly interpolated from its corners.
+        :return: A matrix of shape (pandemic_rates.size, death_factors.size).
+        """
+        mat = np.empty((self.pandemic_rates.size, self.death_factors.size))
+        for i, j, size in self.cells:
+            weights = np.linspace(0, 1, size + 1)
+            rows, cols = weights[:, None], weights[None, :]
+            mat[i:i + size + 1, j:j + size + 1] = \
+                (self.values[i, j] * (1 - rows) * (1 - cols) + self.values[i + size, j] * rows * (1 - cols) +
+                 self.values[i, j + size] * (1 - rows) * cols + self.values[i + size, j + size] * rows * cols)
+        for (i, j), value in self.values.items():
+            mat[i, j] = value
+        return mat
+
+
+def adaptive_heatmap(evaluate: Callable, pandemic_rates: np.ndarray, death_factors: np.ndarray,
+                     max_level: int = DEFAULT_MAX_LEVEL) -> QuadtreeHeatmap:
+    """
+    Sweeps (pandemic rate, colony death factor) adaptively. Starts from the coarse grid of the given axes, then
+    recursively splits into four only the cells whose corners disagree on the outcome class, so that the resolution
+    is high only around the phase boundaries. Regions smaller than a coarse cell whose corners all agree are missed.
+    :param evaluate: Gets arrays of pandemic rates and death factors, and returns the value and outcome class of
+    each point, e.g. deterministic_point_evaluator or stochastic_point_evaluator.
+    :param pandemic_rates: The coarse pandemic rate values.
+    :param death_factors: The coarse colony death factor values.
+    :param max_level: The maximal number of times a coarse cell is split.
+    :return: The evaluated points and the leaf cells.
+    """
+    step = 2 ** max_level
+    fine_rates, fine_factors = _refine_axis(pandemic_rates, max_level), _refine_axis(death_factors, max_level)
+    values, classes = {}, {}
+
+    def evaluate_points(points):
+        points = sorted(set(points) - values.keys())
+        if points:
+            rows, cols = np.array(points).T
+            point_values, point_classes = evaluate(fine_rates[rows], fine_factors[cols])
+            values.update(zip(points, np.asarray(point_values, dtype=float)))
+            classes.update(zip(points, np.asarray(point_classes).tolist()))
+
+    cells = [(i * step, j * step, step) for i in range(pandemic_rates.size - 1) for j in range(death_factors.size - 1)]
+    leaves = []
+    while cells:
+        evaluate_points(corner for cell in cells for corner in _corners(cell))
+        to_split = []
+        for cell in cells:
+            uniform = len({classes[corner] for corner in _corners(cell)}) == 1
+            (leaves if uniform or cell[2] == 1 else to_split).append(cell)
+        cells = [(i + di, j + dj, size // 2) for i, j, size in to_split
+                 for di in (0, size // 2) for dj in (0, size // 2)]
+
+    return QuadtreeHeatmap(fine_rates, fine_factors, values, classes, leaves)
+
+
+def deterministic_point_evaluator(params: Params, pandemic_function: Callable,
+                                  window: int = LAST_GENERATIONS) -> Callable:
+    """
+    Returns an evaluator for adaptive_heatmap that runs all the points of a refinement level together. The value
+    of a point is the average fraction of colony birds in the last 'window' generations.
+    """
+    def evaluate(pandemic_rates: np.ndarray, death_factors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        points_params = replace(params, pandemic_rate=pandemic_rates, c_death_factor=death_factors)
+        avg_fracs, = reduce_ensemble(points_params, pandemic_function, [TrailingMean(window)], pandemic_rates.size)
+        return avg_fracs, classify_colony_fraction(avg_fracs)
+
+    return evaluate
+
+
+def stochastic_point_evaluator(params: Params, pandemic_function: Callable, num_of_runs: int,
+                               seed: int = 0) -> Callable:
+    """
+    Returns an evaluator for adaptive_heatmap that runs 'num_of_runs' replicates at each point. The value of a point
+    is the fraction of colony wins, and its class is the most frequent outcome. The random stream of each point is
+    determined by the seed and the point, so a point gets the same result in every sweep.
+    """
+    def evaluate(pandemic_rates: np.ndarray, death_factors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        fractions = np.array([ensemble_outcome_fractions(
+            replace(params, pandemic_rate=rate, c_death_factor=factor), pandemic_function, num_of_runs,
+            np.random.default_rng([seed, *np.array([rate, factor], dtype=np.float64).view(np.uint64).tolist()]))
+            for rate, factor in zip(pandemic_rates, death_factors)])
+        return fractions[:, 0], np.argmax(fractions, axis=1)
+
+    return evaluate
+
+
+def _refine_axis(axis: np.ndarray, max_level: int) -> np.ndarray:
+    """
+    Inserts 2 ** max_level - 1 evenly spaced values between each two consecutive values of the axis.
+    """
+    axis = np.asarray(axis, dtype=float)
+    weights = np.linspace(0, 1, 2 ** max_level + 1)[:-1]
+    fine_axis = (axis[:-1, None] * (1 - weights) + axis[1:, None] * weights).ravel()
+    return np.append(fine_axis, axis[-1])
+
+
+def _corners(cell: Tuple[int, int, int]) -> List[Tuple[int, int]]:
+    i, j, size = cell
+    return [(i, j), (i + size, j), (i, j + size), (i + size, j + size)]
@@ -0,0 +1,84 @@
+import numpy as np
+from statistics import NormalDist
+from utils.Auxiliary import Params
+from typing import Callable, Tuple
+from discrete_model.ensemble_model import ensemble_outcome_counts, LAST_GENERATIONS
+
+WILSON, CLOPPER_PEARSON = "wilson", "clopper_pearson"
+DEFAULT_CONFIDENCE = 0.95
+DEFAULT_BATCH_SIZE = 20
+DEFAULT_MAX_RUNS = 1000
+
+
+def wilson_interval(successes, num_of_runs, confidence: float = DEFAULT_CONFIDENCE) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calculates the Wilson score interval of a binomial proportion.
+    :param successes: The number of successes, a scalar or an array.
+    :param num_of_runs: The number of trials.
+    :param confidence: The confidence level of the interval.
+    :return: The lower and upper bounds of the interval.
+    """
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    proportion = np.asarray(successes) / num_of_runs
+    denominator = 1 + z ** 2 / num_of_runs
+    center = (proportion + z ** 2 / (2 * num_of_runs)) / denominator
+    spread = np.sqrt(proportion * (1 - proportion) / num_of_runs + z ** 2 / (4 * num_of_runs ** 2))
+    half_width = z * spread / denominator
+    return center - half_width, center + half_width
+
+
+def clopper_pearson_interval(successes, num_of_runs,
+                             confidence: float = DEFAULT_CONFIDENCE) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calculates the exact Clopper-Pearson interval of a binomial proportion.
+    :param successes: The number of successes, a scalar or an array.
+    :param num_of_runs: The number of trials.
+    :param confidence: The confidence level of the interval.
+    :return: The lower and upper bounds of the interval.
+    """
+    from scipy.stats import beta
+
+    successes = np.asarray(successes)
+    alpha = 1 - confidence
+    with np.errstate(invalid='ignore'):
+        lower = np.where(successes == 0, 0., beta.ppf(alpha / 2, successes, num_of_runs - successes + 1))
+        upper = np.where(successes == num_of_runs, 1., beta.ppf(1 - alpha / 2, successes + 1, num_of_runs - successes))
+    return lower, upper
+
+
+INTERVALS = {WILSON: wilson_interval, CLOPPER_PEARSON: clopper_pearson_interval}
+
+
+def adaptive_outcome_fractions(params: Params, pandemic_function: Callable, target_width: float,
+                               rng: np.random.Generator = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                               max_runs: int = DEFAULT_MAX_RUNS, method: str = WILSON,
+                               confidence: float = DEFAULT_CONFIDENCE,
+                               window: int = LAST_GENERATIONS) -> Tuple[float, float, float, int]:
+    """
+    Runs replicates in batches until the confidence intervals of the fractions of colony wins, lone wins and
+    coexistence are all narrower than 'target_width', or until 'max_runs' replicates were run.
+    :param params: A dataclass containing all the relevant parameters.
+    :param pandemic_function: A pandemic function from pandemic_functions.py, or its batched version.
+    :param target_width: The maximal width of the confidence intervals.
+    :param rng: Random generator for the stochastic pandemic functions. A fresh one is created if not given.
+    :param batch_size: The number of replicates run at once.
+    :param max_runs: The maximal number of replicates.
+    :param method: WILSON or CLOPPER_PEARSON.
+    :param confidence: The confidence level of the intervals.
+    :param window: The number of last generations over which the fraction of colony birds is averaged.
+    :return: The fractions of colony wins, lone wins and coexistence, and the number of replicates that were run.
+    """
+    interval = INTERVALS[method]
+    rng = np.random.default_rng() if rng is None else rng
+    counts, num_of_runs = np.zeros(3, dtype=int), 0
+
+    while num_of_runs < max_runs:
+        runs_in_batch = min(batch_size, max_runs - num_of_runs)
+        counts += ensemble_outcome_counts(params, pandemic_function, runs_in_batch, rng, window)
+        num_of_runs += runs_in_batch
+        lower, upper = interval(counts, num_of_runs, confidence)
+        if np.max(upper - lower) < target_width:
+            break
+
+    colony_frac, lone_frac, coexist_frac = counts / num_of_runs
+    return colony_frac, lone_frac, coexist_frac, num_of_runs
@@ -0,0 +1,59 @@
+import numpy as np
+from dataclasses import replace
+from utils.Auxiliary import Params
+from typing import Callable
+from discrete_model.ensemble_model import reduce_ensemble, classify_colony_fraction, COLONY_WIN, LAST_GENERATIONS
+from discrete_model.reducers import TrailingMean
+
+DEFAULT_TOLERANCE = 1e-3
+# For stochastic models, the colony birds are considered winning while they win in at least this fraction of runs.
+DEFAULT_WIN_PROBABILITY = 0.5
+
+
+def critical_death_factors(params: Params, pandemic_function: Callable, pandemic_rates: np.ndarray,
+                           low: float = 0., high: float = 1., tolerance: float = DEFAULT_TOLERANCE,
+                           num_of_runs: int = 1, seed: int = None,
+                           win_probability: float = DEFAULT_WIN_PROBABILITY,
+                           window: int = LAST_GENERATIONS) -> np.ndarray:
+    """
+    Finds, for each pandemic rate, the critical colony death factor above which the colony birds stop winning.
+    Bisects all the pandemic rates together, so each bisection step is a single batched simulation. The outcome is
+    a class rather than a continuous value, so bisection is used rather than a higher order root finder.
+    For stochastic models the win probability is estimated from num_of_runs runs, so it's noisy and not necessarily
+    monotonic in the death factor - a bisection step may land on the wrong side of the crossing and bracket another
+    crossing of the estimate, or one that isn't there. More runs make that less likely, but don't rule it out.
+    :param params: The rest of the parameters.
+    :param pandemic_function: The model pandemic function.
+    :param pandemic_rates: The pandemic rates.
+    :param low: A colony death factor at which the colony birds win.
+    :param high: A colony death factor at which they don't.
+    :param tolerance: The width of the final bracket of the critical death factor.
+    :param num_of_runs: The number of runs at each death factor, for stochastic models.
+    :param seed: Seed for the stochastic models. Every bisection step starts from a generator seeded with it, but the
+    runs don't get common random numbers: the number of draws of a pandemic depends on the death factors (rejected
+    survival factors are redrawn), and all the pandemic rates share the generator, so the streams of the runs differ
+    between the steps.
+    :param win_probability: The minimal fraction of runs the colony birds should win for them to be considered winning.
+    :param window: The number of last generations over which the fraction of colony birds is averaged.
+    :return: The critical death factor of each pandemic rate, NaN where the colony birds don't win at 'low' or still
+    win at 'high'.
+    """
+    pandemic_rates = np.asarray(pandemic_rates, dtype=float)
+    seed = np.random.SeedSequence(seed).entropy if seed is None else seed
+
+    def colony_wins(death_factors: np.ndarray) -> np.ndarray:
+        points_params = replace(params, pandemic_rate=np.repeat(pandemic_rates, num_of_runs),
+                                c_death_factor=np.repeat(death_factors, num_of_runs))
+        avg_fracs, = reduce_ensemble(points_params, pandemic_function, [TrailingMean(window)],
+                                     pandemic_rates.size * num_of_runs, np.random.default_rng(seed))
+        wins = (classify_colony_fraction(avg_fracs) == COLONY_WIN).reshape(pandemic_rates.size, num_of_runs)
+        return np.mean(wins, axis=1) >= win_probability
+
+    lows, highs = np.full(pandemic_rates.size, float(low)), np.full(pandemic_rates.size, float(high))
+    bracketed = colony_wins(lows) & ~colony_wins(highs)
+    while np.max(highs - lows) > tolerance:
+        middles = (lows + highs) / 2
+        wins = colony_wins(middles)
+        lows, highs = np.where(wins, middles, lows), np.where(wins, highs, middles)
+
+    return np.where(bracketed, (lows + highs) / 2, np.nan)
@@ -0,0 +1,163 @@
+import numpy as np
+from utils.Auxiliary import Params
+from typing import Callable, Tuple
+from discrete_model.logistic_growth_model import EXTINCTION_THRESHOLD
+from discrete_model.pandemic_functions import deterministic_pandemic_function, \
+    stochastic_at_death_factor_pandemic_function, stochastic_at_pandemic_rate_pandemic_function, \
+    stochastic_at_both_pandemic_function, types_shift_model_deter_function, types_shift_model_stoch_function, \
+    UPPER_BOUND, STD
+from discrete_model.convergence import CONVERGENCE_TOLERANCE, convergence_period
+from utils.Instrumentation import count, GENERATIONS
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        """
+        Fallback for numba.njit when numba is not installed - the kernels run as plain Python.
+        """
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda function: function
+
+# Kernel pandemic timing and severity modes
+DETERMINISTIC, RANDOM = 0, 1
+# Maps each supported pandemic function to its (timing, severity, type shift) modes in the kernel.
+KERNEL_PANDEMIC_MODES = {
+    deterministic_pandemic_function: (DETERMINISTIC, DETERMINISTIC, False),
+    stochastic_at_death_factor_pandemic_function: (DETERMINISTIC, RANDOM, False),
+    stochastic_at_pandemic_rate_pandemic_function: (RANDOM, DETERMINISTIC, False),
+    stochastic_at_both_pandemic_function: (RANDOM, RANDOM, False),
+    types_shift_model_deter_function: (DETERMINISTIC, DETERMINISTIC, True),
+    types_shift_model_stoch_function: (RANDOM, RANDOM, True),
+}
+
+
+def compiled_logistic_growth_model(params: Params, pandemic_function: Callable, rng: np.random.Generator = None,
+                                   detect_convergence: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Runs the logistic growth model with the whole generation loop inside a single compiled kernel.
+    The kernel runs as plain Python if numba is not installed.
+    :param params: A dataclass containing all the relevant parameters.
+    :param pandemic_function: One of the pandemic functions in KERNEL_PANDEMIC_MODES.
+    :param rng: Used to seed the random generator of the kernel. A fresh one is created if not given.
+    :param detect_convergence: Whether to stop once the trajectory converged, as in logistic_growth_model.
+    :return colony_birds, lone_birds - Numpy arrays of the population of colony and lone birds in each generation.
+    """
+    if pandemic_function not in KERNEL_PANDEMIC_MODES:
+        raise ValueError(f"The compiled backend doesn't support the pandemic function {pandemic_function.__name__}")
+    timing, severity, type_shift = KERNEL_PANDEMIC_MODES[pandemic_function]
+    rng = np.random.default_rng() if rng is None else rng
+    period = convergence_period(pandemic_function, params)
+
+    arguments = (float(params.init_birds_num), float(params.carrying_capacity), float(params.growth_rate),
+                 float(params.selection_coefficient), float(params.pandemic_rate), float(params.c_death_factor),
+                 float(params.l_death_factor), float(params.shift_factor) if type_shift else 0.,
+                 int(params.num_of_generations), timing, severity, type_shift, detect_convergence,
+                 -1 if period is None else period)
+    seed = int(rng.integers(2 ** 32))
+    if NUMBA_AVAILABLE:
+        # Seeds the private random state of numba, not the global one of numpy
+        _seed_kernel(seed)
+        colony_birds, lone_birds, num_of_simulated = _run_kernel(*arguments)
+    else:
+        # As plain Python the kernel draws from the global random state of numpy, which is restored afterwards so
+        # that callers' own draws from it aren't affected
+        state = np.random.get_state()
+        try:
+            np.random.seed(seed)
+            colony_birds, lone_birds, num_of_simulated = _run_kernel(*arguments)
+        finally:
+            np.random.set_state(state)
+    count(GENERATIONS, num_of_simulated)
+    return colony_birds, lone_birds
+
+
+@njit(cache=True)
+def _seed_kernel(seed):
+    np.random.seed(seed)
+
+
+@njit(cache=True)
+def _truncnorm_survival(death_factor):
+    """
+    Samples the fraction of birds surviving a pandemic, as in pandemic_functions.sample_survival_factors.
+    """
+    while True:
+        survival = np.random.normal(1 - death_factor, STD)
+        if survival >= UPPER_BOUND:
+            return survival
+
+
+@njit(cache=True)
+def _run_kernel(init_birds_num, carrying_capacity, growth_rate, selection_coefficient, pandemic_rate, c_death_factor,
+                l_death_factor, shift_factor, num_of_generations, timing, severity, type_shift, detect_convergence,
+                period):
+    """
+    The generation loop of the model - the logistic update with the extinction cutoff, followed by the pandemic and
+    the type shift. Draws from the random state seeded by compiled_logistic_growth_model.
+    :return: The populations, and the number of generations simulated before convergence.
+    """
+    colony_birds, lone_birds = np.empty(num_of_generations), np.empty(num_of_generations)
+    colony_birds[0], lone_birds[0] = init_birds_num, init_birds_num
+    extinction_level = carrying_capacity * EXTINCTION_THRESHOLD
+    tolerance = CONVERGENCE_TOLERANCE * carrying_capacity
+    pandemic_period = 1 / pandemic_rate if pandemic_rate > 0 else np.inf
+    num_of_simulated = num_of_generations
+
+    for i in range(1, num_of_generations):
+        # Logistic update
+        colony, lone = colony_birds[i - 1], lone_birds[i - 1]
+        n_total = colony + lone
+        n_total += growth_rate * n_total * (carrying_capacity - n_total) / carrying_capacity
+        if colony < extinction_level:
+            new_colony = 0.
+        else:
+            new_colony = n_total * ((1 + selection_coefficient) * colony /
+                                    ((1 + selection_coefficient) * colony + lone))
+        new_lone = 0. if lone < extinction_level else n_total - new_colony
+
+        # Pandemic
+        if timing == DETERMINISTIC:
+            hit = i % pandemic_period == 0
+        else:
+            hit = np.random.random() < pandemic_rate
+        if hit:
+            if severity == DETERMINISTIC:
+                new_colony *= 1 - c_death_factor
+                new_lone *= 1 - l_death_factor
+            else:
+                new_colony *= _truncnorm_survival(c_death_factor)
+                if l_death_factor > 0:
+                    new_lone *= _truncnorm_survival(l_death_factor)
+
+        # Type shift
+        if type_shift:
+            colony_to_lone, lone_to_colony = new_colony * shift_factor, new_lone * shift_factor
+            if colony_to_lone >= 1:
+                new_lone += colony_to_lone
+                new_colony -= colony_to_lone
+            if lone_to_colony >= 1:
+                new_colony += lone_to_colony
+                new_lone -= lone_to_colony
+
+        colony_birds[i], lone_birds[i] = new_colony, new_lone
+
+        if detect_convergence:
+            repeating_period = 0
+            if new_colony == 0 and new_lone == 0:
+                repeating_period = 1
+            elif (period > 0 and i >= period and abs(new_colony - colony_birds[i - period]) <= tolerance and
+                  abs(new_lone - lone_birds[i - period]) <= tolerance):
+                repeating_period = period
+            if repeating_period > 0:
+                for j in range(i + 1, num_of_generations):
+                    colony_birds[j] = colony_birds[j - repeating_period]
+                    lone_birds[j] = lone_birds[j - repeating_period]
+                num_of_simulated = i + 1
+                break
+
+    return colony_birds, lone_birds, num_of_simulated
@@ -0,0 +1,56 @@
+import numpy as np
+from utils.Auxiliary import Params
+from typing import Callable
+from discrete_model.pandemic_functions import deterministic_pandemic_function, types_shift_model_deter_function
+
+# Maximal distance between the populations one period apart, relative to the carrying capacity, for the
+# trajectory to be considered converged.
+CONVERGENCE_TOLERANCE = 1e-12
+# Pandemic functions whose pandemics hit exactly every 1 / pandemic_rate generations.
+PERIODIC_PANDEMIC_FUNCTIONS = {deterministic_pandemic_function, types_shift_model_deter_function}
+
+
+def convergence_period(pandemic_function: Callable, params: Params) -> int:
+    """
+    Finds the period of the pandemics of a deterministic pandemic function. Once the populations repeat themselves
+    after one period, the rest of the trajectory is a periodic orbit (a fixed point if the period is 1).
+    :param pandemic_function: The model pandemic function.
+    :param params: A dataclass containing all the relevant parameters.
+    :return: The period in generations, or None if the pandemics are random or not periodic in whole generations.
+    """
+    if pandemic_function not in PERIODIC_PANDEMIC_FUNCTIONS:
+        return None
+    if params.pandemic_rate == 0 or 1 / params.pandemic_rate >= params.num_of_generations:
+        # No pandemic hits during the simulation
+        return 1
+    period = 1 / params.pandemic_rate
+    return int(period) if period == int(period) else None
+
+
+def find_repeating_period(colony_birds: np.ndarray, lone_birds: np.ndarray, i: int, period: int,
+                          params: Params) -> int:
+    """
+    Checks whether the trajectory has converged at generation i - both populations went extinct, or they are the same
+    as one period earlier.
+    :param period: The period of the pandemics, None if only extinction should be detected.
+    :return: The period with which the trajectory repeats itself from generation i on (1 for extinction), or None if
+    it hasn't converged.
+    """
+    if colony_birds[i] == 0 and lone_birds[i] == 0:
+        return 1
+    if period is None or i < period:
+        return None
+    tolerance = CONVERGENCE_TOLERANCE * params.carrying_capacity
+    if (abs(colony_birds[i] - colony_birds[i - period]) <= tolerance and
+            abs(lone_birds[i] - lone_birds[i - period]) <= tolerance):
+        return period
+    return None
+
+
+def fill_converged(colony_birds: np.ndarray, lone_birds: np.ndarray, i: int, period: int) -> None:
+    """
+    Fills the generations after i by repeating the last period of the trajectory.
+    """
+    remaining = colony_birds.size - i - 1
+    colony_birds[i + 1:] = np.resize(colony_birds[i - period + 1:i + 1], remaining)
+    lone_birds[i + 1:] = np.resize(lone_birds[i - period + 1:i + 1], remaining)
@@ -0,0 +1,167 @@
+import numpy as np
+from utils.Auxiliary import Params, ParamBatch, batch_params
+from typing import Callable, Tuple, Iterator, List, Union
+from discrete_model.logistic_growth_model import EXTINCTION_THRESHOLD
+from discrete_model.pandemic_functions import BATCH_PANDEMIC_FUNCTIONS
+from discrete_model.pandemic_schedule import schedule_for
+from discrete_model.reducers import Reducer, TrailingMean
+from utils.Instrumentation import timed, count, SIMULATION, GENERATIONS
+
+# The number of last generations over which the fraction of colony birds is averaged.
+LAST_GENERATIONS = 100
+# Minimal average fraction of a birds type in the last generations for it to be considered the winner.
+MIN_FRAC_FOR_WIN = 0.95
+# Outcome classes of a run
+COLONY_WIN, LONE_WIN, COEXISTENCE = 0, 1, 2
+
+
+@timed(SIMULATION)
+def ensemble_logistic_growth_model(params: Union[Params, ParamBatch], pandemic_function: Callable, num_of_runs: int,
+                                   rng: np.random.Generator = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Runs 'num_of_runs' replicates of the logistic growth model at once. All the replicates are advanced together,
+    one generation at a time, and the pandemic function is applied to all of them in a single call. The pandemics
+    of the stochastic pandemic functions are sampled in advance for all the replicates and generations.
+    The pandemics are drawn in a different order than in iterate_ensemble and reduce_ensemble, so the same rng gives
+    the two engines statistically equivalent but different runs.
+    :param params: A dataclass containing all the relevant parameters. Each parameter may also be an array with
+    one value per replicate. A ParamBatch runs 'num_of_runs' replicates of each of its parameter sets.
+    :param pandemic_function: A pandemic function from pandemic_functions.py, or its batched version.
+    :param num_of_runs: The number of replicates.
+    :param rng: Random generator for the stochastic pandemic functions. A fresh one is created if not given.
+    :return colony_birds, lone_birds - Numpy arrays of shape (num_of_runs, num_of_generations) of the population
+    of colony and lone birds in each replicate and generation. With a ParamBatch, the first dimension is
+    batch.size * num_of_runs, and the replicates of each parameter set are consecutive.
+    """
+    params, num_of_runs = batch_params(params, num_of_runs)
+    pandemic_function = BATCH_PANDEMIC_FUNCTIONS.get(pandemic_function, pandemic_function)
+    rng = np.random.default_rng() if rng is None else rng
+    schedule = schedule_for(pandemic_function, params, num_of_runs, rng)
+    if schedule is not None:
+        pandemic_function = schedule.apply
+
+    # Fortran order keeps each generation contiguous in memory
+    count(GENERATIONS, num_of_runs * params.num_of_generations)
+    shape = (num_of_runs, params.num_of_generations)
+    colony_birds, lone_birds = np.empty(shape, order='F'), np.empty(shape, order='F')
+    colony_birds[:, 0], lone_birds[:, 0] = params.init_birds_num, params.init_birds_num
+
+    for i in range(1, params.num_of_generations):
+        colony_birds[:, i], lone_birds[:, i] = run_single_iteration_batch(colony_birds[:, i - 1],
+                                                                          lone_birds[:, i - 1], params)
+        pandemic_function(colony_birds[:, i], lone_birds[:, i], i, params, rng)
+
+    return colony_birds, lone_birds
+
+
+def run_single_iteration_batch(colony_birds: np.ndarray, lone_birds: np.ndarray,
+                               params: Params) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Performs a single iteration of the model equations on arrays of populations.
+    :param colony_birds: The colony birds populations at the previous generation.
+    :param lone_birds: The lone birds populations at the previous generation.
+    :param params: A dataclass containing all the relevant parameters, scalars or arrays.
+    :return: The colony and lone birds populations at the next generation.
+    """
+    extinction_level = params.carrying_capacity * EXTINCTION_THRESHOLD
+    n_total = colony_birds + lone_birds
+    n_total = n_total + params.growth_rate * n_total * (params.carrying_capacity - n_total) / params.carrying_capacity
+
+    weighted_colony = (1 + params.selection_coefficient) * colony_birds
+    with np.errstate(divide='ignore', invalid='ignore'):
+        new_colony = np.where(colony_birds < extinction_level, 0.,
+                              n_total * (weighted_colony / (weighted_colony + lone_birds)))
+    new_lone = np.where(lone_birds < extinction_level, 0., n_total - new_colony)
+
+    return new_colony, new_lone
+
+
+def iterate_ensemble(params: Union[Params, ParamBatch], pandemic_function: Callable, num_of_runs: int = 1,
+                     rng: np.random.Generator = None) -> Iterator[Tuple[int, np.ndarray, np.ndarray]]:
+    """
+    Runs replicates of the logistic growth model as a stream of generations. Only the current generation is kept
+    in memory, so the memory doesn't depend on the number of generations. For the same reason the pandemics are
+    drawn generation by generation with the batched pandemic functions, rather than pre-sampled for the whole run
+    with a PandemicSchedule as in ensemble_logistic_growth_model. The random draws are made in a different order, so
+    the two engines are not seed-equivalent: the same rng gives statistically equivalent but different runs.
+    :param params: A dataclass containing all the relevant parameters. Each parameter may also be an array with
+    one value per replicate. A ParamBatch runs 'num_of_runs' replicates of each of its parameter sets.
+    :param pandemic_function: A pandemic function with a batched version, or a batched pandemic function.
+    :param num_of_runs: The number of replicates.
+    :param rng: Random generator for the stochastic pandemic functions. A fresh one is created if not given.
+    :return: An iterator of (generation, colony_birds, lone_birds), with the populations of all the replicates.
+    The yielded arrays must not be modified.
+    """
+    params, num_of_runs = batch_params(params, num_of_runs)
+    pandemic_function = BATCH_PANDEMIC_FUNCTIONS.get(pandemic_function, pandemic_function)
+    rng = np.random.default_rng() if rng is None else rng
+    count(GENERATIONS, num_of_runs * params.num_of_generations)
+
+    colony_birds = np.broadcast_to(params.init_birds_num, num_of_runs).astype(float)
+    lone_birds = colony_birds.copy()
+    yield 0, colony_birds, lone_birds
+
+    for i in range(1, params.num_of_generations):
+        colony_birds, lone_birds = run_single_iteration_batch(colony_birds, lone_birds, params)
+        pandemic_function(colony_birds, lone_birds, i, params, rng)
+        yield i, colony_birds, lone_birds
+
+
+@timed(SIMULATION)
+def reduce_ensemble(params: Union[Params, ParamBatch], pandemic_function: Callable, reducers: List[Reducer],
+                    num_of_runs: int = 1, rng: np.random.Generator = None) -> List[np.ndarray]:
+    """
+    Runs replicates of the logistic growth model, feeding every generation to the reducers instead of storing it.
+    :param params: A dataclass containing all the relevant parameters, scalars or arrays with one value per replicate,
+    or a ParamBatch.
+    :param pandemic_function: A pandemic function with a batched version, or a batched pandemic function.
+    :param reducers: The reducers from reducers.py to feed.
+    :param num_of_runs: The number of replicates.
+    :param rng: Random generator for the stochastic pandemic functions. A fresh one is created if not given.
+    :return: The result of each reducer, an array with one value per replicate.
+    """
+    for i, colony_birds, lone_birds in iterate_ensemble(params, pandemic_function, num_of_runs, rng):
+        for reducer in reducers:
+            reducer.update(colony_birds, lone_birds, i)
+    return [reducer.result() for reducer in reducers]
+
+
+def ensemble_outcome_counts(params: Params, pandemic_function: Callable, num_of_runs: int,
+                            rng: np.random.Generator = None, window: int = LAST_GENERATIONS) -> Tuple[int, int, int]:
+    """
+    Runs an ensemble of replicates and classifies each one by the average fraction of colony birds in its last
+    'window' generations: Colony birds overtook, Lone birds overtook, Coexistence.
+    :param params: A dataclass containing all the relevant parameters.
+    :param pandemic_function: A pandemic function from pandemic_functions.py, or its batched version.
+    :param num_of_runs: The number of replicates.
+    :param rng: Random generator for the stochastic pandemic functions. A fresh one is created if not given.
+    :param window: The number of last generations over which the fraction of colony birds is averaged.
+    :return: The numbers of colony wins, lone wins and coexistence.
+    """
+    avg_fracs, = reduce_ensemble(params, pandemic_function, [TrailingMean(window)], num_of_runs, rng)
+
+    colony_wins, lone_wins, coexist_wins = np.bincount(classify_colony_fraction(avg_fracs), minlength=3)
+    return colony_wins, lone_wins, coexist_wins
+
+
+def ensemble_outcome_fractions(params: Params, pandemic_function: Callable, num_of_runs: int,
+                               rng: np.random.Generator = None,
+                               window: int = LAST_GENERATIONS) -> Tuple[float, float, float]:
+    """
+    Runs an ensemble of replicates and classifies each one, as in ensemble_outcome_counts.
+    :return: The fractions of colony wins, lone wins and coexistence out of all the replicates.
+    """
+    colony_wins, lone_wins, coexist_wins = ensemble_outcome_counts(params, pandemic_function, num_of_runs, rng,
+                                                                   window)
+    return colony_wins / num_of_runs, lone_wins / num_of_runs, coexist_wins / num_of_runs
+
+
+def classify_colony_fraction(avg_fracs) -> np.ndarray:
+    """
+    Classifies runs by the average fraction of colony birds in their last generations.
+    :param avg_fracs: The average fractions of colony birds, a scalar or an array.
+    :return: COLONY_WIN, LONE_WIN or COEXISTENCE for each fraction. Undefined fractions (extinction) are coexistence.
+    """
+    avg_fracs = np.asarray(avg_fracs)
+    return np.where(avg_fracs > MIN_FRAC_FOR_WIN, COLONY_WIN,
+                    np.where(avg_fracs < (1 - MIN_FRAC_FOR_WIN), LONE_WIN, COEXISTENCE))
@@ -0,0 +1,312 @@
+import os
+import json
+import numpy as np
+from dataclasses import dataclass, replace, fields
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from utils.Auxiliary import Params, Model, ParamName, PARAM_FIELDS
+from typing import Callable, Dict, Tuple
+from discrete_model import pandemic_functions
+from discrete_model.pandemic_functions import MODEL_PANDEMIC_FUNCTIONS, BATCH_PANDEMIC_FUNCTIONS, \
+    DETERMINISTIC_PANDEMIC_FUNCTIONS, TYPE_SHIFT_PANDEMIC_FUNCTIONS
+from discrete_model.logistic_growth_model import logistic_growth_model
+from discrete_model.ensemble_model import reduce_ensemble, ensemble_outcome_fractions, LAST_GENERATIONS
+from discrete_model.reducers import TrailingMean
+
+# Outputs of an experiment
+NPZ_OUTPUT, CSV_OUTPUT, PLOT_OUTPUT, TABLE_OUTPUT = "npz", "csv", "plot", "table"
+OUTPUTS = (NPZ_OUTPUT, CSV_OUTPUT, PLOT_OUTPUT, TABLE_OUTPUT)
+# Files in the directory of an experiment
+SPEC_FILE_NAME, RESULTS_FILE_NAME, CHUNKS_DIR_NAME = "spec.json", "results.npz", "chunks"
+TABLE_FILE_NAME = "table.npy"
+DEFAULT_CHUNK_SIZE = 64
+CHUNK_FILE_PREFIX = "chunk_"
+# The values calculated in each cell
+DETERMINISTIC_VALUES = ("colony_fraction",)
+STOCHASTIC_VALUES = ("colony_wins", "lone_wins", "coexistence")
+
+
+@dataclass
+class ExperimentSpec:
+    """
+    A dataclass that describes a sweep of a model over a grid of parameters.
+    :param name: The name of the experiment, and of its directory.
+    :param model: The model. Deterministic models give the average fraction of colony birds in the last
+    generations of each cell, stochastic ones the fractions of colony wins, lone wins and coexistence of the runs.
+    :param axes: Maps each swept parameter to its values.
+    :param params: The values of the parameters that are not swept, by Params field name.
+    :param num_of_runs: The number of replicates in each cell of a stochastic model.
+    :param seed: The seed of the random streams of the cells. An interrupted experiment resumes with the same one.
+    :param outputs: What to write at the end - NPZ_OUTPUT, CSV_OUTPUT, PLOT_OUTPUT and/or TABLE_OUTPUT (a
+    memory-mapped outcome table, see outcome_table.py).
+    :param pandemic_function: The name of a function of pandemic_functions.py to use instead of the model's one.
+    :param window: The number of last generations over which the fraction of colony birds is averaged.
+    """
+    name: str
+    model: Model
+    axes: Dict[ParamName, np.ndarray]
+    params: Dict[str, float]
+    num_of_runs: int = 1
+    seed: int = None
+    outputs: Tuple[str, ...] = (NPZ_OUTPUT,)
+    pandemic_function: str = None
+    window: int = LAST_GENERATIONS
+
+    @staticmethod
+    def from_dict(spec: Dict) -> "ExperimentSpec":
+        """
+        Creates a spec from its JSON or YAML description. Model and axes are given by their names, and each axis by a
+        list of values or by {"start", "stop", "num"} of evenly spaced values.
+        """
+        axes = {ParamName[name]: _axis_values(values) for name, values in spec["axes"].items()}
+        experiment = ExperimentSpec(name=spec["name"], model=Model[spec["model"]], axes=axes,
+                                    params=dict(spec.get("params", {})), num_of_runs=int(spec.get("num_of_runs", 1)),
+                                    seed=spec.get("seed"), outputs=tuple(spec.get("outputs", (NPZ_OUTPUT,))),
+                                    pandemic_function=spec.get("pandemic_function"),
+                                    window=int(spec.get("window", LAST_GENERATIONS)))
+        experiment.validate()
+        return experiment
+
+    def to_dict(self) -> Dict:
+        return {"name": self.name, "model": self.model.name,
+                "axes": {name.name: values.tolist() for name, values in self.axes.items()}, "params": self.params,
+                "num_of_runs": self.num_of_runs, "seed": self.seed, "outputs": list(self.outputs),
+                "pandemic_function": self.pandemic_function, "window": self.window}
+
+    def validate(self) -> None:
+        """
+        Raises a ValueError if the spec can't be run.
+        """
+        swept_fields = {PARAM_FIELDS[name] for name in self.axes}
+        missing = [params_field.name for params_field in fields(Params) if params_field.default is not None and
+                   params_field.name not in self.params and params_field.name not in swept_fields]
+        if missing:
+            raise ValueError(f"The parameters {missing} are neither given nor swept")
+        unknown = set(self.params) - {params_field.name for params_field in fields(Params)}
+        if unknown:
+            raise ValueError(f"Unknown parameters: {sorted(unknown)}")
+        unknown_outputs = set(self.outputs) - set(OUTPUTS)
+        if unknown_outputs:
+            raise ValueError(f"Unknown outputs: {sorted(unknown_outputs)}")
+        if self.pandemic_function is not None and not callable(getattr(pandemic_functions, self.pandemic_function,
+                                                                       None)):
+            raise ValueError(f"Unknown pandemic function: {self.pandemic_function}")
+        has_shift_factor = self.params.get("shift_factor") is not None or ParamName.SHIFT_FACTOR in self.axes
+        if self.get_pandemic_function() in TYPE_SHIFT_PANDEMIC_FUNCTIONS and not has_shift_factor:
+            raise ValueError(f"The {self.get_pandemic_function().__name__} pandemic function needs a shift_factor")
+
+    def get_pandemic_function(self) -> Callable:
+        if self.pandemic_function is not None:
+            return getattr(pandemic_functions, self.pandemic_function)
+        return MODEL_PANDEMIC_FUNCTIONS[self.model]
+
+    def is_stochastic(self) -> bool:
+        return self.get_pandemic_function() not in DETERMINISTIC_PANDEMIC_FUNCTIONS
+
+    def value_names(self) -> Tuple[str, ...]:
+        return STOCHASTIC_VALUES if self.is_stochastic() else DETERMINISTIC_VALUES
+
+    def shape(self) -> Tuple[int, ...]:
+        return tuple(values.size for values in self.axes.values())
+
+    def base_params(self) -> Params:
+        """
+        :return: The fixed parameters, with the first value of each swept parameter.
+        """
+        values = dict(self.params)
+        for name, axis_values in self.axes.items():
+            values[PARAM_FIELDS[name]] = axis_values[0].item()
+        return Params(**values)
+
+
+def run_experiment(spec: ExperimentSpec, dir_path: str, num_of_workers: int = None,
+                   chunk_size: int = None) -> np.ndarray:
+    """
+    Runs an experiment, checkpointing every completed chunk of cells to its directory. If the directory already
+    has checkpoints of the same spec, only the missing chunks are run.
+    :param spec: The experiment.
+    :param dir_path: The directory in which the directory of the experiment is created.
+    :param num_of_workers: The number of worker processes. Defaults to the number of CPUs, 1 runs serially.
+    :param chunk_size: The number of cells in a chunk - the unit of work that is checkpointed. Defaults to the chunk
+    size of the existing checkpoints, or DEFAULT_CHUNK_SIZE.
+    :return: An array of shape spec.shape() + (number of values,), see ExperimentSpec.value_names.
+    """
+    spec, chunks_dir, chunk_size = prepare_experiment(spec, dir_path, chunk_size)
+    run_chunks(spec, chunks_dir, chunk_size, chunk_starts(spec, chunk_size), num_of_workers)
+    return load_results(spec, chunks_dir, chunk_size)
+
+
+def prepare_experiment(spec: ExperimentSpec, dir_path: str, chunk_size: int = None) -> Tuple[ExperimentSpec, str, int]:
+    """
+    Creates the directory of an experiment, or checks that an existing one has checkpoints of the same spec.
+    :return: The spec with its seed fixed, the directory of the checkpoints and the chunk size.
+    """
+    experiment_dir = os.path.join(dir_path, spec.name)
+    spec = _load_or_save_spec(spec, experiment_dir)
+    chunks_dir = os.path.join(experiment_dir, CHUNKS_DIR_NAME)
+    os.makedirs(chunks_dir, exist_ok=True)
+    if chunk_size is None:
+        chunk_size = _checkpoints_chunk_size(chunks_dir)
+    return spec, chunks_dir, chunk_size
+
+
+def chunk_starts(spec: ExperimentSpec, chunk_size: int) -> range:
+    """
+    :return: The index of the first cell of each chunk.
+    """
+    return range(0, int(np.prod(spec.shape())), chunk_size)
+
+
+def is_chunk_done(chunks_dir: str, start: int, chunk_size: int) -> bool:
+    return os.path.exists(_chunk_path(chunks_dir, start, chunk_size))
+
+
+def run_chunks(spec: ExperimentSpec, chunks_dir: str, chunk_size: int, starts, num_of_workers: int = None) -> None:
+    """
+    Evaluates the chunks that start at 'starts' and aren't checkpointed yet, and checkpoints each one as it completes.
+    :param num_of_workers: The number of worker processes. Defaults to the number of CPUs, 1 runs serially.
+    """
+    num_of_workers = os.cpu_count() if num_of_workers is None else num_of_workers
+    num_of_cells = int(np.prod(spec.shape()))
+    starts = [start for start in starts if not is_chunk_done(chunks_dir, start, chunk_size)]
+    if num_of_workers == 1:
+        for start in starts:
+            _save_chunk(chunks_dir, start, chunk_size, evaluate_cells(spec, start, min(start + chunk_size,
+                                                                                      num_of_cells)))
+    elif starts:
+        with ProcessPoolExecutor(max_workers=num_of_workers) as executor:
+            futures = {executor.submit(evaluate_cells, spec, start, min(start + chunk_size, num_of_cells)): start
+                       for start in starts}
+            for future in as_completed(futures):
+                _save_chunk(chunks_dir, futures[future], chunk_size, future.result())
+
+
+def load_results(spec: ExperimentSpec, chunks_dir: str, chunk_size: int) -> np.ndarray:
+    """
+    Assembles the checkpointed chunks of an experiment.
+    :return: An array of shape spec.shape() + (number of values,).
+    """
+    missing = [start for start in chunk_starts(spec, chunk_size) if not is_chunk_done(chunks_dir, start, chunk_size)]
+    if missing:
+        raise ValueError(f"{len(missing)} chunks of {spec.name} are not done, the first one starts at cell "
+                         f"{missing[0]}")
+    results = np.concatenate([np.load(_chunk_path(chunks_dir, start, chunk_size))
+                              for start in chunk_starts(spec, chunk_size)])
+    return results.reshape(spec.shape() + (len(spec.value_names()),))
+
+
+def evaluate_cells(spec: ExperimentSpec, start: int, stop: int) -> np.ndarray:
+    """
+    Evaluates the cells start, ..., stop - 1 of the grid (in C order). Executed inside a worker process.
+    Every cell gets its own random stream spawned from the seed of the spec, so the result doesn't depend on the
+    chunking.
+    :return: An array of shape (stop - start, number of values).
+    """
+    pandemic_function = spec.get_pandemic_function()
+    indices = np.unravel_index(np.arange(start, stop), spec.shape())
+    cells_values = {PARAM_FIELDS[name]: axis_values[axis_indices]
+                    for (name, axis_values), axis_indices in zip(spec.axes.items(), indices)}
+    params = spec.base_params()
+
+    if spec.is_stochastic():
+        # The same streams as SeedSequence(spec.seed).spawn(number of cells)
+        cell_seeds = [np.random.SeedSequence(spec.seed, spawn_key=(cell,)) for cell in range(start, stop)]
+        return np.array([ensemble_outcome_fractions(_cell_params(params, cells_values, cell), pandemic_function,
+                                                    spec.num_of_runs, np.random.default_rng(cell_seed), spec.window)
+                         for cell, cell_seed in enumerate(cell_seeds)])
+    batched = pandemic_function in BATCH_PANDEMIC_FUNCTIONS or pandemic_function in BATCH_PANDEMIC_FUNCTIONS.values()
+    if batched and ParamName.NUM_OF_GENERATIONS not in spec.axes:
+        # All the cells of the chunk are simulated together
+        colony_fraction, = reduce_ensemble(replace(params, **cells_values), pandemic_function,
+                                           [TrailingMean(spec.window)], stop - start)
+        return colony_fraction[:, None]
+    fractions = []
+    for cell in range(stop - start):
+        colony_birds, lone_birds = logistic_growth_model(_cell_params(params, cells_values, cell), pandemic_function)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fractions.append(np.average((colony_birds / (colony_birds + lone_birds))[-spec.window:]))
+    return np.array(fractions)[:, None]
+
+
+def load_spec(file_path: str) -> ExperimentSpec:
+    """
+    Loads a spec from a JSON file, or from a YAML file (requires PyYAML).
+    """
+    with open(file_path) as f:
+        if file_path.endswith((".yaml", ".yml")):
+            import yaml
+            return ExperimentSpec.from_dict(yaml.safe_load(f))
+        return ExperimentSpec.from_dict(json.load(f))
+
+
+def _load_or_save_spec(spec: ExperimentSpec, experiment_dir: str) -> ExperimentSpec:
+    """
+    Saves the spec in the directory of a new experiment, with a fixed seed. When resuming, checks that the spec is
+    the one the checkpoints were made with, and takes its seed.
+    """
+    spec_path = os.path.join(experiment_dir, SPEC_FILE_NAME)
+    if os.path.exists(spec_path):
+        with open(spec_path) as f:
+            saved_spec = ExperimentSpec.from_dict(json.load(f))
+        if spec.seed is not None and spec.seed != saved_spec.seed:
+            raise ValueError(f"{experiment_dir} was run with seed {saved_spec.seed}, not {spec.seed}")
+        spec = replace(spec, seed=saved_spec.seed)
+        if _run_description(spec) != _run_description(saved_spec):
+            raise ValueError(f"{experiment_dir} has checkpoints of a different experiment")
+        return spec
+
+    os.makedirs(experiment_dir, exist_ok=True)
+    if spec.seed is None:
+        spec = replace(spec, seed=int(np.random.SeedSequence().entropy % 2 ** 63))
+    temp_path = f"{spec_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(spec.to_dict(), f, indent=2)
+    os.replace(temp_path, spec_path)
+    return spec
+
+
+def _run_description(spec: ExperimentSpec) -> Dict:
+    """
+    The part of the spec that the results depend on.
+    """
+    description = spec.to_dict()
+    del description["outputs"]
+    return description
+
+
+def _axis_values(values) -> np.ndarray:
+    if isinstance(values, dict):
+        return np.linspace(values["start"], values["stop"], int(values["num"]))
+    return np.asarray(values, dtype=float)
+
+
+def _cell_params(params: Params, cells_values: Dict[str, np.ndarray], cell: int) -> Params:
+    values = {name: field_values[cell].item() for name, field_values in cells_values.items()}
+    if PARAM_FIELDS[ParamName.NUM_OF_GENERATIONS] in values:
+        values[PARAM_FIELDS[ParamName.NUM_OF_GENERATIONS]] = int(values[PARAM_FIELDS[ParamName.NUM_OF_GENERATIONS]])
+    return replace(params, **values)
+
+
+def _chunk_path(chunks_dir: str, start: int, chunk_size: int) -> str:
+    return os.path.join(chunks_dir, f"{CHUNK_FILE_PREFIX}{start:09d}_{chunk_size}.npy")
+
+
+def _checkpoints_chunk_size(chunks_dir: str) -> int:
+    """
+    :return: The chunk size of the existing checkpoints, or DEFAULT_CHUNK_SIZE if there are none.
+    """
+    for file_name in sorted(os.listdir(chunks_dir)):
+        if file_name.startswith(CHUNK_FILE_PREFIX) and file_name.endswith(".npy"):
+            return int(file_name[:-len(".npy")].split("_")[-1])
+    return DEFAULT_CHUNK_SIZE
+
+
+def _save_chunk(chunks_dir: str, start: int, chunk_size: int, values: np.ndarray) -> None:
+    """
+    Saves the values of a chunk of cells. The file is written under a temporary name and then renamed, so an
+    interruption never leaves a partial chunk.
+    """
+    path = _chunk_path(chunks_dir, start, chunk_size)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as f:
+        np.save(f, values)
+    os.replace(temp_path, path)
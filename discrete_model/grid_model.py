@@ -0,0 +1,83 @@
+import numpy as np
+from utils.Auxiliary import Params, ParamName, ParamBatch
+from typing import Callable, Dict, List
+from discrete_model.ensemble_model import reduce_ensemble, LAST_GENERATIONS
+from discrete_model.pandemic_functions import types_shift_model_deter_function, types_shift_model_stoch_function
+from discrete_model.reducers import Reducer, TrailingMean, lone_population
+
+
+def grid_logistic_growth_model(params: Params, pandemic_function: Callable, axes: Dict[ParamName, np.ndarray],
+                               window: int = LAST_GENERATIONS, rng: np.random.Generator = None) -> np.ndarray:
+    """
+    Runs the logistic growth model on every combination of the given parameter values at once. Only the current
+    generation of all the grid cells is kept in memory, and the fraction of colony birds is reduced on the fly.
+    :param params: The rest of the parameters.
+    :param pandemic_function: A pandemic function from pandemic_functions.py, or its batched version.
+    :param axes: Maps each swept parameter to its values. num_of_generations can't be swept.
+    :param window: The number of last generations over which the fraction of colony birds is averaged.
+    :param rng: Random generator for the stochastic pandemic functions. A fresh one is created if not given.
+    :return: A matrix with one dimension per axis (in the order of 'axes') of the average fraction of colony birds
+    in the last 'window' generations.
+    """
+    colony_fraction, = grid_reduce(params, pandemic_function, axes, [TrailingMean(window)], rng=rng)
+    return colony_fraction[..., 0]
+
+
+def grid_reduce(params: Params, pandemic_function: Callable, axes: Dict[ParamName, np.ndarray],
+                reducers: List[Reducer], num_of_runs: int = 1, rng: np.random.Generator = None) -> List[np.ndarray]:
+    """
+    Runs replicates of the logistic growth model on every combination of the given parameter values at once,
+    feeding every generation of all the runs to the reducers.
+    :param params: The rest of the parameters.
+    :param pandemic_function: A pandemic function with a batched version, or a batched pandemic function.
+    :param axes: Maps each swept parameter to its values. num_of_generations can't be swept.
+    :param reducers: The reducers from reducers.py to feed.
+    :param num_of_runs: The number of replicates of each combination.
+    :param rng: Random generator for the stochastic pandemic functions. A fresh one is created if not given.
+    :return: The result of each reducer, an array with one dimension per axis (in the order of 'axes') and a last
+    dimension of the replicates.
+    """
+    if ParamName.NUM_OF_GENERATIONS in axes:
+        raise ValueError(f"{ParamName.NUM_OF_GENERATIONS} can't be swept by the grid engine")
+
+    batch = ParamBatch.product(params, {name: np.asarray(axis_values, dtype=float)
+                                        for name, axis_values in axes.items()})
+    results = reduce_ensemble(batch, pandemic_function, reducers, num_of_runs, rng)
+    return [result.reshape(batch.shape + (num_of_runs,)) for result in results]
+
+
+def grid_pr_df_colony_fraction(params: Params, pandemic_function: Callable, pandemic_rates: np.ndarray,
+                               death_factors: np.ndarray, rng: np.random.Generator = None) -> np.ndarray:
+    """
+    Calculates the (pandemic rate, colony death factor) heatmap matrix of the average fraction of colony birds.
+    :param params: The rest of the parameters.
+    :param pandemic_function: The model pandemic function.
+    :param pandemic_rates: Pandemic rate values (rows).
+    :param death_factors: Colony death factor values (columns).
+    :param rng: Random generator for the stochastic pandemic functions.
+    :return: A matrix of shape (pandemic_rates.size, death_factors.size).
+    """
+    return grid_logistic_growth_model(params, pandemic_function, {ParamName.PANDEMIC_RATE: pandemic_rates,
+                                                                  ParamName.C_DEATH_FACTOR: death_factors}, rng=rng)
+
+
+def type_shift_sweep(params: Params, shift_factors: np.ndarray, death_factors: np.ndarray, num_of_runs: int = 1,
+                     stochastic: bool = False, reducers: List[Reducer] = None,
+                     rng: np.random.Generator = None) -> List[np.ndarray]:
+    """
+    Runs the types shift model on every (shift factor, colony death factor) combination, with all the replicates,
+    in a single batched run.
+    :param params: The rest of the parameters.
+    :param shift_factors: Shift factor values.
+    :param death_factors: Colony death factor values.
+    :param num_of_runs: The number of replicates of each combination.
+    :param stochastic: Whether to run the stochastic types shift model, with random pandemic timing and severity.
+    :param reducers: The reducers to feed. Defaults to the average number of lone birds in the last generations.
+    :param rng: Random generator for the stochastic model. A fresh one is created if not given.
+    :return: The result of each reducer, an array of shape (shift_factors.size, death_factors.size, num_of_runs).
+    """
+    reducers = [TrailingMean(LAST_GENERATIONS, lone_population)] if reducers is None else reducers
+    pandemic_function = types_shift_model_stoch_function if stochastic else types_shift_model_deter_function
+    return grid_reduce(params, pandemic_function, {ParamName.SHIFT_FACTOR: shift_factors,
+                                                   ParamName.C_DEATH_FACTOR: death_factors},
+                       reducers, num_of_runs, rng)
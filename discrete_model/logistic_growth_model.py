@@ -1,24 +1,63 @@
 import numpy as np
 from utils.Auxiliary import Params, BirdsPopulations
 from typing import Callable, Tuple
+from discrete_model.pandemic_schedule import schedule_for
+from discrete_model.convergence import convergence_period, find_repeating_period, fill_converged
+from utils.Instrumentation import timed, count, SIMULATION, GENERATIONS
 
+# Populations below this fraction of the carrying capacity are considered extinct.
+EXTINCTION_THRESHOLD = 0.001
+# Backends of logistic_growth_model
+PYTHON_BACKEND, COMPILED_BACKEND = "python", "compiled"
 
-def logistic_growth_model(params: Params, pandemic_function: Callable) -> Tuple[np.ndarray, np.ndarray]:
+
+@timed(SIMULATION)
+def logistic_growth_model(params: Params, pandemic_function: Callable,
+                          rng: np.random.Generator = None,
+                          detect_convergence: bool = False,
+                          backend: str = PYTHON_BACKEND) -> Tuple[np.ndarray, np.ndarray]:
     """
     Calculates the logistic growth each year according to preset parameters. Applies the pandemic function in
-    each generation.
+    each generation. The pandemics of the stochastic pandemic functions are sampled in advance for the whole run.
     :param params - A dataclass containing all the relevant parameters.
     :param pandemic_function - A function that calculates whether a pandemic hits, and the losses from the pandemic.
+    :param rng - Random generator for the stochastic pandemic functions. A fresh one is created if not given.
+    :param detect_convergence - Whether to stop simulating once both populations went extinct, or once a
+    deterministic trajectory reached a fixed point or a periodic orbit. The rest of the generations are then filled
+    by repeating the converged trajectory.
+    :param backend - PYTHON_BACKEND runs the generation loop in Python and accepts any pandemic function.
+    COMPILED_BACKEND runs it in a numba kernel (plain Python if numba is not installed), and supports only the
+    pandemic functions of pandemic_functions.py.
     :return colony_birds, lone_birds - Numpy arrays of the population of colony and lone birds in each generation.
     """
+    if backend == COMPILED_BACKEND:
+        # Imported here so that numba is loaded only when the compiled backend is used
+        from discrete_model.compiled_kernels import compiled_logistic_growth_model
+        return compiled_logistic_growth_model(params, pandemic_function, rng, detect_convergence)
+    if backend != PYTHON_BACKEND:
+        raise ValueError(f"Unknown backend: {backend}")
+
+    period = convergence_period(pandemic_function, params)
+    schedule = schedule_for(pandemic_function, params, 1, rng)
+    if schedule is not None:
+        pandemic_function = schedule.single_run_pandemic_function()
 
     colony_birds, lone_birds = np.empty(params.num_of_generations), np.empty(params.num_of_generations)
     colony_birds[0], lone_birds[0] = params.init_birds_num, params.init_birds_num
 
+    # Only the simulated generations are counted, not the ones filled after convergence
+    num_of_simulated = params.num_of_generations
     for i in range(1, params.num_of_generations):
         run_single_iteration(colony_birds, lone_birds, i, params)
         pandemic_function(colony_birds, lone_birds, i, params)
+        if detect_convergence:
+            repeating_period = find_repeating_period(colony_birds, lone_birds, i, period, params)
+            if repeating_period is not None:
+                fill_converged(colony_birds, lone_birds, i, repeating_period)
+                num_of_simulated = i + 1
+                break
 
+    count(GENERATIONS, num_of_simulated)
     return colony_birds, lone_birds
 
 
@@ -29,13 +68,13 @@ def run_single_iteration(colony_birds: np.ndarray, lone_birds: np.ndarray, i: in
     N_total = colony_birds[i - 1] + lone_birds[i - 1]
     N_total += params.growth_rate * N_total * (params.carrying_capacity - N_total) / params.carrying_capacity
 
-    if colony_birds[i - 1] < params.carrying_capacity * 0.001:
+    if colony_birds[i - 1] < params.carrying_capacity * EXTINCTION_THRESHOLD:
         colony_birds[i] = 0
     else:
         colony_birds[i] = N_total * ((1 + params.selection_coefficient) * colony_birds[i - 1] /
                                      ((1 + params.selection_coefficient) * colony_birds[i - 1] + lone_birds[i - 1]))
 
-    if lone_birds[i - 1] < params.carrying_capacity * 0.001:
+    if lone_birds[i - 1] < params.carrying_capacity * EXTINCTION_THRESHOLD:
         lone_birds[i] = 0
     else:
         lone_birds[i] = (N_total - colony_birds[i])
@@ -0,0 +1,208 @@
+import os
+import numpy as np
+from bisect import bisect_right
+from itertools import product
+from utils.Auxiliary import Params, ParamName, PARAM_FIELDS
+from typing import Dict, List, Tuple, Union
+from discrete_model.experiment import ExperimentSpec, run_experiment, load_spec, SPEC_FILE_NAME, TABLE_FILE_NAME
+from discrete_model.ensemble_model import classify_colony_fraction
+from discrete_model.pandemic_functions import FIXED_TIMING_PANDEMIC_FUNCTIONS, deterministic_pandemic_mask
+
+
+class OutcomeTable:
+    """
+    The precomputed results of an experiment over a grid of parameters, kept in a memory-mapped file, so that it's
+    computed once and opened instantly by any number of processes. Points between the grid values are answered by
+    multilinear interpolation of the cells around them, and points outside the grid by its nearest edge.
+    The pandemics of the models with fixed timing only hit the generations that are multiples of 1 / pandemic_rate,
+    so their outcome isn't continuous in the pandemic rate. A pandemic rate of these models isn't interpolated, but
+    answered by the grid rate whose pandemics hit the same generations (e.g. 0.15, which never hits, by 0).
+    """
+
+    def __init__(self, spec: ExperimentSpec, table: np.ndarray):
+        """
+        :param spec: The experiment of the table.
+        :param table: An array of shape spec.shape() + (number of values,), see ExperimentSpec.value_names.
+        """
+        _check_axes(spec)
+        self.spec = spec
+        self.table = table
+        self._axes = [np.asarray(axis_values, dtype=float) for axis_values in spec.axes.values()]
+        self._fields = [PARAM_FIELDS[name] for name in spec.axes]
+        self._stochastic = spec.is_stochastic()
+        # A plain view of the memory map, which is faster to index
+        self._cells = np.asarray(table).reshape(-1, table.shape[-1])
+        # The offset of each corner of a grid cell from its lowest corner, in flat cells. Axes with a single value
+        # have no upper corner.
+        strides = np.array([int(np.prod(spec.shape()[axis + 1:])) for axis in range(len(self._axes))], dtype=np.intp)
+        steps = np.array([axis_values.size > 1 for axis_values in self._axes], dtype=np.intp)
+        self._corners = np.array(list(product((0, 1), repeat=len(self._axes))), dtype=bool)
+        self._strides, self._corner_offsets = strides, (self._corners * steps) @ strides
+        # The same as lists, for the queries of single points
+        self._axis_lists = [axis_values.tolist() for axis_values in self._axes]
+        self._stride_list, self._corner_list = strides.tolist(), list(zip(self._corners.tolist(),
+                                                                          self._corner_offsets.tolist()))
+        # The grid rate of each pandemic timing, for the models with fixed timing
+        self._rate_axis, self._grid_rates = None, {}
+        if spec.get_pandemic_function() in FIXED_TIMING_PANDEMIC_FUNCTIONS and ParamName.PANDEMIC_RATE in spec.axes:
+            self._rate_axis = list(spec.axes).index(ParamName.PANDEMIC_RATE)
+            generations = spec.axes.get(ParamName.NUM_OF_GENERATIONS, spec.params.get("num_of_generations"))
+            self._num_of_generations = int(np.max(generations))
+            for rate in reversed(self._axis_lists[self._rate_axis]):
+                self._grid_rates[self._pandemic_timing(rate)] = rate
+
+    @classmethod
+    def load(cls, experiment_dir: str) -> "OutcomeTable":
+        """
+        Opens the table saved in the directory of an experiment, without reading it into memory.
+        """
+        spec = load_spec(os.path.join(experiment_dir, SPEC_FILE_NAME))
+        return cls(spec, np.load(os.path.join(experiment_dir, TABLE_FILE_NAME), mmap_mode='r'))
+
+    def names(self) -> List[ParamName]:
+        return list(self.spec.axes)
+
+    def value_names(self) -> Tuple[str, ...]:
+        return self.spec.value_names()
+
+    def interpolate(self, points: np.ndarray) -> np.ndarray:
+        """
+        :param points: An array of shape (number of points, number of axes), in the order of the axes of the spec.
+        :return: An array of shape (number of points, number of values). A value is NaN if a cell it's interpolated
+        from is NaN (the colony fraction of a population that went extinct).
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, len(self._axes))
+        if self._rate_axis is not None:
+            rates, inverse = np.unique(points[:, self._rate_axis], return_inverse=True)
+            points = points.copy()
+            points[:, self._rate_axis] = np.array([self._grid_rate(rate) for rate in rates])[inverse.ravel()]
+        lower, weights = np.empty(points.shape, dtype=np.intp), np.empty(points.shape)
+        for axis, axis_values in enumerate(self._axes):
+            values = np.clip(points[:, axis], axis_values[0], axis_values[-1])
+            if axis_values.size == 1:
+                lower[:, axis], weights[:, axis] = 0, 0.
+                continue
+            index = np.clip(np.searchsorted(axis_values, values, side='right') - 1, 0, axis_values.size - 2)
+            lower[:, axis] = index
+            weights[:, axis] = (values - axis_values[index]) / (axis_values[index + 1] - axis_values[index])
+
+        corner_weights = np.prod(np.where(self._corners, weights[:, None, :], 1 - weights[:, None, :]), axis=-1)
+        corner_values = self._cells[(lower @ self._strides)[:, None] + self._corner_offsets]
+        # Corners with no weight don't make the value NaN
+        corner_values = np.where(corner_weights[..., None] > 0, corner_values, 0.)
+        return np.einsum('pc,pcv->pv', corner_weights, corner_values)
+
+    def classify(self, points: np.ndarray) -> np.ndarray:
+        """
+        :param points: An array of shape (number of points, number of axes), in the order of the axes of the spec.
+        :return: COLONY_WIN, LONE_WIN or COEXISTENCE for each point - for deterministic models by the interpolated
+        fraction of colony birds, for stochastic models the most frequent outcome.
+        """
+        return self._classify_values(self.interpolate(points))
+
+    def query(self, point: Union[Params, Dict[ParamName, float]]) -> np.ndarray:
+        """
+        :param point: The values of the swept parameters, as a Params or by ParamName.
+        :return: The interpolated values at the point, one per value name.
+        """
+        return self._interpolate_point(self._point(point))
+
+    def query_class(self, point: Union[Params, Dict[ParamName, float]]) -> int:
+        """
+        :param point: The values of the swept parameters, as a Params or by ParamName.
+        :return: COLONY_WIN, LONE_WIN or COEXISTENCE.
+        """
+        return int(self._classify_values(self._interpolate_point(self._point(point))[None, :])[0])
+
+    def _point(self, point: Union[Params, Dict[ParamName, float]]) -> List[float]:
+        if isinstance(point, Params):
+            values = [float(getattr(point, field_name)) for field_name in self._fields]
+        else:
+            values = [float(point[name]) for name in self.spec.axes]
+        if self._rate_axis is not None:
+            values[self._rate_axis] = self._grid_rate(values[self._rate_axis])
+        return values
+
+    def _pandemic_timing(self, pandemic_rate: float) -> bytes:
+        """
+        :return: A key of the generations the pandemics of the rate hit.
+        """
+        return np.packbits(deterministic_pandemic_mask(np.arange(1, self._num_of_generations), pandemic_rate)).tobytes()
+
+    def _grid_rate(self, pandemic_rate: float) -> float:
+        """
+        :return: The grid rate whose pandemics hit the same generations as the pandemic rate.
+        """
+        grid_rate = self._grid_rates.get(self._pandemic_timing(pandemic_rate))
+        if grid_rate is None:
+            raise ValueError(f"No pandemic rate of the grid hits the same generations as {pandemic_rate}, and the "
+                             f"outcome of {self.spec.get_pandemic_function().__name__} can't be interpolated between "
+                             f"pandemic rates")
+        return grid_rate
+
+    def _interpolate_point(self, point: List[float]) -> np.ndarray:
+        """
+        Interpolates a single point like interpolate, in plain Python, which is faster than vector operations over
+        the few corners of a single cell.
+        """
+        base, weights = 0, []
+        for axis_values, stride, value in zip(self._axis_lists, self._stride_list, point):
+            value = min(max(value, axis_values[0]), axis_values[-1])
+            if len(axis_values) == 1:
+                weights.append(0.)
+                continue
+            index = min(bisect_right(axis_values, value) - 1, len(axis_values) - 2)
+            base += index * stride
+            weights.append((value - axis_values[index]) / (axis_values[index + 1] - axis_values[index]))
+        result = 0.
+        for corner, offset in self._corner_list:
+            corner_weight = 1.
+            for upper, weight in zip(corner, weights):
+                corner_weight *= weight if upper else 1 - weight
+            if corner_weight > 0:
+                result = result + corner_weight * self._cells[base + offset]
+        return result
+
+    def _classify_values(self, values: np.ndarray) -> np.ndarray:
+        if self._stochastic:
+            # The values are the fractions of COLONY_WIN, LONE_WIN and COEXISTENCE, in this order
+            return np.argmax(values, axis=1)
+        return classify_colony_fraction(values[:, 0])
+
+
+def save_outcome_table(results: np.ndarray, experiment_dir: str) -> str:
+    """
+    Saves the results of an experiment as the memory-mappable table of its directory. The file is written under a
+    temporary name and then renamed, so readers never open a partial table.
+    :param results: The results of the experiment, as returned by run_experiment.
+    :return: The path of the table.
+    """
+    path = os.path.join(experiment_dir, TABLE_FILE_NAME)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    table = np.lib.format.open_memmap(temp_path, mode='w+', dtype=np.float64, shape=results.shape)
+    table[...] = results
+    table.flush()
+    del table
+    os.replace(temp_path, path)
+    return path
+
+
+def build_outcome_table(spec: ExperimentSpec, dir_path: str, num_of_workers: int = None,
+                        chunk_size: int = None) -> OutcomeTable:
+    """
+    Runs an experiment, or resumes it, and saves its results as an outcome table. The sweep is checkpointed and
+    parallelized like any experiment, and can be sharded (see sharding.py) before the table is saved.
+    :param spec: The experiment. Every axis must be increasing.
+    :param dir_path: The directory in which the directory of the experiment is created.
+    :return: The table, opened from its file.
+    """
+    _check_axes(spec)
+    results = run_experiment(spec, dir_path, num_of_workers, chunk_size)
+    save_outcome_table(results, os.path.join(dir_path, spec.name))
+    return OutcomeTable.load(os.path.join(dir_path, spec.name))
+
+
+def _check_axes(spec: ExperimentSpec) -> None:
+    for name, axis_values in spec.axes.items():
+        if np.any(np.diff(axis_values) <= 0):
+            raise ValueError(f"The values of the axis {name} must be increasing to be interpolated")
@@ -1,7 +1,7 @@
 import numpy as np
 import random
-from utils.Auxiliary import Params
-from scipy.stats import truncnorm
+from utils.Auxiliary import Params, Model
+from utils.Instrumentation import timed, count, RNG, RNG_DRAWS
 from abc import abstractmethod
 
 UPPER_BOUND = 0.1
@@ -34,13 +34,10 @@ def stochastic_at_death_factor_pandemic_function(colony_birds: np.ndarray, lone_
     """
 
     if i % (1 / params.pandemic_rate) == 0:
-        death_factor = 1 - params.c_death_factor
-        colony_birds[i] *= truncnorm.rvs((UPPER_BOUND - death_factor) / STD, (np.inf - death_factor) / STD,
-                                         loc=death_factor, scale=STD)
+        count(RNG_DRAWS, 1 + (params.l_death_factor > 0))
+        colony_birds[i] *= _truncnorm_survival_factor(params.c_death_factor)
         if params.l_death_factor > 0:
-            death_factor = 1 - params.l_death_factor
-            lone_birds[i] *= truncnorm.rvs((UPPER_BOUND - death_factor) / STD, (np.inf - death_factor) / STD,
-                                           loc=death_factor, scale=STD)
+            lone_birds[i] *= _truncnorm_survival_factor(params.l_death_factor)
 
 
 def stochastic_at_pandemic_rate_pandemic_function(colony_birds: np.ndarray, lone_birds: np.ndarray, i: int,
@@ -53,6 +50,7 @@ def stochastic_at_pandemic_rate_pandemic_function(colony_birds: np.ndarray, lone
     :param params: A dataclass containing all the relevant parameters.
     :return: None
     """
+    count(RNG_DRAWS)
     if random.choices([True, False], weights=[params.pandemic_rate, 1 - params.pandemic_rate])[0]:
         colony_birds[i] *= (1 - params.c_death_factor)
         lone_birds[i] *= (1 - params.l_death_factor)
@@ -70,14 +68,23 @@ def stochastic_at_both_pandemic_function(colony_birds: np.ndarray, lone_birds: n
     :return: None
     """
 
+    count(RNG_DRAWS)
     if random.choices([True, False], weights=[params.pandemic_rate, 1 - params.pandemic_rate])[0]:
-        death_factor = 1 - params.c_death_factor
-        colony_birds[i] *= truncnorm.rvs((UPPER_BOUND - death_factor) / STD, (np.inf - death_factor) / STD,
-                                         loc=death_factor, scale=STD)
+        count(RNG_DRAWS, 1 + (params.l_death_factor > 0))
+        colony_birds[i] *= _truncnorm_survival_factor(params.c_death_factor)
         if params.l_death_factor > 0:
-            death_factor = 1 - params.l_death_factor
-            lone_birds[i] *= truncnorm.rvs((UPPER_BOUND - death_factor) / STD, (np.inf - death_factor) / STD,
-                                           loc=death_factor, scale=STD)
+            lone_birds[i] *= _truncnorm_survival_factor(params.l_death_factor)
+
+
+def _truncnorm_survival_factor(death_factor: float) -> float:
+    """
+    Draws the fraction of birds surviving a pandemic, from a normal distribution around 1 - death_factor truncated
+    at UPPER_BOUND from below.
+    """
+    # Imported here so that the simulation engines, which sample with sample_survival_factors, don't load scipy
+    from scipy.stats import truncnorm
+    survival = 1 - death_factor
+    return truncnorm.rvs((UPPER_BOUND - survival) / STD, (np.inf - survival) / STD, loc=survival, scale=STD)
 
 
 def types_shift_model_deter_function(colony_birds: np.ndarray, lone_birds: np.ndarray, i: int, params: Params) -> None:
@@ -91,8 +98,28 @@ def types_shift_model_deter_function(colony_birds: np.ndarray, lone_birds: np.nd
     :return: None
     """
     deterministic_pandemic_function(colony_birds, lone_birds, i, params)
-    # stochastic_at_pandemic_rate_pandemic_function(colony_birds, lone_birds, i, params)
+    type_shift(colony_birds, lone_birds, i, params)
+
+
+def types_shift_model_stoch_function(colony_birds: np.ndarray, lone_birds: np.ndarray, i: int, params: Params) -> None:
+    """
+    The progression function of the stochastic 'types shift' model. The pandemics are random at both their timing
+    and their severity, as in stochastic_at_both_pandemic_function, and are followed by the type shifting.
+    :param colony_birds: Numpy array of the colony birds populations in each generation.
+    :param i: Generation number
+    :param lone_birds: Numpy array of the lone birds populations in each generation.
+    :param params: A dataclass containing all the relevant parameters.
+    :return: None
+    """
+    stochastic_at_both_pandemic_function(colony_birds, lone_birds, i, params)
+    type_shift(colony_birds, lone_birds, i, params)
 
+
+def type_shift(colony_birds: np.ndarray, lone_birds: np.ndarray, i: int, params: Params) -> None:
+    """
+    Moves a 'shift_factor' fraction of each type of birds to the other type at generation i. A shift of less than
+    one bird doesn't happen.
+    """
     colony_to_lone = colony_birds[i] * params.shift_factor
     lone_to_colony = lone_birds[i] * params.shift_factor
     if colony_to_lone >= 1:
@@ -103,7 +130,190 @@ def types_shift_model_deter_function(colony_birds: np.ndarray, lone_birds: np.nd
         lone_birds[i] -= lone_to_colony
 
 
-# def type_shift_stoch(colony_birds: np.ndarray, lone_birds: np.ndarray, i: int, params: Params):
+# Batched pandemic functions, used by the ensemble engine. Each one receives the populations of all the replicates
+# at generation i (1D arrays, modified in place) instead of the full history of a single replicate. Any parameter
+# may also be an array broadcastable to the populations shape.
+
+
+def deterministic_pandemic_mask(i: int, pandemic_rate) -> np.ndarray:
+    """
+    Returns whether a deterministic pandemic hits at generation i, for scalar or array pandemic rates.
+    A pandemic rate of zero never hits.
+    """
+    with np.errstate(divide='ignore'):
+        period = 1 / np.asarray(pandemic_rate, dtype=float)
+    return np.mod(i, period) == 0
+
+
+@timed(RNG)
+def sample_survival_factors(death_factor, size, rng: np.random.Generator) -> np.ndarray:
+    """
+    Samples the fractions of birds surviving a pandemic, from a normal distribution around 1 - death_factor
+    truncated at UPPER_BOUND from below - the same distribution as the truncnorm draws of the stochastic pandemic
+    functions. The samples are drawn at once with numpy, redrawing only the ones below the bound.
+    :param death_factor: The death factor, a scalar or an array broadcastable to 'size'.
+    :param size: The shape of the samples.
+    :param rng: The random generator to draw from.
+    :return: Numpy array of survival factors.
+    """
+    survival = np.broadcast_to(1 - np.asarray(death_factor, dtype=float), size)
+    samples = rng.normal(survival, STD)
+    count(RNG_DRAWS, samples.size)
+    rejected = samples < UPPER_BOUND
+    while np.any(rejected):
+        samples[rejected] = rng.normal(survival[rejected], STD)
+        count(RNG_DRAWS, np.count_nonzero(rejected))
+        rejected = samples < UPPER_BOUND
+    return samples
+
+
+def _apply_stochastic_death_factors(colony_birds: np.ndarray, lone_birds: np.ndarray, hit: np.ndarray,
+                                    params: Params, rng: np.random.Generator) -> None:
+    """
+    Applies randomly sampled death factors to the replicates that were hit by a pandemic.
+    """
+    if not np.any(hit):
+        return
+    colony_birds *= np.where(hit, sample_survival_factors(params.c_death_factor, colony_birds.shape, rng), 1)
+    if np.any(np.asarray(params.l_death_factor) > 0):
+        lone_hit = hit & (np.asarray(params.l_death_factor) > 0)
+        lone_birds *= np.where(lone_hit, sample_survival_factors(params.l_death_factor, lone_birds.shape, rng), 1)
+
+
+def deterministic_pandemic_function_batch(colony_birds: np.ndarray, lone_birds: np.ndarray, i: int, params: Params,
+                                          rng: np.random.Generator = None) -> None:
+    """
+    Batched version of deterministic_pandemic_function.
+    :param colony_birds: Numpy array of the colony birds populations of all replicates at generation i.
+    :param lone_birds: Numpy array of the lone birds populations of all replicates at generation i.
+    :param i: Generation number
+    :param params: A dataclass containing all the relevant parameters.
+    :param rng: Unused, kept for a uniform signature.
+    :return: None
+    """
+    hit = deterministic_pandemic_mask(i, params.pandemic_rate)
+    colony_birds *= np.where(hit, 1 - np.asarray(params.c_death_factor), 1)
+    lone_birds *= np.where(hit, 1 - np.asarray(params.l_death_factor), 1)
+
+
+def stochastic_at_death_factor_pandemic_function_batch(colony_birds: np.ndarray, lone_birds: np.ndarray, i: int,
+                                                       params: Params, rng: np.random.Generator) -> None:
+    """
+    Batched version of stochastic_at_death_factor_pandemic_function.
+    :param colony_birds: Numpy array of the colony birds populations of all replicates at generation i.
+    :param lone_birds: Numpy array of the lone birds populations of all replicates at generation i.
+    :param i: Generation number
+    :param params: A dataclass containing all the relevant parameters.
+    :param rng: The random generator of the ensemble.
+    :return: None
+    """
+    hit = np.broadcast_to(deterministic_pandemic_mask(i, params.pandemic_rate), colony_birds.shape)
+    _apply_stochastic_death_factors(colony_birds, lone_birds, hit, params, rng)
+
+
+def stochastic_at_pandemic_rate_pandemic_function_batch(colony_birds: np.ndarray, lone_birds: np.ndarray, i: int,
+                                                        params: Params, rng: np.random.Generator) -> None:
+    """
+    Batched version of stochastic_at_pandemic_rate_pandemic_function.
+    :param colony_birds: Numpy array of the colony birds populations of all replicates at generation i.
+    :param lone_birds: Numpy array of the lone birds populations of all replicates at generation i.
+    :param i: Generation number
+    :param params: A dataclass containing all the relevant parameters.
+    :param rng: The random generator of the ensemble.
+    :return: None
+    """
+    hit = rng.random(colony_birds.shape) < params.pandemic_rate
+    count(RNG_DRAWS, hit.size)
+    colony_birds *= np.where(hit, 1 - np.asarray(params.c_death_factor), 1)
+    lone_birds *= np.where(hit, 1 - np.asarray(params.l_death_factor), 1)
+
+
+def stochastic_at_both_pandemic_function_batch(colony_birds: np.ndarray, lone_birds: np.ndarray, i: int,
+                                               params: Params, rng: np.random.Generator) -> None:
+    """
+    Batched version of stochastic_at_both_pandemic_function.
+    :param colony_birds: Numpy array of the colony birds populations of all replicates at generation i.
+    :param lone_birds: Numpy array of the lone birds populations of all replicates at generation i.
+    :param i: Generation number
+    :param params: A dataclass containing all the relevant parameters.
+    :param rng: The random generator of the ensemble.
+    :return: None
+    """
+    hit = rng.random(colony_birds.shape) < params.pandemic_rate
+    count(RNG_DRAWS, hit.size)
+    _apply_stochastic_death_factors(colony_birds, lone_birds, hit, params, rng)
+
+
+def types_shift_model_deter_function_batch(colony_birds: np.ndarray, lone_birds: np.ndarray, i: int,
+                                           params: Params, rng: np.random.Generator = None) -> None:
+    """
+    Batched version of types_shift_model_deter_function.
+    :param colony_birds: Numpy array of the colony birds populations of all replicates at generation i.
+    :param lone_birds: Numpy array of the lone birds populations of all replicates at generation i.
+    :param i: Generation number
+    :param params: A dataclass containing all the relevant parameters.
+    :param rng: Unused, kept for a uniform signature.
+    :return: None
+    """
+    deterministic_pandemic_function_batch(colony_birds, lone_birds, i, params)
+    type_shift_batch(colony_birds, lone_birds, params)
+
+
+def types_shift_model_stoch_function_batch(colony_birds: np.ndarray, lone_birds: np.ndarray, i: int,
+                                           params: Params, rng: np.random.Generator) -> None:
+    """
+    Batched version of types_shift_model_stoch_function.
+    :param colony_birds: Numpy array of the colony birds populations of all replicates at generation i.
+    :param lone_birds: Numpy array of the lone birds populations of all replicates at generation i.
+    :param i: Generation number
+    :param params: A dataclass containing all the relevant parameters.
+    :param rng: The random generator of the ensemble.
+    :return: None
+    """
+    stochastic_at_both_pandemic_function_batch(colony_birds, lone_birds, i, params, rng)
+    type_shift_batch(colony_birds, lone_birds, params)
+
+
+def type_shift_batch(colony_birds: np.ndarray, lone_birds: np.ndarray, params: Params) -> None:
+    """
+    Batched version of type_shift, for the populations of all replicates at one generation.
+    """
+    colony_to_lone = colony_birds * params.shift_factor
+    lone_to_colony = lone_birds * params.shift_factor
+    colony_to_lone = np.where(colony_to_lone >= 1, colony_to_lone, 0)
+    lone_to_colony = np.where(lone_to_colony >= 1, lone_to_colony, 0)
+    colony_birds += lone_to_colony - colony_to_lone
+    lone_birds += colony_to_lone - lone_to_colony
+
+
+# Maps each pandemic function to its batched version.
+BATCH_PANDEMIC_FUNCTIONS = {
+    deterministic_pandemic_function: deterministic_pandemic_function_batch,
+    stochastic_at_death_factor_pandemic_function: stochastic_at_death_factor_pandemic_function_batch,
+    stochastic_at_pandemic_rate_pandemic_function: stochastic_at_pandemic_rate_pandemic_function_batch,
+    stochastic_at_both_pandemic_function: stochastic_at_both_pandemic_function_batch,
+    types_shift_model_deter_function: types_shift_model_deter_function_batch,
+    types_shift_model_stoch_function: types_shift_model_stoch_function_batch,
+}
+
+# The pandemic functions whose runs don't depend on the random generator.
+DETERMINISTIC_PANDEMIC_FUNCTIONS = {deterministic_pandemic_function, types_shift_model_deter_function,
+                                    deterministic_pandemic_function_batch, types_shift_model_deter_function_batch}
 
+# The pandemic functions whose pandemics hit exactly the generations that are multiples of 1 / pandemic_rate.
+FIXED_TIMING_PANDEMIC_FUNCTIONS = DETERMINISTIC_PANDEMIC_FUNCTIONS | {stochastic_at_death_factor_pandemic_function,
+                                                                     stochastic_at_death_factor_pandemic_function_batch}
 
+# The pandemic functions that shift birds between the types after the pandemics.
+TYPE_SHIFT_PANDEMIC_FUNCTIONS = {types_shift_model_deter_function, types_shift_model_stoch_function,
+                                 types_shift_model_deter_function_batch, types_shift_model_stoch_function_batch}
 
+# The pandemic function of each model.
+MODEL_PANDEMIC_FUNCTIONS = {
+    Model.DETER: deterministic_pandemic_function,
+    Model.STOCHASTIC1: stochastic_at_death_factor_pandemic_function,
+    Model.STOCHASTIC2: stochastic_at_pandemic_rate_pandemic_function,
+    Model.STOCHASTIC3: stochastic_at_both_pandemic_function,
+    Model.TYPE_SHIFT: types_shift_model_deter_function,
+    Model.STOCHASTIC_TYPE_SHIFT: types_shift_model_stoch_function,
+}
@@ -0,0 +1,128 @@
+import numpy as np
+from dataclasses import dataclass
+from utils.Auxiliary import Params
+from typing import Callable
+from discrete_model.pandemic_functions import stochastic_at_death_factor_pandemic_function, \
+    stochastic_at_pandemic_rate_pandemic_function, stochastic_at_both_pandemic_function, \
+    stochastic_at_death_factor_pandemic_function_batch, stochastic_at_pandemic_rate_pandemic_function_batch, \
+    stochastic_at_both_pandemic_function_batch, sample_survival_factors, types_shift_model_stoch_function, \
+    types_shift_model_stoch_function_batch, type_shift, type_shift_batch, TYPE_SHIFT_PANDEMIC_FUNCTIONS
+from utils.Instrumentation import timed, count, RNG, RNG_DRAWS
+
+
+@dataclass
+class PandemicSchedule:
+    """
+    A dataclass that contains the pre-sampled pandemics of a batch of runs: the fraction of colony and lone birds
+    surviving at each generation of each run. Generations without a pandemic have a survival factor of 1.
+    Both arrays are of shape (num_of_runs, num_of_generations). With type_shift, the pandemics are followed by the
+    type shifting of the types shift model.
+    """
+    colony_survival: np.ndarray
+    lone_survival: np.ndarray
+    type_shift: bool = False
+
+    def apply(self, colony_birds: np.ndarray, lone_birds: np.ndarray, i: int, params: Params,
+              rng: np.random.Generator = None) -> None:
+        """
+        A batched pandemic function that applies the pandemics of generation i to the populations of all the runs.
+        """
+        colony_birds *= self.colony_survival[:, i]
+        lone_birds *= self.lone_survival[:, i]
+        if self.type_shift:
+            type_shift_batch(colony_birds, lone_birds, params)
+
+    def single_run_pandemic_function(self, run: int = 0) -> Callable:
+        """
+        Returns a pandemic function for logistic_growth_model that applies the pandemics of the given run.
+        """
+        colony_survival, lone_survival = self.colony_survival[run], self.lone_survival[run]
+
+        def scheduled_pandemic_function(colony_birds: np.ndarray, lone_birds: np.ndarray, i: int,
+                                        params: Params) -> None:
+            colony_birds[i] *= colony_survival[i]
+            lone_birds[i] *= lone_survival[i]
+            if self.type_shift:
+                type_shift(colony_birds, lone_birds, i, params)
+
+        return scheduled_pandemic_function
+
+
+@timed(RNG)
+def generate_pandemic_schedule(params: Params, num_of_runs: int, random_timing: bool, random_severity: bool,
+                               rng: np.random.Generator) -> PandemicSchedule:
+    """
+    Draws all the pandemics of a batch of runs at once.
+    :param params: A dataclass containing all the relevant parameters. Each parameter may also be an array with
+    one value per run.
+    :param num_of_runs: The number of runs.
+    :param random_timing: Whether a pandemic hits each generation with probability pandemic_rate, or exactly every
+    1 / pandemic_rate generations.
+    :param random_severity: Whether the death factors are sampled around c_death_factor and l_death_factor, or
+    applied as they are.
+    :param rng: The random generator to draw from.
+    :return: The schedule of the pandemics.
+    """
+    shape = (num_of_runs, params.num_of_generations)
+    pandemic_rate, c_death_factor, l_death_factor = (_per_run(value) for value in
+                                                     (params.pandemic_rate, params.c_death_factor,
+                                                      params.l_death_factor))
+
+    if random_timing:
+        hit = rng.random(shape) < pandemic_rate
+        count(RNG_DRAWS, hit.size)
+    else:
+        with np.errstate(divide='ignore'):
+            hit = np.broadcast_to(np.mod(np.arange(params.num_of_generations), 1 / pandemic_rate) == 0, shape).copy()
+    # The pandemic function is never applied to the initial generation
+    hit[:, 0] = False
+
+    colony_survival, lone_survival = np.ones(shape), np.ones(shape)
+    if random_severity:
+        lone_hit = hit & (np.broadcast_to(l_death_factor, shape) > 0)
+        colony_survival[hit] = sample_survival_factors(np.broadcast_to(c_death_factor, shape)[hit],
+                                                       np.count_nonzero(hit), rng)
+        lone_survival[lone_hit] = sample_survival_factors(np.broadcast_to(l_death_factor, shape)[lone_hit],
+                                                          np.count_nonzero(lone_hit), rng)
+    else:
+        colony_survival[hit] = np.broadcast_to(1 - c_death_factor, shape)[hit]
+        lone_survival[hit] = np.broadcast_to(1 - l_death_factor, shape)[hit]
+
+    return PandemicSchedule(colony_survival, lone_survival)
+
+
+def _per_run(value) -> np.ndarray:
+    """
+    Reshapes a parameter with one value per run to a column, so it broadcasts over the generations.
+    """
+    value = np.asarray(value, dtype=float)
+    return value.reshape(-1, 1) if value.ndim else value
+
+
+# Maps each stochastic pandemic function, and its batched version, to the randomness of its pandemics:
+# (random timing, random severity).
+SCHEDULE_TYPES = {
+    stochastic_at_death_factor_pandemic_function: (False, True),
+    stochastic_at_death_factor_pandemic_function_batch: (False, True),
+    stochastic_at_pandemic_rate_pandemic_function: (True, False),
+    stochastic_at_pandemic_rate_pandemic_function_batch: (True, False),
+    stochastic_at_both_pandemic_function: (True, True),
+    stochastic_at_both_pandemic_function_batch: (True, True),
+    types_shift_model_stoch_function: (True, True),
+    types_shift_model_stoch_function_batch: (True, True),
+}
+
+
+def schedule_for(pandemic_function: Callable, params: Params, num_of_runs: int,
+                 rng: np.random.Generator = None) -> PandemicSchedule:
+    """
+    Pre-samples the pandemics of a stochastic pandemic function for a batch of runs.
+    :return: The schedule, or None if the pandemic function has no schedule type.
+    """
+    if pandemic_function not in SCHEDULE_TYPES:
+        return None
+    random_timing, random_severity = SCHEDULE_TYPES[pandemic_function]
+    rng = np.random.default_rng() if rng is None else rng
+    schedule = generate_pandemic_schedule(params, num_of_runs, random_timing, random_severity, rng)
+    schedule.type_shift = pandemic_function in TYPE_SHIFT_PANDEMIC_FUNCTIONS
+    return schedule
@@ -0,0 +1,97 @@
+import os
+import numpy as np
+from dataclasses import replace
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from utils.Auxiliary import Params
+from typing import Callable, List, Tuple
+from discrete_model.ensemble_model import ensemble_outcome_fractions
+from discrete_model.adaptive_replicates import adaptive_outcome_fractions, DEFAULT_BATCH_SIZE, DEFAULT_MAX_RUNS
+
+# The number of chunks each worker gets on average, when the chunk size is not given.
+CHUNKS_PER_WORKER = 4
+
+
+def run_stoch_heatmap_parallel(num_of_runs: int, pandemic_function: Callable, pandemic_rates: np.ndarray,
+                               death_factors: np.ndarray, params: Params, seed: int = None,
+                               num_of_workers: int = None,
+                               chunk_size: int = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Runs the stochastic model on every (pandemic rate, colony death factor) cell, splitting the cells between
+    worker processes. Every cell gets its own random stream spawned from 'seed', so the result doesn't depend
+    on the number of workers or on the chunking.
+    :param num_of_runs: The number of replicates in each cell.
+    :param pandemic_function: The stochastic model function.
+    :param pandemic_rates: Pandemic rate values (rows).
+    :param death_factors: Colony death factor values (columns).
+    :param params: The rest of the parameters.
+    :param seed: Seed for the random streams of the cells. Fresh entropy is used if not given.
+    :param num_of_workers: The number of worker processes. Defaults to the number of CPUs, 1 runs serially.
+    :param chunk_size: The number of cells sent to a worker at once.
+    :return: Three matrices of shape (pandemic_rates.size, death_factors.size) - the fractions of colony wins,
+    lone wins and coexistence in each cell.
+    """
+    cell_function = partial(ensemble_outcome_fractions, pandemic_function=pandemic_function, num_of_runs=num_of_runs)
+    return run_cells_parallel(cell_function, pandemic_rates, death_factors, params, seed, num_of_workers, chunk_size)
+
+
+def run_adaptive_stoch_heatmap_parallel(pandemic_function: Callable, pandemic_rates: np.ndarray,
+                                        death_factors: np.ndarray, params: Params, target_width: float,
+                                        batch_size: int = DEFAULT_BATCH_SIZE, max_runs: int = DEFAULT_MAX_RUNS,
+                                        seed: int = None, num_of_workers: int = None, chunk_size: int = None) \
+        -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Like run_stoch_heatmap_parallel, but each cell runs replicates in batches until the confidence intervals of its
+    fractions are narrower than 'target_width' (see adaptive_outcome_fractions).
+    :return: Four matrices of shape (pandemic_rates.size, death_factors.size) - the fractions of colony wins,
+    lone wins and coexistence, and the number of replicates run in each cell.
+    """
+    cell_function = partial(adaptive_outcome_fractions, pandemic_function=pandemic_function,
+                            target_width=target_width, batch_size=batch_size, max_runs=max_runs)
+    return run_cells_parallel(cell_function, pandemic_rates, death_factors, params, seed, num_of_workers, chunk_size)
+
+
+def run_cells_parallel(cell_function: Callable, pandemic_rates: np.ndarray, death_factors: np.ndarray,
+                       params: Params, seed: int = None, num_of_workers: int = None,
+                       chunk_size: int = None) -> Tuple[np.ndarray, ...]:
+    """
+    Evaluates a function on every (pandemic rate, colony death factor) cell, splitting the cells between worker
+    processes.
+    :param cell_function: A picklable function that gets 'params' and 'rng' keyword arguments, and returns a tuple
+    of numbers.
+    :param pandemic_rates: Pandemic rate values (rows).
+    :param death_factors: Colony death factor values (columns).
+    :param params: The rest of the parameters.
+    :param seed: Seed for the random streams of the cells. Fresh entropy is used if not given.
+    :param num_of_workers: The number of worker processes. Defaults to the number of CPUs, 1 runs serially.
+    :param chunk_size: The number of cells sent to a worker at once.
+    :return: A matrix of shape (pandemic_rates.size, death_factors.size) for each value that the function returns.
+    """
+    num_of_workers = os.cpu_count() if num_of_workers is None else num_of_workers
+    shape = (pandemic_rates.size, death_factors.size)
+    cell_seeds = np.random.SeedSequence(seed).spawn(int(np.prod(shape)))
+    grid = [(rate, factor) for rate in pandemic_rates for factor in death_factors]
+    cells = [(rate, factor, cell_seed) for (rate, factor), cell_seed in zip(grid, cell_seeds)]
+
+    if num_of_workers == 1:
+        results = _run_cells_chunk(cell_function, params, cells)
+    else:
+        if chunk_size is None:
+            chunk_size = max(1, -(-len(cells) // (num_of_workers * CHUNKS_PER_WORKER)))
+        chunks = [cells[start:start + chunk_size] for start in range(0, len(cells), chunk_size)]
+        with ProcessPoolExecutor(max_workers=num_of_workers) as executor:
+            futures = [executor.submit(_run_cells_chunk, cell_function, params, chunk) for chunk in chunks]
+            results = [cell_result for future in futures for cell_result in future.result()]
+
+    return tuple(np.reshape(mat, shape) for mat in zip(*results))
+
+
+def _run_cells_chunk(cell_function: Callable, params: Params,
+                     cells: List[Tuple[float, float, np.random.SeedSequence]]) -> List[Tuple]:
+    """
+    Evaluates the cell function on a chunk of heatmap cells. Executed inside a worker process.
+    :return: The result of each cell.
+    """
+    return [cell_function(params=replace(params, pandemic_rate=rate, c_death_factor=factor),
+                          rng=np.random.default_rng(cell_seed))
+            for rate, factor, cell_seed in cells]
@@ -0,0 +1,225 @@
+import numpy as np
+from dataclasses import replace
+from utils.Auxiliary import Params
+from typing import Callable, Tuple
+from discrete_model.ensemble_model import run_single_iteration_batch, LAST_GENERATIONS
+from discrete_model.logistic_growth_model import EXTINCTION_THRESHOLD
+from discrete_model.pandemic_functions import deterministic_pandemic_function, deterministic_pandemic_function_batch, \
+    deterministic_pandemic_mask
+from discrete_model.convergence import CONVERGENCE_TOLERANCE
+
+# Every how many iterations of the period map a Newton step is attempted.
+NEWTON_INTERVAL = 4
+# Relative step of the finite differences of the Jacobian.
+JACOBIAN_STEP = 1e-7
+PERIOD_MAP_PANDEMIC_FUNCTIONS = {deterministic_pandemic_function, deterministic_pandemic_function_batch}
+
+
+def pandemic_period(params: Params) -> int:
+    """
+    Finds the period in generations of the deterministic pandemics, from the generations they hit during the
+    simulation. Pandemics after the last generation are ignored.
+    :return: The period, 1 if no pandemic hits, or None if the pandemics are not periodic.
+    """
+    hits = np.flatnonzero(deterministic_pandemic_mask(np.arange(1, params.num_of_generations),
+                                                      params.pandemic_rate)) + 1
+    if hits.size == 0:
+        return 1
+    return int(hits[0]) if np.array_equal(hits, hits[0] * np.arange(1, hits.size + 1)) else None
+
+
+def apply_period_map(colony_birds: np.ndarray, lone_birds: np.ndarray, params: Params, period: int,
+                     with_pandemic: bool) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Advances the populations by one period - 'period' iterations of the model, then the pandemic.
+    :param colony_birds: The colony birds populations just after a pandemic (or at generation 0).
+    :param lone_birds: The lone birds populations, of the same shape.
+    :param params: The parameters, scalars or arrays of the shape of the populations.
+    :param period: The period of the pandemics.
+    :param with_pandemic: Whether the pandemic hits at the end of the period.
+    :return: The populations just after the next pandemic.
+    """
+    for _ in range(period):
+        colony_birds, lone_birds = run_single_iteration_batch(colony_birds, lone_birds, params)
+    if with_pandemic:
+        colony_birds = colony_birds * (1 - np.asarray(params.c_death_factor))
+        lone_birds = lone_birds * (1 - np.asarray(params.l_death_factor))
+    return colony_birds, lone_birds
+
+
+def solve_period_map(params: Params, period: int, with_pandemic: bool,
+                     max_generations: int = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Finds the fixed point of the period map that the trajectory from the initial populations converges to.
+    The map is iterated from the initial populations, and every NEWTON_INTERVAL iterations a Newton step (with a
+    finite differences Jacobian) is attempted. A Newton step is accepted only where the fixed point is stable, the
+    step reduces the residual, and it stays within the distance that the contracting iteration itself could still
+    travel. So Newton only accelerates the convergence to the fixed point the trajectory is heading to.
+    :param params: The parameters, each may be an array with one value per cell (all cells with the same period).
+    :param period: The period of the pandemics.
+    :param with_pandemic: Whether a pandemic hits at the end of each period.
+    :param max_generations: The maximal number of simulated generations. Defaults to num_of_generations.
+    :return: The colony and lone birds populations at the fixed point (just after a pandemic), and whether each cell
+    converged.
+    """
+    max_generations = params.num_of_generations if max_generations is None else max_generations
+    num_of_cells = max(np.size(value) for value in (params.pandemic_rate, params.c_death_factor,
+                                                    params.l_death_factor, params.selection_coefficient,
+                                                    params.growth_rate, params.init_birds_num,
+                                                    params.carrying_capacity))
+    tolerance = CONVERGENCE_TOLERANCE * np.asarray(params.carrying_capacity, dtype=float)
+    extinction_level = EXTINCTION_THRESHOLD * np.asarray(params.carrying_capacity, dtype=float)
+    colony_birds = np.broadcast_to(params.init_birds_num, num_of_cells).astype(float)
+    lone_birds = colony_birds.copy()
+    converged = np.zeros(num_of_cells, dtype=bool)
+
+    def period_map(colony, lone):
+        return apply_period_map(colony, lone, params, period, with_pandemic)
+
+    for iteration in range(1, max(1, max_generations // period) + 1):
+        next_colony, next_lone = period_map(colony_birds, lone_birds)
+        step = np.hypot(next_colony - colony_birds, next_lone - lone_birds)
+        converged |= step <= tolerance
+        colony_birds = np.where(converged, colony_birds, next_colony)
+        lone_birds = np.where(converged, lone_birds, next_lone)
+        if np.all(converged):
+            break
+        if iteration % NEWTON_INTERVAL == 0:
+            colony_birds, lone_birds, converged = _newton_step(period_map, colony_birds, lone_birds, converged,
+                                                               tolerance, extinction_level)
+
+    return colony_birds, lone_birds, converged
+
+
+def period_map_colony_fraction(params: Params, pandemic_function: Callable = deterministic_pandemic_function,
+                               window: int = LAST_GENERATIONS) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calculates the asymptotic average fraction of colony birds of the deterministic model from the fixed point of
+    its period map, without simulating the transient. The fraction is averaged over the generations of the orbit
+    that fall in the last 'window' generations, so it's comparable to the fraction of a full simulation.
+    :param params: The parameters, each may be an array with one value per cell. Cells are grouped by period.
+    :param pandemic_function: deterministic_pandemic_function or its batched version.
+    :param window: The number of last generations over which the fraction of colony birds is averaged.
+    :return: The asymptotic fraction of colony birds, and whether the period map converged, for each cell.
+    Cells whose pandemics are not periodic are NaN and not converged.
+    """
+    if pandemic_function not in PERIOD_MAP_PANDEMIC_FUNCTIONS:
+        raise ValueError(f"The period map supports only {deterministic_pandemic_function.__name__}")
+    cells_params = _broadcast_params(params)
+    num_of_cells = cells_params.pandemic_rate.size
+    fractions, converged = np.full(num_of_cells, np.nan), np.zeros(num_of_cells, dtype=bool)
+    periods = np.array([pandemic_period(replace(params, pandemic_rate=rate)) or 0
+                        for rate in cells_params.pandemic_rate])
+    # The period is 1 both without pandemics and with a pandemic every generation
+    with_pandemic = deterministic_pandemic_mask(periods, cells_params.pandemic_rate)
+
+    for period in np.unique(periods[periods > 0]):
+        for pandemic in (False, True):
+            cells = (periods == period) & (with_pandemic == pandemic)
+            if not np.any(cells):
+                continue
+            group_params = _select_cells(cells_params, cells)
+            colony_birds, lone_birds, converged[cells] = solve_period_map(group_params, int(period), pandemic)
+            fractions[cells] = _orbit_window_fraction(colony_birds, lone_birds, group_params, int(period), window)
+
+    return fractions, converged
+
+
+def period_map_pr_df_colony_fraction(params: Params, pandemic_function: Callable, pandemic_rates: np.ndarray,
+                                     death_factors: np.ndarray) -> np.ndarray:
+    """
+    Calculates the (pandemic rate, colony death factor) heatmap matrix of the asymptotic average fraction of colony
+    birds from the period map. Cells that didn't converge get the fraction at their last iterate.
+    :param params: The rest of the parameters.
+    :param pandemic_function: deterministic_pandemic_function or its batched version.
+    :param pandemic_rates: Pandemic rate values (rows).
+    :param death_factors: Colony death factor values (columns).
+    :return: A matrix of shape (pandemic_rates.size, death_factors.size).
+    """
+    rates_grid, death_factors_grid = np.meshgrid(pandemic_rates, death_factors, indexing='ij')
+    fractions, _ = period_map_colony_fraction(replace(params, pandemic_rate=rates_grid.ravel(),
+                                                      c_death_factor=death_factors_grid.ravel()), pandemic_function)
+    return fractions.reshape(rates_grid.shape)
+
+
+def _orbit_window_fraction(colony_birds: np.ndarray, lone_birds: np.ndarray, params: Params, period: int,
+                           window: int) -> np.ndarray:
+    """
+    Averages the fraction of colony birds over the generations of the periodic orbit that fall in the last 'window'
+    generations. Generation g of the orbit is g % period generations after a pandemic.
+    """
+    orbit_fractions = []
+    for phase in range(period):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            orbit_fractions.append(colony_birds / (colony_birds + lone_birds))
+        colony_birds, lone_birds = run_single_iteration_batch(colony_birds, lone_birds, params)
+    phases = np.arange(max(params.num_of_generations - window, 0), params.num_of_generations) % period
+    return np.average(np.array(orbit_fractions)[phases], axis=0)
+
+
+def _newton_step(period_map: Callable, colony_birds: np.ndarray, lone_birds: np.ndarray, converged: np.ndarray,
+                 tolerance: np.ndarray, extinction_level: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Attempts a Newton step towards the fixed point of the period map for the cells that haven't converged.
+    :param tolerance: The convergence tolerance of each cell.
+    :param extinction_level: The population below which a type goes extinct, in each cell.
+    :return: The populations after the accepted steps, and whether each cell converged.
+    """
+    next_colony, next_lone = period_map(colony_birds, lone_birds)
+    residual = np.stack([next_colony - colony_birds, next_lone - lone_birds], axis=-1)
+    jacobian = _jacobian(period_map, colony_birds, lone_birds, next_colony, next_lone)
+
+    spectral_radius = np.max(np.abs(np.linalg.eigvals(jacobian)), axis=-1)
+    system = jacobian - np.eye(2)
+    invertible = np.abs(np.linalg.det(system)) > 1e-12
+    safe_system = np.where(invertible[:, None, None], system, np.eye(2))
+    newton_step = -np.linalg.solve(safe_system, residual[..., None])[..., 0]
+    # A population heading below the extinction threshold goes extinct rather than converging to zero
+    candidate_colony = np.where(colony_birds + newton_step[:, 0] < extinction_level, 0.,
+                                colony_birds + newton_step[:, 0])
+    candidate_lone = np.where(lone_birds + newton_step[:, 1] < extinction_level, 0., lone_birds + newton_step[:, 1])
+    newton_step = np.stack([candidate_colony - colony_birds, candidate_lone - lone_birds], axis=-1)
+
+    # The iteration contracts by the spectral radius, so its fixed point is at most this far away
+    with np.errstate(divide='ignore'):
+        reach = 2 * np.hypot(residual[:, 0], residual[:, 1]) / (1 - spectral_radius)
+    mapped_colony, mapped_lone = period_map(candidate_colony, candidate_lone)
+    candidate_residual = np.hypot(mapped_colony - candidate_colony, mapped_lone - candidate_lone)
+    accepted = (~converged & invertible & (spectral_radius < 1) &
+                (np.hypot(newton_step[:, 0], newton_step[:, 1]) <= reach) &
+                (candidate_residual < np.hypot(residual[:, 0], residual[:, 1])))
+
+    return (np.where(accepted, candidate_colony, colony_birds), np.where(accepted, candidate_lone, lone_birds),
+            converged | (accepted & (candidate_residual <= tolerance)))
+
+
+def _jacobian(period_map: Callable, colony_birds: np.ndarray, lone_birds: np.ndarray, next_colony: np.ndarray,
+              next_lone: np.ndarray) -> np.ndarray:
+    """
+    Calculates the Jacobian of the period map of each cell with forward finite differences.
+    :return: An array of shape (number of cells, 2, 2).
+    """
+    step = JACOBIAN_STEP * np.maximum(np.abs(colony_birds) + np.abs(lone_birds), 1)
+    colony_shifted = period_map(colony_birds + step, lone_birds)
+    lone_shifted = period_map(colony_birds, lone_birds + step)
+    jacobian = np.empty(colony_birds.shape + (2, 2))
+    jacobian[:, 0, 0], jacobian[:, 1, 0] = (colony_shifted[0] - next_colony) / step, \
+        (colony_shifted[1] - next_lone) / step
+    jacobian[:, 0, 1], jacobian[:, 1, 1] = (lone_shifted[0] - next_colony) / step, (lone_shifted[1] - next_lone) / step
+    return jacobian
+
+
+def _broadcast_params(params: Params) -> Params:
+    """
+    Broadcasts the scalar and array parameters to 1D arrays of the same size.
+    """
+    names = ("pandemic_rate", "c_death_factor", "selection_coefficient", "l_death_factor", "growth_rate",
+             "init_birds_num", "carrying_capacity")
+    arrays = np.broadcast_arrays(*(np.atleast_1d(np.asarray(getattr(params, name), dtype=float)) for name in names))
+    return replace(params, **{name: array.ravel() for name, array in zip(names, arrays)})
+
+
+def _select_cells(params: Params, cells: np.ndarray) -> Params:
+    names = ("pandemic_rate", "c_death_factor", "selection_coefficient", "l_death_factor", "growth_rate",
+             "init_birds_num", "carrying_capacity")
+    return replace(params, **{name: getattr(params, name)[cells] for name in names})
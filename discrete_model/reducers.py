@@ -0,0 +1,147 @@
+import numpy as np
+from abc import ABC, abstractmethod
+from typing import Callable
+
+# Online reducers that summarize a simulation one generation at a time, so that the populations of all
+# generations never have to be stored. Each reducer gets the populations of all the runs at each generation,
+# as arrays of the same shape.
+
+
+def colony_fraction(colony_birds: np.ndarray, lone_birds: np.ndarray) -> np.ndarray:
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return colony_birds / (colony_birds + lone_birds)
+
+
+def total_population(colony_birds: np.ndarray, lone_birds: np.ndarray) -> np.ndarray:
+    return colony_birds + lone_birds
+
+
+def colony_population(colony_birds: np.ndarray, lone_birds: np.ndarray) -> np.ndarray:
+    return colony_birds
+
+
+def lone_population(colony_birds: np.ndarray, lone_birds: np.ndarray) -> np.ndarray:
+    return lone_birds
+
+
+class Reducer(ABC):
+    """
+    An abstract online reducer of a simulation.
+    """
+    @abstractmethod
+    def update(self, colony_birds: np.ndarray, lone_birds: np.ndarray, i: int) -> None:
+        """
+        Feeds the populations of generation i to the reducer. Generations are fed in order, starting from 0.
+        """
+        pass
+
+    @abstractmethod
+    def result(self) -> np.ndarray:
+        """
+        Returns the reduction of all the generations fed so far, one value per run.
+        """
+        pass
+
+
+class TrailingMean(Reducer):
+    """
+    The average of a metric over the last 'window' generations. Keeps only the populations of the last 'window'
+    generations, the metric is calculated when the result is requested.
+    """
+    def __init__(self, window: int, metric: Callable = colony_fraction):
+        self.window = window
+        self.metric = metric
+        self._colony_buffer, self._lone_buffer = None, None
+        self._count = 0
+
+    def update(self, colony_birds, lone_birds, i):
+        if self._colony_buffer is None:
+            self._colony_buffer = np.empty((self.window,) + np.shape(colony_birds))
+            self._lone_buffer = np.empty((self.window,) + np.shape(lone_birds))
+        self._colony_buffer[i % self.window] = colony_birds
+        self._lone_buffer[i % self.window] = lone_birds
+        self._count += 1
+
+    def result(self):
+        filled = min(self._count, self.window)
+        return np.average(self.metric(self._colony_buffer[:filled], self._lone_buffer[:filled]), axis=0)
+
+
+class Maximum(Reducer):
+    """
+    The maximum of a metric over all the generations.
+    """
+    def __init__(self, metric: Callable = total_population):
+        self.metric = metric
+        self._maximum = None
+
+    def update(self, colony_birds, lone_birds, i):
+        value = self.metric(colony_birds, lone_birds)
+        self._maximum = np.array(value) if self._maximum is None else np.maximum(self._maximum, value)
+
+    def result(self):
+        return self._maximum
+
+
+class Minimum(Reducer):
+    """
+    The minimum of a metric over all the generations.
+    """
+    def __init__(self, metric: Callable = total_population):
+        self.metric = metric
+        self._minimum = None
+
+    def update(self, colony_birds, lone_birds, i):
+        value = self.metric(colony_birds, lone_birds)
+        self._minimum = np.array(value) if self._minimum is None else np.minimum(self._minimum, value)
+
+    def result(self):
+        return self._minimum
+
+
+class ExtinctionTime(Reducer):
+    """
+    The first generation in which both populations are extinct, NaN for runs that survived.
+    """
+    def __init__(self):
+        self._extinction_time = None
+
+    def update(self, colony_birds, lone_birds, i):
+        if self._extinction_time is None:
+            self._extinction_time = np.full(np.shape(colony_birds), np.nan)
+        extinct = (colony_birds == 0) & (lone_birds == 0) & np.isnan(self._extinction_time)
+        self._extinction_time[extinct] = i
+
+    def result(self):
+        return self._extinction_time
+
+
+class EndpointMetrics(Reducer):
+    """
+    The average fraction of colony birds in the last 'window' generations, the extinction time and the minimum total
+    population of runs with different numbers of generations, simulated together for the longest of them. Each run
+    only counts its own generations.
+    The extinction time is the first generation in which both populations are extinct, or the number of generations
+    of runs that survived. The result is of shape (number of runs, 3).
+    """
+    def __init__(self, num_of_generations: np.ndarray, window: int):
+        self.num_of_generations = np.asarray(num_of_generations)
+        self.window = window
+        self._fraction_sum, self._fraction_count = 0., 0
+        self._extinction_time = self.num_of_generations.astype(float)
+        self._minimum = np.inf
+
+    def update(self, colony_birds, lone_birds, i):
+        running = i < self.num_of_generations
+        in_window = running & (i >= self.num_of_generations - self.window)
+        self._fraction_sum = self._fraction_sum + np.where(in_window, colony_fraction(colony_birds, lone_birds), 0.)
+        self._fraction_count = self._fraction_count + in_window
+        extinct = running & (colony_birds == 0) & (lone_birds == 0)
+        self._extinction_time = np.where(extinct, np.minimum(self._extinction_time, i), self._extinction_time)
+        self._minimum = np.minimum(self._minimum, np.where(running, total_population(colony_birds, lone_birds),
+                                                           np.inf))
+
+    def result(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fraction = self._fraction_sum / self._fraction_count
+        return np.stack(np.broadcast_arrays(fraction, self._extinction_time, self._minimum), axis=-1)
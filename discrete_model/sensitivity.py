@@ -0,0 +1,257 @@
+import warnings
+import numpy as np
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from utils.Auxiliary import Params, ParamName, ParamBatch
+from typing import Callable, Dict, List, Tuple
+from discrete_model.ensemble_model import reduce_ensemble, LAST_GENERATIONS
+from discrete_model.reducers import EndpointMetrics
+from discrete_model.pandemic_functions import DETERMINISTIC_PANDEMIC_FUNCTIONS
+
+# Output metrics, in the order of the columns of the evaluations
+COLONY_FRACTION, EXTINCTION_TIME, MIN_TOTAL_POPULATION = "colony_fraction", "extinction_time", "min_total_population"
+METRICS = (COLONY_FRACTION, EXTINCTION_TIME, MIN_TOTAL_POPULATION)
+DEFAULT_NUM_OF_TRAJECTORIES = 10
+DEFAULT_NUM_OF_LEVELS = 4
+# A power of 2, which keeps the Sobol sequence balanced
+DEFAULT_NUM_OF_SAMPLES = 256
+# A Sobol index is NaN if the variance of its metric is at most this fraction of the mean square of the metric
+VARIANCE_TOLERANCE = 1e-12
+# How far from 1 / pandemic_rate a snapped pandemic period is searched for, see snap_pandemic_rate
+MAX_PERIOD_OFFSET = 8
+
+
+@dataclass
+class SensitivityProblem:
+    """
+    A dataclass that describes a sensitivity analysis: the parameters that vary, their ranges, and how a point is
+    simulated. Every evaluated point is kept, so the estimators and repeated analyses of the same problem never
+    simulate a point twice.
+    :param params: The values of the parameters that don't vary.
+    :param ranges: Maps each varying parameter to its (low, high) range. num_of_generations is rounded.
+    :param pandemic_function: A pandemic function with a batched version, or a batched pandemic function. The
+    sampled pandemic rates of the deterministic ones are snapped, see snap_pandemic_rate.
+    :param num_of_runs: The number of replicates of each point, for stochastic models. The metrics are averaged over
+    the replicates (the colony fraction over the replicates that didn't go extinct).
+    :param window: The number of last generations over which the fraction of colony birds is averaged.
+    :param seed: Seed for the sample designs and the stochastic models.
+    """
+    params: Params
+    ranges: Dict[ParamName, Tuple[float, float]]
+    pandemic_function: Callable
+    num_of_runs: int = 1
+    window: int = LAST_GENERATIONS
+    seed: int = None
+    _evaluations: Dict[bytes, np.ndarray] = field(default_factory=dict, init=False, repr=False)
+
+    def __post_init__(self):
+        self.rng = np.random.default_rng(self.seed)
+
+    def names(self) -> List[ParamName]:
+        return list(self.ranges)
+
+    def scale(self, unit_points: np.ndarray) -> np.ndarray:
+        """
+        Maps points of the unit hypercube to the parameter ranges.
+        """
+        low, high = np.array(list(self.ranges.values()), dtype=float).T
+        return low + unit_points * (high - low)
+
+    def evaluate(self, unit_points: np.ndarray) -> np.ndarray:
+        """
+        Evaluates the metrics at points of the unit hypercube. The points that weren't evaluated yet are simulated
+        together, in a single batched run.
+        :param unit_points: An array of shape (number of points, number of varying parameters).
+        :return: An array of shape (number of points, len(METRICS)).
+        """
+        keys = [point.tobytes() for point in np.ascontiguousarray(unit_points, dtype=float)]
+        missing = list(dict.fromkeys(key for key in keys if key not in self._evaluations))
+        if missing:
+            points = np.array([np.frombuffer(key) for key in missing])
+            for key, values in zip(missing, simulate_metrics(self.params, self.pandemic_function,
+                                                             dict(zip(self.names(), self.scale(points).T)),
+                                                             self.num_of_runs, self.window, self.rng)):
+                self._evaluations[key] = values
+        return np.array([self._evaluations[key] for key in keys])
+
+    def num_of_evaluations(self) -> int:
+        return len(self._evaluations)
+
+
+@dataclass
+class SensitivityResult:
+    """
+    A dataclass that contains sensitivity indices. Each index is an array of shape (number of parameters,
+    len(METRICS)).
+    """
+    names: List[ParamName]
+    indices: Dict[str, np.ndarray]
+    num_of_evaluations: int
+
+    def index(self, index_name: str, metric: str) -> Dict[ParamName, float]:
+        """
+        :return: The index of each parameter for one metric.
+        """
+        return dict(zip(self.names, self.indices[index_name][:, METRICS.index(metric)]))
+
+
+def simulate_metrics(params: Params, pandemic_function: Callable, values: Dict[ParamName, np.ndarray],
+                     num_of_runs: int = 1, window: int = LAST_GENERATIONS,
+                     rng: np.random.Generator = None) -> np.ndarray:
+    """
+    Simulates the parameter sets given by zipping 'values' in a single batched run, and calculates the metrics.
+    Parameter sets with different numbers of generations are simulated for the longest of them, and every run is
+    measured up to its own number of generations. The pandemic rates of a deterministic pandemic function are
+    snapped with snap_pandemic_rate.
+    :return: An array of shape (number of parameter sets, len(METRICS)), averaged over the replicates.
+    """
+    values = dict(values)
+    if pandemic_function in DETERMINISTIC_PANDEMIC_FUNCTIONS and ParamName.PANDEMIC_RATE in values:
+        values[ParamName.PANDEMIC_RATE] = snap_pandemic_rate(values[ParamName.PANDEMIC_RATE])
+    num_of_generations = np.rint(values.pop(ParamName.NUM_OF_GENERATIONS, params.num_of_generations)).astype(int)
+    batch = ParamBatch(params, {**values, ParamName.NUM_OF_GENERATIONS: np.full(num_of_generations.shape,
+                                                                                np.max(num_of_generations))})
+    reducer = EndpointMetrics(np.repeat(np.broadcast_to(num_of_generations, batch.size), num_of_runs), window)
+    metrics, = reduce_ensemble(batch, pandemic_function, [reducer], num_of_runs, rng)
+    metrics = metrics.reshape(batch.size, num_of_runs, len(METRICS))
+    with _ignore_empty_slices():
+        return np.stack([np.nanmean(metrics[..., 0], axis=1), np.mean(metrics[..., 1], axis=1),
+                         np.mean(metrics[..., 2], axis=1)], axis=-1)
+
+
+def snap_pandemic_rate(pandemic_rate) -> np.ndarray:
+    """
+    Rounds pandemic rates to rates 1 / n with an integer n. A deterministic pandemic hits every generation that is a
+    multiple of 1 / pandemic_rate, so a continuously sampled rate almost never hits at all. Not every n is the exact
+    reciprocal of a float (1 / (1 / 49) isn't 49), so the period is the nearest one that is, at most
+    MAX_PERIOD_OFFSET generations from 1 / pandemic_rate. A rate of zero stays zero.
+    """
+    pandemic_rate = np.asarray(pandemic_rate, dtype=float)
+    with np.errstate(divide='ignore'):
+        period = np.maximum(np.rint(1 / pandemic_rate), 1)
+        snapped = 1 / period
+        found = np.zeros(period.shape, dtype=bool)
+        for offset in sorted(range(-MAX_PERIOD_OFFSET, MAX_PERIOD_OFFSET + 1), key=abs):
+            candidate = np.maximum(period + offset, 1)
+            exact = ~found & (1 / (1 / candidate) == candidate)
+            snapped = np.where(exact, 1 / candidate, snapped)
+            found |= exact
+    return snapped
+
+
+def morris_design(num_of_params: int, num_of_trajectories: int, num_of_levels: int,
+                  rng: np.random.Generator) -> np.ndarray:
+    """
+    Generates Morris trajectories in the unit hypercube. Each trajectory starts at a random point of the level grid
+    and moves one parameter at a time, in random order and direction, by delta = levels / (2 (levels - 1)).
+    :return: An array of shape (num_of_trajectories, num_of_params + 1, num_of_params).
+    """
+    delta = num_of_levels / (2 * (num_of_levels - 1))
+    start_levels = np.arange(num_of_levels) / (num_of_levels - 1)
+    start_levels = start_levels[start_levels <= 1 - delta + 1e-12]
+    trajectories = np.empty((num_of_trajectories, num_of_params + 1, num_of_params))
+    for trajectory in range(num_of_trajectories):
+        directions = rng.choice([-1., 1.], num_of_params)
+        point = rng.choice(start_levels, num_of_params) + np.where(directions < 0, delta, 0.)
+        trajectories[trajectory, 0] = point
+        for step, param in enumerate(rng.permutation(num_of_params), start=1):
+            point = point.copy()
+            point[param] += directions[param] * delta
+            trajectories[trajectory, step] = point
+    return trajectories
+
+
+def sobol_design(num_of_params: int, num_of_samples: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Generates the Saltelli design: two independent quasi-random samples A and B, and for every parameter the matrix
+    AB_i - A with its column i taken from B.
+    :return: An array of shape (num_of_params + 2, num_of_samples, num_of_params) - A, B, AB_1, ..., AB_k.
+    """
+    # Imported here so that the simulation modules don't load scipy
+    from scipy.stats import qmc
+    sample = qmc.Sobol(2 * num_of_params, seed=rng).random(num_of_samples)
+    a, b = sample[:, :num_of_params], sample[:, num_of_params:]
+    design = np.empty((num_of_params + 2, num_of_samples, num_of_params))
+    design[0], design[1] = a, b
+    for param in range(num_of_params):
+        design[param + 2] = a
+        design[param + 2, :, param] = b[:, param]
+    return design
+
+
+def morris_indices(problem: SensitivityProblem, num_of_trajectories: int = DEFAULT_NUM_OF_TRAJECTORIES,
+                   num_of_levels: int = DEFAULT_NUM_OF_LEVELS) -> SensitivityResult:
+    """
+    Screens the parameters with the elementary effects method of Morris, at a cost of
+    num_of_trajectories * (number of parameters + 1) evaluations.
+    :return: The indices "mu" (the mean elementary effect), "mu_star" (the mean absolute elementary effect, which
+    ranks the importance of the parameters) and "sigma" (the standard deviation, large for nonlinear effects and
+    interactions). The effects are per unit of the normalized range of a parameter.
+    """
+    num_of_params = len(problem.ranges)
+    trajectories = morris_design(num_of_params, num_of_trajectories, num_of_levels, problem.rng)
+    values = problem.evaluate(trajectories.reshape(-1, num_of_params)).reshape(num_of_trajectories,
+                                                                                num_of_params + 1, len(METRICS))
+    effects = np.empty((num_of_trajectories, num_of_params, len(METRICS)))
+    steps = np.diff(trajectories, axis=1)
+    for trajectory in range(num_of_trajectories):
+        params = np.argmax(np.abs(steps[trajectory]), axis=1)
+        delta = steps[trajectory, np.arange(num_of_params), params]
+        effects[trajectory, params] = np.diff(values[trajectory], axis=0) / delta[:, None]
+
+    with _ignore_empty_slices():
+        indices = {"mu": np.nanmean(effects, axis=0), "mu_star": np.nanmean(np.abs(effects), axis=0),
+                   "sigma": np.nanstd(effects, axis=0, ddof=1)}
+    return SensitivityResult(problem.names(), indices, problem.num_of_evaluations())
+
+
+def sobol_indices(problem: SensitivityProblem, num_of_samples: int = DEFAULT_NUM_OF_SAMPLES) -> SensitivityResult:
+    """
+    Estimates the first order and total Sobol indices with the Saltelli design, at a cost of
+    num_of_samples * (number of parameters + 2) evaluations. The first order index is estimated as in Saltelli et al.
+    (2010) and the total index as in Jansen (1999), both from the same evaluations. Samples with an undefined metric
+    (the colony fraction after extinction) are left out of the estimates of that metric.
+    :return: The indices "S1" (the fraction of the variance due to the parameter alone) and "ST" (the fraction due
+    to the parameter and all its interactions).
+    """
+    num_of_params = len(problem.ranges)
+    design = sobol_design(num_of_params, num_of_samples, problem.rng)
+    values = problem.evaluate(design.reshape(-1, num_of_params)).reshape(num_of_params + 2, num_of_samples,
+                                                                          len(METRICS))
+    first_order, total = sobol_estimates(values)
+    return SensitivityResult(problem.names(), {"S1": first_order, "ST": total}, problem.num_of_evaluations())
+
+
+def sobol_estimates(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Estimates the first order and total Sobol indices from the evaluations of a Saltelli design, see sobol_indices.
+    The indices of an output whose variance is within VARIANCE_TOLERANCE of zero are NaN, as the output doesn't
+    vary.
+    :param values: An array of shape (number of parameters + 2, number of samples, number of outputs) - the outputs
+    at the points of sobol_design.
+    :return: The first order and total indices, arrays of shape (number of parameters, number of outputs).
+    """
+    num_of_params, num_of_outputs = values.shape[0] - 2, values.shape[-1]
+    f_a, f_b, f_ab = values[0], values[1], values[2:]
+    first_order, total = np.empty((num_of_params, num_of_outputs)), np.empty((num_of_params, num_of_outputs))
+    with _ignore_empty_slices():
+        for param in range(num_of_params):
+            valid = ~(np.isnan(f_a) | np.isnan(f_b) | np.isnan(f_ab[param]))
+            a, b, ab = (np.where(valid, f, np.nan) for f in (f_a, f_b, f_ab[param]))
+            samples = np.concatenate([a, b])
+            variance = np.nanvar(samples, axis=0)
+            varies = variance > VARIANCE_TOLERANCE * np.nanmean(samples ** 2, axis=0)
+            variance = np.where(varies, variance, np.nan)
+            first_order[param] = np.nanmean(b * (ab - a), axis=0) / variance
+            total[param] = 0.5 * np.nanmean((a - ab) ** 2, axis=0) / variance
+    return first_order, total
+
+
+@contextmanager
+def _ignore_empty_slices():
+    """
+    Silences the warnings of the nan reductions over slices with no valid values, which are NaN.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        yield
@@ -0,0 +1,235 @@
+import os
+import time
+import shutil
+import socket
+import sqlite3
+import numpy as np
+from abc import ABC, abstractmethod
+from typing import List, Optional
+from discrete_model.experiment import ExperimentSpec, prepare_experiment, chunk_starts, is_chunk_done, run_chunks, \
+    load_results, CHUNK_FILE_PREFIX
+
+# A claimed chunk that isn't done after this many seconds is considered abandoned, and may be claimed again.
+DEFAULT_LEASE = 3600
+# The number of seconds to wait between claims while the remaining chunks are claimed by other nodes.
+DEFAULT_POLL_INTERVAL = 60
+CLAIMS_DIR_NAME = "claims"
+QUEUE_FILE_NAME = "queue.sqlite"
+
+
+def plan_shards(spec: ExperimentSpec, num_of_shards: int, chunk_size: int) -> List[List[int]]:
+    """
+    Splits the chunks of an experiment between shards. The chunks are dealt in turn, so every shard gets cells from
+    all over the grid and the shards take about the same time. The plan depends only on its arguments, so every node
+    computes the same one. Each cell has its own random substream (see evaluate_cells), so the results don't depend
+    on the sharding.
+    :return: The starts of the chunks of each shard.
+    """
+    starts = list(chunk_starts(spec, chunk_size))
+    return [starts[shard::num_of_shards] for shard in range(num_of_shards)]
+
+
+def parse_shard(shard: str) -> (int, int):
+    """
+    Parses a shard given as "i/N", with i in 1, ..., N.
+    :return: The zero-based index of the shard and the number of shards.
+    """
+    index, num_of_shards = (int(value) for value in shard.split("/"))
+    if not 1 <= index <= num_of_shards:
+        raise ValueError(f"Shard {shard} is not in 1/{num_of_shards}, ..., {num_of_shards}/{num_of_shards}")
+    return index - 1, num_of_shards
+
+
+def run_shard(spec: ExperimentSpec, dir_path: str, shard: int, num_of_shards: int, num_of_workers: int = None,
+              chunk_size: int = None) -> None:
+    """
+    Runs the chunks of one shard of an experiment, checkpointing them to its directory. Every shard must be run
+    with the same spec, seed and chunk size.
+    :param shard: The zero-based index of the shard.
+    """
+    if spec.seed is None:
+        raise ValueError("A sharded experiment needs a seed, so that all the shards use the same one")
+    spec, chunks_dir, chunk_size = prepare_experiment(spec, dir_path, chunk_size)
+    run_chunks(spec, chunks_dir, chunk_size, plan_shards(spec, num_of_shards, chunk_size)[shard], num_of_workers)
+
+
+def merge_shards(spec: ExperimentSpec, dir_path: str, shard_dir_paths: List[str],
+                 chunk_size: int = None) -> np.ndarray:
+    """
+    Gathers the checkpoints of the shards into the directory of the experiment, and assembles the results.
+    :param dir_path: The directory in which the directory of the merged experiment is created.
+    :param shard_dir_paths: The directories the shards were run in. A shared directory may be given as dir_path
+    itself.
+    :return: An array of shape spec.shape() + (number of values,), see ExperimentSpec.value_names.
+    """
+    spec, chunks_dir, merged_chunk_size = prepare_experiment(spec, dir_path, chunk_size)
+    for shard_dir_path in shard_dir_paths:
+        if not os.path.isdir(os.path.join(shard_dir_path, spec.name)):
+            continue
+        # Checks that the shard was run with the same spec and seed
+        _, shard_chunks_dir, shard_chunk_size = prepare_experiment(spec, shard_dir_path, chunk_size)
+        chunk_size = shard_chunk_size if chunk_size is None else chunk_size
+        if os.path.samefile(shard_chunks_dir, chunks_dir):
+            continue
+        for file_name in os.listdir(shard_chunks_dir):
+            path = os.path.join(chunks_dir, file_name)
+            if file_name.startswith(CHUNK_FILE_PREFIX) and file_name.endswith(".npy") and not os.path.exists(path):
+                temp_path = f"{path}.{os.getpid()}.tmp"
+                shutil.copy(os.path.join(shard_chunks_dir, file_name), temp_path)
+                os.replace(temp_path, path)
+    return load_results(spec, chunks_dir, merged_chunk_size if chunk_size is None else chunk_size)
+
+
+class WorkQueue(ABC):
+    """
+    A pull-based queue of the chunks of an experiment. Nodes claim chunks one at a time until all of them are done, so
+    idle nodes keep taking work. A claim expires after a lease, so the chunks of a node that died are taken by the
+    others.
+    Two nodes may rarely run the same chunk - that only wastes time, as the results of a chunk are deterministic and
+    written atomically.
+    """
+
+    def __init__(self, chunks_dir: str, starts: List[int], chunk_size: int, lease: float = DEFAULT_LEASE):
+        self.chunks_dir = chunks_dir
+        self.starts = starts
+        self.chunk_size = chunk_size
+        self.lease = lease
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+    @abstractmethod
+    def claim(self) -> Optional[int]:
+        """
+        Claims a chunk that isn't done or claimed.
+        :return: The start of the chunk, or None if there's nothing left to claim right now - chunks claimed by other
+        nodes may still be claimed once their lease expires, see is_finished.
+        """
+        pass
+
+    def is_finished(self) -> bool:
+        """
+        :return: Whether all the chunks are done.
+        """
+        return all(self._is_done(start) for start in self.starts)
+
+    def complete(self, start: int) -> None:
+        """
+        Marks a claimed chunk as done, after it was checkpointed.
+        """
+        pass
+
+    def _is_done(self, start: int) -> bool:
+        return is_chunk_done(self.chunks_dir, start, self.chunk_size)
+
+
+class DirectoryQueue(WorkQueue):
+    """
+    A work queue kept as claim files in the shared directory of the experiment. A chunk is claimed by creating its
+    claim file exclusively.
+    """
+
+    def __init__(self, chunks_dir: str, starts: List[int], chunk_size: int, lease: float = DEFAULT_LEASE):
+        super().__init__(chunks_dir, starts, chunk_size, lease)
+        self.claims_dir = os.path.join(os.path.dirname(chunks_dir), CLAIMS_DIR_NAME)
+        os.makedirs(self.claims_dir, exist_ok=True)
+
+    def claim(self) -> Optional[int]:
+        for start in self.starts:
+            if self._is_done(start):
+                continue
+            claim_path = os.path.join(self.claims_dir, f"{CHUNK_FILE_PREFIX}{start:09d}.claim")
+            try:
+                file_descriptor = os.open(claim_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if time.time() - _modification_time(claim_path) < self.lease:
+                    continue
+                # The claim expired - take it over
+                temp_path = f"{claim_path}.{os.getpid()}.tmp"
+                file_descriptor = os.open(temp_path, os.O_CREAT | os.O_WRONLY | os.O_TRUNC)
+                os.write(file_descriptor, self.owner.encode())
+                os.close(file_descriptor)
+                os.replace(temp_path, claim_path)
+                return start
+            os.write(file_descriptor, self.owner.encode())
+            os.close(file_descriptor)
+            return start
+        return None
+
+
+class SQLiteQueue(WorkQueue):
+    """
+    A work queue kept in an SQLite file. Chunks are claimed in transactions, so the file may be shared by processes
+    on a node, or by nodes on a file system with working locks.
+    """
+
+    def __init__(self, chunks_dir: str, starts: List[int], chunk_size: int, lease: float = DEFAULT_LEASE,
+                 file_path: str = None):
+        super().__init__(chunks_dir, starts, chunk_size, lease)
+        self.file_path = os.path.join(os.path.dirname(chunks_dir), QUEUE_FILE_NAME) if file_path is None \
+            else file_path
+        with self._connect() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS chunks "
+                               "(start INTEGER PRIMARY KEY, owner TEXT, claimed_at REAL, done INTEGER DEFAULT 0)")
+            connection.executemany("INSERT OR IGNORE INTO chunks (start) VALUES (?)",
+                                   [(start,) for start in starts])
+
+    def claim(self) -> Optional[int]:
+        while True:
+            connection = self._connect()
+            try:
+                connection.execute("BEGIN IMMEDIATE")
+                row = connection.execute("SELECT start FROM chunks WHERE done = 0 AND "
+                                         "(claimed_at IS NULL OR claimed_at < ?) ORDER BY start LIMIT 1",
+                                         (time.time() - self.lease,)).fetchone()
+                if row is not None:
+                    connection.execute("UPDATE chunks SET owner = ?, claimed_at = ? WHERE start = ?",
+                                       (self.owner, time.time(), row[0]))
+                connection.execute("COMMIT")
+            finally:
+                connection.close()
+            if row is None or not self._is_done(row[0]):
+                return None if row is None else row[0]
+            # Checkpointed by a node that didn't mark it
+            self.complete(row[0])
+
+    def complete(self, start: int) -> None:
+        with self._connect() as connection:
+            connection.execute("UPDATE chunks SET done = 1 WHERE start = ?", (start,))
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.file_path, timeout=60, isolation_level=None)
+
+
+def run_queue(spec: ExperimentSpec, dir_path: str, queue_type: type = DirectoryQueue, chunk_size: int = None,
+              lease: float = DEFAULT_LEASE, poll_interval: float = DEFAULT_POLL_INTERVAL) -> int:
+    """
+    Runs chunks of an experiment from a work queue in its shared directory, until all the chunks are done. While the
+    remaining chunks are claimed by other nodes it keeps polling, so it takes over the chunks of a node that died once
+    their lease expires. Any number of processes, on any number of nodes, may run this together.
+    :param queue_type: DirectoryQueue or SQLiteQueue.
+    :param lease: The number of seconds after which the claim of a chunk that isn't done expires. Should be longer
+    than the time of a chunk.
+    :param poll_interval: The number of seconds to wait between claims while all the remaining chunks are claimed.
+    :return: The number of chunks this process ran.
+    """
+    if spec.seed is None:
+        raise ValueError("An experiment run from a work queue needs a seed, so that all the nodes use the same one")
+    spec, chunks_dir, chunk_size = prepare_experiment(spec, dir_path, chunk_size)
+    queue = queue_type(chunks_dir, list(chunk_starts(spec, chunk_size)), chunk_size, lease)
+    num_of_chunks = 0
+    while True:
+        start = queue.claim()
+        if start is None:
+            if queue.is_finished():
+                return num_of_chunks
+            time.sleep(poll_interval)
+            continue
+        run_chunks(spec, chunks_dir, chunk_size, [start], num_of_workers=1)
+        queue.complete(start)
+        num_of_chunks += 1
+
+
+def _modification_time(path: str) -> float:
+    try:
+        return os.path.getmtime(path)
+    except FileNotFoundError:
+        return time.time()
@@ -0,0 +1,293 @@
+import numpy as np
+from dataclasses import dataclass, field
+from utils.Auxiliary import Params, ParamName, ParamBatch, PARAM_FIELDS
+from typing import Callable, Dict, List, Tuple
+from discrete_model.ensemble_model import reduce_ensemble, classify_colony_fraction, COLONY_WIN, LAST_GENERATIONS
+from discrete_model.reducers import TrailingMean
+
+# Acquisition functions of the active learning: the largest predictive uncertainty, or the largest uncertainty near
+# the boundary where the colony birds win in half of the runs.
+UNCERTAINTY, STRADDLE = "uncertainty", "straddle"
+ACQUISITIONS = (UNCERTAINTY, STRADDLE)
+STRADDLE_Z = 1.96
+DEFAULT_NUM_OF_RUNS = 50
+DEFAULT_NUM_OF_INITIAL_POINTS = 16
+DEFAULT_NUM_OF_CANDIDATES = 2048
+# The bounds of the length scales, in units of the ranges of the parameters
+LENGTH_SCALE_BOUNDS = (1e-2, 1e1)
+SIGNAL_VARIANCE_BOUNDS = (1e-4, 1.)
+# Added to the diagonal of the kernel matrix, for a stable Cholesky decomposition
+JITTER = 1e-8
+
+
+class GaussianProcessEmulator:
+    """
+    A Gaussian process regression of the probability that the colony birds win, as a function of some of the
+    parameters. The kernel is a squared exponential with a length scale per parameter, over the parameters scaled to
+    their ranges. Every training point is a binomial estimate from a number of runs, so it has its own noise variance,
+    and the hyperparameters maximize the marginal likelihood.
+    Once fitted, a prediction only takes a few vector operations over the training points.
+    """
+
+    def __init__(self, ranges: Dict[ParamName, Tuple[float, float]]):
+        """
+        :param ranges: Maps each input parameter to its (low, high) range.
+        """
+        self.ranges = dict(ranges)
+        self._low, high = np.array(list(self.ranges.values()), dtype=float).T
+        self._width = high - self._low
+        self._fields = [PARAM_FIELDS[name] for name in self.ranges]
+        self.length_scales = np.full(len(self.ranges), 0.3)
+        self.signal_variance = 0.1
+        self._unit_points = None
+
+    def names(self) -> List[ParamName]:
+        return list(self.ranges)
+
+    def fit(self, points: np.ndarray, wins: np.ndarray, num_of_runs, optimize: bool = True) \
+            -> "GaussianProcessEmulator":
+        """
+        Fits the emulator to simulation results.
+        :param points: An array of shape (number of points, number of parameters), in the order of 'ranges'.
+        :param wins: The number of runs the colony birds won at each point.
+        :param num_of_runs: The number of runs at each point, a scalar or an array.
+        :param optimize: Whether to fit the hyperparameters, or keep the current ones.
+        :return: The emulator.
+        """
+        wins = np.asarray(wins, dtype=float)
+        num_of_runs = np.broadcast_to(np.asarray(num_of_runs, dtype=float), wins.shape)
+        # The binomial variance of the estimates, with the proportions shrunk away from 0 and 1 so that points where
+        # all the runs ended alike still have some noise
+        shrunk = (wins + 1) / (num_of_runs + 2)
+        self._set_data(self._unit(points), wins / num_of_runs, shrunk * (1 - shrunk) / num_of_runs)
+        if optimize:
+            self._optimize_hyperparameters()
+        self._factorize()
+        return self
+
+    def fit_grid(self, axes: Dict[ParamName, np.ndarray], win_fractions: np.ndarray, num_of_runs,
+                 optimize: bool = True) -> "GaussianProcessEmulator":
+        """
+        Fits the emulator to the results of a sweep, e.g. the matrix of the fractions of colony wins of
+        run_stoch_heatmap_parallel or of an experiment.
+        :param axes: Maps each swept parameter to its values. Must have the parameters of 'ranges', in their order.
+        :param win_fractions: The fractions of colony wins, with one dimension per axis.
+        :param num_of_runs: The number of runs in each cell, a scalar or an array of the shape of win_fractions.
+        """
+        if list(axes) != self.names():
+            raise ValueError(f"The axes {list(axes)} are not the parameters of the emulator {self.names()}")
+        mesh = np.meshgrid(*(np.asarray(axis_values, dtype=float) for axis_values in axes.values()), indexing='ij')
+        points = np.stack([axis_mesh.ravel() for axis_mesh in mesh], axis=-1)
+        num_of_runs = np.broadcast_to(num_of_runs, np.shape(win_fractions)).ravel()
+        return self.fit(points, np.rint(np.ravel(win_fractions) * num_of_runs), num_of_runs, optimize)
+
+    def predict(self, points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :param points: An array of shape (number of points, number of parameters), in the order of 'ranges'.
+        :return: The predicted probabilities of colony wins, and their standard deviations.
+        """
+        kernel = self._kernel(self._unit(points), self._unit_points)
+        mean = self._mean + kernel @ self._alpha
+        variance = self.signal_variance - np.sum((kernel @ self._inverse) * kernel, axis=1)
+        return np.clip(mean, 0., 1.), np.sqrt(np.maximum(variance, 0.))
+
+    def predict_params(self, params: Params) -> Tuple[float, float]:
+        """
+        Predicts a single point, given by the values of the input parameters in 'params'.
+        :return: The predicted probability of colony wins, and its standard deviation.
+        """
+        point = (np.array([getattr(params, field_name) for field_name in self._fields]) - self._low) * self._scale
+        differences = self._scaled_points - point
+        kernel = self.signal_variance * np.exp(-0.5 * np.einsum('ij,ij->i', differences, differences))
+        mean = self._mean + kernel.dot(self._alpha)
+        variance = self.signal_variance - kernel.dot(self._inverse.dot(kernel))
+        return min(max(float(mean), 0.), 1.), max(float(variance), 0.) ** 0.5
+
+    def log_marginal_likelihood(self) -> float:
+        return -self._negative_log_likelihood(self._hyperparameters())[0]
+
+    def conditioned(self, points: np.ndarray) -> "GaussianProcessEmulator":
+        """
+        Returns a copy of the emulator that also treats 'points' as observed, at their predicted values and with
+        the noise of the least noisy training point. The predictive variance doesn't depend on the observed values,
+        so the copy tells how much simulating the points would reduce the uncertainty.
+        """
+        mean, _ = self.predict(points)
+        emulator = GaussianProcessEmulator(self.ranges)
+        emulator.length_scales, emulator.signal_variance = self.length_scales, self.signal_variance
+        emulator._set_data(np.concatenate([self._unit_points, self._unit(points)]),
+                           np.concatenate([self._values, mean]),
+                           np.concatenate([self._noise, np.full(len(mean), np.min(self._noise))]))
+        emulator._factorize()
+        return emulator
+
+    def _unit(self, points: np.ndarray) -> np.ndarray:
+        return (np.asarray(points, dtype=float).reshape(-1, len(self.ranges)) - self._low) / self._width
+
+    def _set_data(self, unit_points: np.ndarray, values: np.ndarray, noise: np.ndarray) -> None:
+        self._unit_points, self._values, self._noise = unit_points, values, noise
+        self._mean = np.mean(values)
+
+    def _kernel(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        squared_distances = np.sum(((a[:, None, :] - b[None, :, :]) / self.length_scales) ** 2, axis=-1)
+        return self.signal_variance * np.exp(-0.5 * squared_distances)
+
+    def _factorize(self) -> None:
+        covariance = self._kernel(self._unit_points, self._unit_points) + np.diag(self._noise + JITTER)
+        self._inverse = _cholesky_inverse(np.linalg.cholesky(covariance))
+        self._alpha = self._inverse @ (self._values - self._mean)
+        # For predict_params, the training points and the scaling of a point already divided by the length scales
+        self._scale = 1 / (self._width * self.length_scales)
+        self._scaled_points = self._unit_points / self.length_scales
+
+    def _hyperparameters(self) -> np.ndarray:
+        return np.log(np.append(self.length_scales, self.signal_variance))
+
+    def _negative_log_likelihood(self, log_hyperparameters: np.ndarray) -> Tuple[float, np.ndarray]:
+        """
+        :return: The negative log marginal likelihood of the hyperparameters, and its gradient by their logarithms.
+        """
+        length_scales, signal_variance = np.exp(log_hyperparameters[:-1]), np.exp(log_hyperparameters[-1])
+        differences = (self._unit_points[:, None, :] - self._unit_points[None, :, :]) ** 2 / length_scales ** 2
+        correlation = signal_variance * np.exp(-0.5 * np.sum(differences, axis=-1))
+        cholesky = np.linalg.cholesky(correlation + np.diag(self._noise + JITTER))
+        inverse = _cholesky_inverse(cholesky)
+        centered = self._values - self._mean
+        alpha = inverse @ centered
+        value = 0.5 * centered @ alpha + np.sum(np.log(np.diag(cholesky))) + 0.5 * len(centered) * np.log(2 * np.pi)
+        weights = np.outer(alpha, alpha) - inverse
+        gradient = np.append(-0.5 * np.einsum('ij,ij,ijk->k', weights, correlation, differences),
+                             -0.5 * np.sum(weights * correlation))
+        return value, gradient
+
+    def _optimize_hyperparameters(self) -> None:
+        # Imported here so that the simulation modules don't load scipy
+        from scipy.optimize import minimize
+
+        bounds = [tuple(np.log(LENGTH_SCALE_BOUNDS))] * len(self.ranges) + [tuple(np.log(SIGNAL_VARIANCE_BOUNDS))]
+        start = np.clip(self._hyperparameters(), *np.array(bounds).T)
+        result = minimize(self._negative_log_likelihood, start, jac=True, method='L-BFGS-B', bounds=bounds)
+        if np.isfinite(result.fun):
+            self.length_scales, self.signal_variance = np.exp(result.x[:-1]), np.exp(result.x[-1])
+
+
+@dataclass
+class ActiveLearner:
+    """
+    A dataclass that trains a GaussianProcessEmulator of the probability of colony wins, choosing the points to
+    simulate where the emulator is the least certain. Completed simulation results can be added before and between
+    the rounds.
+    :param params: The values of the parameters that the emulator doesn't take.
+    :param ranges: Maps each input parameter of the emulator to its (low, high) range. num_of_generations can't be
+    an input.
+    :param pandemic_function: A pandemic function with a batched version, or a batched pandemic function.
+    :param num_of_runs: The number of runs simulated at each chosen point.
+    :param acquisition: UNCERTAINTY or STRADDLE.
+    :param window: The number of last generations over which the fraction of colony birds is averaged.
+    :param seed: Seed for the chosen points and the stochastic models.
+    """
+    params: Params
+    ranges: Dict[ParamName, Tuple[float, float]]
+    pandemic_function: Callable
+    num_of_runs: int = DEFAULT_NUM_OF_RUNS
+    acquisition: str = STRADDLE
+    window: int = LAST_GENERATIONS
+    seed: int = None
+    num_of_candidates: int = DEFAULT_NUM_OF_CANDIDATES
+    points: np.ndarray = field(init=False, repr=False)
+    wins: np.ndarray = field(init=False, repr=False)
+    runs: np.ndarray = field(init=False, repr=False)
+
+    def __post_init__(self):
+        if ParamName.NUM_OF_GENERATIONS in self.ranges:
+            raise ValueError(f"{ParamName.NUM_OF_GENERATIONS} can't be an input of the emulator")
+        if self.acquisition not in ACQUISITIONS:
+            raise ValueError(f"Unknown acquisition {self.acquisition}, expected one of {ACQUISITIONS}")
+        self.rng = np.random.default_rng(self.seed)
+        self.emulator = GaussianProcessEmulator(self.ranges)
+        self.points = np.empty((0, len(self.ranges)))
+        self.wins, self.runs = np.empty(0), np.empty(0)
+
+    def add_results(self, points: np.ndarray, wins: np.ndarray, num_of_runs, refit: bool = True) -> None:
+        """
+        Adds completed simulation results to the training points.
+        :param points: An array of shape (number of points, number of parameters), in the order of 'ranges'.
+        :param wins: The number of runs the colony birds won at each point.
+        :param num_of_runs: The number of runs at each point, a scalar or an array.
+        :param refit: Whether to refit the emulator.
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, len(self.ranges))
+        self.points = np.concatenate([self.points, points])
+        self.wins = np.concatenate([self.wins, np.ravel(wins)])
+        self.runs = np.concatenate([self.runs, np.broadcast_to(np.asarray(num_of_runs, dtype=float),
+                                                               (len(points),))])
+        if refit:
+            self.emulator.fit(self.points, self.wins, self.runs)
+
+    def simulate(self, points: np.ndarray, refit: bool = True) -> np.ndarray:
+        """
+        Simulates the points together and adds their results.
+        :return: The fraction of colony wins at each point.
+        """
+        values = dict(zip(self.ranges, np.asarray(points, dtype=float).reshape(-1, len(self.ranges)).T))
+        wins = simulate_colony_wins(self.params, self.pandemic_function, values, self.num_of_runs, self.window,
+                                    self.rng)
+        self.add_results(points, wins, self.num_of_runs, refit)
+        return wins / self.num_of_runs
+
+    def suggest(self, num_of_points: int) -> np.ndarray:
+        """
+        Chooses the next points to simulate among random candidates. The points are chosen one at a time, each
+        assuming the previous ones were simulated, so a batch doesn't pile up at the same spot.
+        :return: An array of shape (num_of_points, number of parameters).
+        """
+        low, high = np.array(list(self.ranges.values()), dtype=float).T
+        candidates = low + self.rng.random((self.num_of_candidates, len(self.ranges))) * (high - low)
+        emulator, chosen = self.emulator, []
+        for _ in range(num_of_points):
+            mean, std = emulator.predict(candidates)
+            score = std if self.acquisition == UNCERTAINTY else STRADDLE_Z * std - np.abs(mean - 0.5)
+            best = np.argmax(score)
+            chosen.append(candidates[best])
+            candidates = np.delete(candidates, best, axis=0)
+            emulator = emulator.conditioned(chosen[-1])
+        return np.array(chosen)
+
+    def run(self, num_of_rounds: int, batch_size: int,
+            num_of_initial_points: int = DEFAULT_NUM_OF_INITIAL_POINTS) -> GaussianProcessEmulator:
+        """
+        Runs rounds of active learning. If there are no training points yet, a Latin hypercube of initial points is
+        simulated first.
+        :param num_of_rounds: The number of rounds.
+        :param batch_size: The number of points simulated together in each round.
+        :return: The fitted emulator.
+        """
+        if not len(self.points):
+            # Imported here so that the simulation modules don't load scipy
+            from scipy.stats import qmc
+            low, high = np.array(list(self.ranges.values()), dtype=float).T
+            self.simulate(low + qmc.LatinHypercube(len(self.ranges), seed=self.rng).random(num_of_initial_points)
+                          * (high - low))
+        for _ in range(num_of_rounds):
+            self.simulate(self.suggest(batch_size))
+        return self.emulator
+
+
+def simulate_colony_wins(params: Params, pandemic_function: Callable, values: Dict[ParamName, np.ndarray],
+                         num_of_runs: int, window: int = LAST_GENERATIONS,
+                         rng: np.random.Generator = None) -> np.ndarray:
+    """
+    Simulates the parameter sets given by zipping 'values' in a single batched run.
+    :return: The number of runs the colony birds won in each parameter set.
+    """
+    batch = ParamBatch.zip(params, values)
+    avg_fracs, = reduce_ensemble(batch, pandemic_function, [TrailingMean(window)], num_of_runs, rng)
+    return np.sum(classify_colony_fraction(avg_fracs).reshape(batch.size, num_of_runs) == COLONY_WIN, axis=1)
+
+
+def _cholesky_inverse(cholesky: np.ndarray) -> np.ndarray:
+    """
+    Inverts a symmetric positive definite matrix given its Cholesky factor.
+    """
+    inverse_factor = np.linalg.inv(cholesky)
+    return inverse_factor.T @ inverse_factor
@@ -0,0 +1,85 @@
+import numpy as np
+from dataclasses import replace
+from scipy.integrate import solve_ivp
+from scipy.optimize import brentq
+from utils.Auxiliary import Params
+from discrete_model.logistic_growth_model import EXTINCTION_THRESHOLD
+from discrete_model.pandemic_functions import deterministic_pandemic_function
+from differential_model.adaptive_integrator import logistic_growth_ode, ensemble_logistic_growth_ode
+
+PARAMS = Params(pandemic_rate=0.1, c_death_factor=0.3, selection_coefficient=0.05, l_death_factor=0.1,
+                num_of_generations=101, growth_rate=1.5, init_birds_num=3000, carrying_capacity=10000)
+RTOL, ATOL = 1e-10, 1e-8
+
+
+def closed_form(colony_birds: float, lone_birds: float, params: Params, t: float) -> (float, float):
+    """
+    The exact solution of the system without pandemics - the total population grows logistically at growth_rate,
+    and the colony fraction logistically at selection_coefficient.
+    """
+    n_total, colony_fraction = colony_birds + lone_birds, colony_birds / (colony_birds + lone_birds)
+    growth = np.exp(params.growth_rate * t)
+    n_total = params.carrying_capacity * n_total * growth / (params.carrying_capacity + n_total * (growth - 1))
+    selection = np.exp(params.selection_coefficient * t)
+    colony_fraction = colony_fraction * selection / (1 + colony_fraction * (selection - 1))
+    return n_total * colony_fraction, n_total * (1 - colony_fraction)
+
+
+def impulsive_solution(params: Params, step) -> np.ndarray:
+    """
+    Advances the populations generation by generation with 'step', applying the pandemics at the multiples of
+    1 / pandemic_rate.
+    :return: An array of shape (num_of_generations, 2) of the colony and lone birds.
+    """
+    populations = np.empty((params.num_of_generations, 2))
+    populations[0] = params.init_birds_num
+    for generation in range(1, params.num_of_generations):
+        populations[generation] = step(*populations[generation - 1], params)
+        if generation % round(1 / params.pandemic_rate) == 0:
+            populations[generation] *= (1 - params.c_death_factor, 1 - params.l_death_factor)
+    return populations
+
+
+def solve_ivp_step(colony_birds: float, lone_birds: float, params: Params) -> np.ndarray:
+    def rhs(_, y):
+        n_total = y[0] + y[1]
+        growth = params.growth_rate * (params.carrying_capacity - n_total) / params.carrying_capacity
+        selection = params.selection_coefficient * y[0] * y[1] / n_total
+        return [y[0] * growth + selection, y[1] * growth - selection]
+
+    return solve_ivp(rhs, (0, 1), [colony_birds, lone_birds], method='RK45', rtol=RTOL, atol=ATOL).y[:, -1]
+
+
+def test_matches_closed_form_between_pandemics():
+    expected = impulsive_solution(PARAMS, lambda colony, lone, params: closed_form(colony, lone, params, 1))
+    colony_birds, lone_birds = logistic_growth_ode(PARAMS, deterministic_pandemic_function, rtol=RTOL, atol=ATOL)
+    np.testing.assert_allclose(colony_birds, expected[:, 0], rtol=1e-7)
+    np.testing.assert_allclose(lone_birds, expected[:, 1], rtol=1e-7)
+
+
+def test_matches_solve_ivp():
+    growth_rates = np.array([0.5, 1., 1.5])
+    solution = ensemble_logistic_growth_ode(replace(PARAMS, growth_rate=growth_rates),
+                                            deterministic_pandemic_function, growth_rates.size, rtol=RTOL, atol=ATOL)
+    for run, growth_rate in enumerate(growth_rates):
+        expected = impulsive_solution(replace(PARAMS, growth_rate=growth_rate), solve_ivp_step)
+        np.testing.assert_allclose(solution.colony_birds[run], expected[:, 0], rtol=1e-6)
+        np.testing.assert_allclose(solution.lone_birds[run], expected[:, 1], rtol=1e-6)
+
+
+def test_extinction_time():
+    # Without pandemics the lone birds decay until they cross the extinction threshold, after which the colony birds
+    # grow alone
+    params = replace(PARAMS, pandemic_rate=0, selection_coefficient=0.5, num_of_generations=40)
+    extinction_level = EXTINCTION_THRESHOLD * params.carrying_capacity
+    expected_time = brentq(lambda t: closed_form(params.init_birds_num, params.init_birds_num, params, t)[1] -
+                           extinction_level, 0, params.num_of_generations)
+    solution = ensemble_logistic_growth_ode(params, deterministic_pandemic_function, rtol=RTOL, atol=ATOL)
+
+    assert np.isnan(solution.colony_extinction_time[0])
+    np.testing.assert_allclose(solution.lone_extinction_time[0], expected_time, rtol=1e-8)
+    after = solution.times > expected_time
+    assert np.all(solution.lone_birds[0, after] == 0)
+    colony_birds, _ = closed_form(params.init_birds_num, params.init_birds_num, params, expected_time)
+    expected, _ = closed_form(colony_birds, 0, params, solution.times[after] - expected_time)
+    np.testing.assert_allclose(solution.colony_birds[0, after], expected, rtol=1e-7)
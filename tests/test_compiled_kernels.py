@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from dataclasses import replace
+from utils.Auxiliary import Params
+from discrete_model.logistic_growth_model import logistic_growth_model, PYTHON_BACKEND, COMPILED_BACKEND
+from discrete_model.pandemic_functions import deterministic_pandemic_function, types_shift_model_deter_function, \
+    stochastic_at_both_pandemic_function, types_shift_model_stoch_function, deterministic_pandemic_function_batch
+
+PARAMS = Params(pandemic_rate=0.1, c_death_factor=0.5, selection_coefficient=0.05, l_death_factor=0.1,
+                num_of_generations=2000, growth_rate=1.5, init_birds_num=3000, carrying_capacity=10000,
+                shift_factor=0.01)
+PANDEMIC_RATES = [0.05, 0.1, 0.25, 0.3, 1]
+C_DEATH_FACTORS = [0.1, 0.5, 0.9]
+
+
+@pytest.mark.parametrize("pandemic_function", [deterministic_pandemic_function, types_shift_model_deter_function])
+@pytest.mark.parametrize("detect_convergence", [False, True])
+def test_compiled_matches_python(pandemic_function, detect_convergence):
+    for pandemic_rate in PANDEMIC_RATES:
+        for c_death_factor in C_DEATH_FACTORS:
+            params = replace(PARAMS, pandemic_rate=pandemic_rate, c_death_factor=c_death_factor)
+            expected = logistic_growth_model(params, pandemic_function, detect_convergence=detect_convergence,
+                                             backend=PYTHON_BACKEND)
+            compiled = logistic_growth_model(params, pandemic_function, detect_convergence=detect_convergence,
+                                             backend=COMPILED_BACKEND)
+            np.testing.assert_allclose(compiled, expected, rtol=1e-12)
+
+
+@pytest.mark.parametrize("pandemic_function", [stochastic_at_both_pandemic_function, types_shift_model_stoch_function])
+def test_compiled_stochastic_runs_are_reproducible(pandemic_function):
+    state = np.random.get_state()
+    first = logistic_growth_model(PARAMS, pandemic_function, np.random.default_rng(1), backend=COMPILED_BACKEND)
+    second = logistic_growth_model(PARAMS, pandemic_function, np.random.default_rng(1), backend=COMPILED_BACKEND)
+    np.testing.assert_array_equal(first, second)
+    # The global random state of numpy isn't touched
+    after = np.random.get_state()
+    assert state[0] == after[0] and np.array_equal(state[1], after[1]) and state[2:] == after[2:]
+
+
+def test_unsupported_pandemic_function():
+    with pytest.raises(ValueError):
+        logistic_growth_model(PARAMS, deterministic_pandemic_function_batch, backend=COMPILED_BACKEND)
+    with pytest.raises(ValueError):
+        logistic_growth_model(PARAMS, deterministic_pandemic_function, backend="unknown")
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from dataclasses import replace
+from utils.Auxiliary import Params
+from discrete_model.ensemble_model import ensemble_logistic_growth_model, iterate_ensemble, reduce_ensemble, \
+    LAST_GENERATIONS
+from discrete_model.logistic_growth_model import logistic_growth_model
+from discrete_model.pandemic_functions import deterministic_pandemic_function, deterministic_pandemic_function_batch, \
+    stochastic_at_death_factor_pandemic_function, stochastic_at_pandemic_rate_pandemic_function, \
+    stochastic_at_both_pandemic_function
+from discrete_model.reducers import TrailingMean
+
+PARAMS = Params(pandemic_rate=0.1, c_death_factor=0.5, selection_coefficient=0.05, l_death_factor=0.1,
+                num_of_generations=300, growth_rate=1.5, init_birds_num=3000, carrying_capacity=10000)
+# One value per replicate
+C_DEATH_FACTORS = np.array([0.1, 0.3, 0.5, 0.7, 0.9])
+PANDEMIC_RATES = np.array([0.05, 0.1, 0.2, 0.25, 0.5])
+STOCHASTIC_PANDEMIC_FUNCTIONS = [stochastic_at_death_factor_pandemic_function,
+                                 stochastic_at_pandemic_rate_pandemic_function, stochastic_at_both_pandemic_function]
+
+
+@pytest.mark.parametrize("pandemic_function", [deterministic_pandemic_function, deterministic_pandemic_function_batch])
+def test_deterministic_ensemble_matches_scalar_runs(pandemic_function):
+    params = replace(PARAMS, c_death_factor=C_DEATH_FACTORS, pandemic_rate=PANDEMIC_RATES)
+    colony_birds, lone_birds = ensemble_logistic_growth_model(params, pandemic_function, C_DEATH_FACTORS.size)
+    for run, (c_death_factor, pandemic_rate) in enumerate(zip(C_DEATH_FACTORS, PANDEMIC_RATES)):
+        expected_colony_birds, expected_lone_birds = logistic_growth_model(
+            replace(PARAMS, c_death_factor=c_death_factor, pandemic_rate=pandemic_rate),
+            deterministic_pandemic_function)
+        np.testing.assert_allclose(colony_birds[run], expected_colony_birds, rtol=1e-12)
+        np.testing.assert_allclose(lone_birds[run], expected_lone_birds, rtol=1e-12)
+
+
+def test_streaming_ensemble_matches_ensemble():
+    params = replace(PARAMS, c_death_factor=C_DEATH_FACTORS)
+    colony_birds, lone_birds = ensemble_logistic_growth_model(params, deterministic_pandemic_function,
+                                                              C_DEATH_FACTORS.size)
+    for i, colony_generation, lone_generation in iterate_ensemble(params, deterministic_pandemic_function,
+                                                                  C_DEATH_FACTORS.size):
+        np.testing.assert_allclose(colony_generation, colony_birds[:, i], rtol=1e-12)
+        np.testing.assert_allclose(lone_generation, lone_birds[:, i], rtol=1e-12)
+
+    avg_fracs, = reduce_ensemble(params, deterministic_pandemic_function, [TrailingMean(LAST_GENERATIONS)],
+                                 C_DEATH_FACTORS.size)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected = np.mean((colony_birds / (colony_birds + lone_birds))[:, -LAST_GENERATIONS:], axis=1)
+    np.testing.assert_allclose(avg_fracs, expected, rtol=1e-12)
+
+
+@pytest.mark.parametrize("pandemic_function", STOCHASTIC_PANDEMIC_FUNCTIONS)
+def test_stochastic_ensemble_is_reproducible(pandemic_function):
+    first = ensemble_logistic_growth_model(PARAMS, pandemic_function, 20, np.random.default_rng(1))
+    second = ensemble_logistic_growth_model(PARAMS, pandemic_function, 20, np.random.default_rng(1))
+    np.testing.assert_array_equal(first, second)
+    # The replicates differ from each other
+    assert np.unique(first[0][:, -1]).size > 1
+
+
+@pytest.mark.parametrize("pandemic_function", STOCHASTIC_PANDEMIC_FUNCTIONS)
+def test_stochastic_single_run_matches_scalar_run(pandemic_function):
+    # Both engines sample the pandemics of a single run with the same schedule
+    colony_birds, lone_birds = ensemble_logistic_growth_model(PARAMS, pandemic_function, 1, np.random.default_rng(2))
+    expected_colony_birds, expected_lone_birds = logistic_growth_model(PARAMS, pandemic_function,
+                                                                       np.random.default_rng(2))
+    np.testing.assert_allclose(colony_birds[0], expected_colony_birds, rtol=1e-12)
+    np.testing.assert_allclose(lone_birds[0], expected_lone_birds, rtol=1e-12)
@@ -0,0 +1,83 @@
+import os
+import numpy as np
+import pytest
+from dataclasses import replace
+from utils.Auxiliary import Model, ParamName
+from discrete_model import experiment
+from discrete_model.experiment import ExperimentSpec, run_experiment, prepare_experiment, run_chunks, chunk_starts, \
+    CHUNKS_DIR_NAME
+
+PARAMS = {"c_death_factor": 0.5, "selection_coefficient": 0.05, "l_death_factor": 0.1, "num_of_generations": 200,
+          "growth_rate": 1.5, "init_birds_num": 3000, "carrying_capacity": 10000}
+AXES = {ParamName.PANDEMIC_RATE: np.array([0.05, 0.1, 0.2]), ParamName.C_DEATH_FACTOR: np.array([0.2, 0.5, 0.8])}
+DETERMINISTIC_SPEC = ExperimentSpec(name="deterministic", model=Model.DETER, axes=AXES, params=PARAMS)
+STOCHASTIC_SPEC = ExperimentSpec(name="stochastic", model=Model.STOCHASTIC3, axes=AXES, params=PARAMS, num_of_runs=8,
+                                 seed=3)
+
+
+@pytest.fixture
+def evaluated_chunks(monkeypatch):
+    """
+    Records the starts of the chunks that are evaluated (in the main process).
+    """
+    starts = []
+    evaluate_cells = experiment.evaluate_cells
+
+    def recording_evaluate_cells(spec, start, stop):
+        starts.append(start)
+        return evaluate_cells(spec, start, stop)
+
+    monkeypatch.setattr(experiment, "evaluate_cells", recording_evaluate_cells)
+    return starts
+
+
+@pytest.mark.parametrize("spec", [DETERMINISTIC_SPEC, STOCHASTIC_SPEC])
+def test_resume(tmp_path, evaluated_chunks, spec):
+    expected = run_experiment(spec, str(tmp_path / "uninterrupted"), num_of_workers=1, chunk_size=2)
+
+    # Interrupted after the first two chunks
+    dir_path = str(tmp_path / "interrupted")
+    prepared_spec, chunks_dir, chunk_size = prepare_experiment(spec, dir_path, 2)
+    run_chunks(prepared_spec, chunks_dir, chunk_size, chunk_starts(prepared_spec, chunk_size)[:2], num_of_workers=1)
+    evaluated_chunks.clear()
+    # The chunk size is taken from the checkpoints
+    results = run_experiment(spec, dir_path, num_of_workers=1)
+
+    assert evaluated_chunks == list(chunk_starts(spec, 2))[2:]
+    np.testing.assert_array_equal(results, expected)
+
+
+def test_mismatched_checkpoints_are_rejected(tmp_path):
+    run_experiment(STOCHASTIC_SPEC, str(tmp_path), num_of_workers=1)
+    with pytest.raises(ValueError):
+        run_experiment(replace(STOCHASTIC_SPEC, seed=4), str(tmp_path), num_of_workers=1)
+    with pytest.raises(ValueError):
+        run_experiment(replace(STOCHASTIC_SPEC, params={**PARAMS, "growth_rate": 1.}), str(tmp_path),
+                       num_of_workers=1)
+    with pytest.raises(ValueError):
+        run_experiment(replace(STOCHASTIC_SPEC, num_of_runs=4), str(tmp_path), num_of_workers=1)
+    # The seed of the checkpoints is taken when none is given
+    np.testing.assert_array_equal(run_experiment(replace(STOCHASTIC_SPEC, seed=None), str(tmp_path)),
+                                  run_experiment(STOCHASTIC_SPEC, str(tmp_path / "again"), num_of_workers=1))
+
+
+@pytest.mark.parametrize("spec", [DETERMINISTIC_SPEC, STOCHASTIC_SPEC])
+def test_results_dont_depend_on_execution(tmp_path, spec):
+    expected = run_experiment(spec, str(tmp_path / "serial"), num_of_workers=1, chunk_size=1)
+    for num_of_workers, chunk_size in ((1, 4), (2, 2), (3, 64)):
+        dir_path = str(tmp_path / f"{num_of_workers}_{chunk_size}")
+        results = run_experiment(spec, dir_path, num_of_workers=num_of_workers, chunk_size=chunk_size)
+        # Vector operations over batches of different sizes may round differently
+        np.testing.assert_allclose(results, expected, rtol=1e-12)
+        assert len(os.listdir(os.path.join(dir_path, spec.name, CHUNKS_DIR_NAME))) == \
+            len(chunk_starts(spec, chunk_size))
+
+
+def test_type_shift_needs_shift_factor():
+    with pytest.raises(ValueError):
+        replace(DETERMINISTIC_SPEC, model=Model.TYPE_SHIFT).validate()
+    with pytest.raises(ValueError):
+        replace(DETERMINISTIC_SPEC, pandemic_function="types_shift_model_stoch_function").validate()
+    replace(DETERMINISTIC_SPEC, model=Model.TYPE_SHIFT, params={**PARAMS, "shift_factor": 0.01}).validate()
+    replace(DETERMINISTIC_SPEC, model=Model.STOCHASTIC_TYPE_SHIFT,
+            axes={**AXES, ParamName.SHIFT_FACTOR: np.array([0.01, 0.1])}).validate()
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from utils.Auxiliary import Params, ParamName, Model
+from discrete_model.ensemble_model import LAST_GENERATIONS
+from discrete_model.experiment import ExperimentSpec
+from discrete_model.logistic_growth_model import logistic_growth_model
+from discrete_model.outcome_table import build_outcome_table
+from discrete_model.pandemic_functions import deterministic_pandemic_function
+
+PARAMS = {"selection_coefficient": 0.05, "l_death_factor": 0.1, "num_of_generations": 1000, "growth_rate": 1.5,
+          "init_birds_num": 3000, "carrying_capacity": 10000}
+PANDEMIC_RATES = [0, 0.05, 0.1, 0.2]
+C_DEATH_FACTORS = [0.2, 0.4, 0.6, 0.8]
+
+
+@pytest.fixture(scope="module")
+def table(tmp_path_factory):
+    spec = ExperimentSpec(name="table", model=Model.DETER, params=PARAMS,
+                          axes={ParamName.PANDEMIC_RATE: np.array(PANDEMIC_RATES),
+                                ParamName.C_DEATH_FACTOR: np.array(C_DEATH_FACTORS)})
+    return build_outcome_table(spec, str(tmp_path_factory.mktemp("experiments")), num_of_workers=1)
+
+
+def simulated_colony_fraction(pandemic_rate: float, c_death_factor: float) -> float:
+    params = Params(pandemic_rate=pandemic_rate, c_death_factor=c_death_factor, **PARAMS)
+    colony_birds, lone_birds = logistic_growth_model(params, deterministic_pandemic_function)
+    return np.average((colony_birds / (colony_birds + lone_birds))[-LAST_GENERATIONS:])
+
+
+def test_grid_points_match_simulation(table):
+    # The scalar pandemic function doesn't take a pandemic rate of 0
+    for pandemic_rate in PANDEMIC_RATES[1:]:
+        for c_death_factor in C_DEATH_FACTORS:
+            point = {ParamName.PANDEMIC_RATE: pandemic_rate, ParamName.C_DEATH_FACTOR: c_death_factor}
+            np.testing.assert_allclose(table.query(point)[0], simulated_colony_fraction(pandemic_rate, c_death_factor))
+
+
+def test_off_grid_pandemic_rates_match_simulation(table):
+    # No generation is a multiple of 1 / 0.15 or of 1 / 0.30001, so no pandemic ever hits, like with a rate of 0
+    for pandemic_rate in (0.15, 0.30001):
+        for c_death_factor in C_DEATH_FACTORS:
+            point = {ParamName.PANDEMIC_RATE: pandemic_rate, ParamName.C_DEATH_FACTOR: c_death_factor}
+            expected = simulated_colony_fraction(pandemic_rate, c_death_factor)
+            np.testing.assert_allclose(table.query(point)[0], expected)
+            np.testing.assert_allclose(table.interpolate(np.array([[pandemic_rate, c_death_factor]]))[0, 0], expected)
+    params = Params(pandemic_rate=0.15, c_death_factor=0.6, **PARAMS)
+    assert table.query_class(params) == table.query_class({ParamName.PANDEMIC_RATE: 0,
+                                                           ParamName.C_DEATH_FACTOR: 0.6})
+
+
+def test_death_factor_is_interpolated(table):
+    point = {ParamName.PANDEMIC_RATE: 0.1, ParamName.C_DEATH_FACTOR: 0.5}
+    expected = (simulated_colony_fraction(0.1, 0.4) + simulated_colony_fraction(0.1, 0.6)) / 2
+    np.testing.assert_allclose(table.query(point)[0], expected)
+
+
+def test_pandemic_rate_without_grid_timing_is_rejected(table):
+    # Pandemics every 8 generations, which no grid rate has
+    with pytest.raises(ValueError):
+        table.query({ParamName.PANDEMIC_RATE: 0.125, ParamName.C_DEATH_FACTOR: 0.6})
+    with pytest.raises(ValueError):
+        table.interpolate(np.array([[0.1, 0.6], [0.125, 0.6]]))
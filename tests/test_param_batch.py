@@ -0,0 +1,81 @@
+import pickle
+import numpy as np
+import pytest
+from dataclasses import replace, FrozenInstanceError
+from utils.Auxiliary import Params, ParamName, ParamBatch
+from discrete_model.ensemble_model import ensemble_logistic_growth_model
+from discrete_model.logistic_growth_model import logistic_growth_model
+from discrete_model.pandemic_functions import deterministic_pandemic_function, types_shift_model_deter_function
+
+PARAMS = Params(pandemic_rate=0.1, c_death_factor=0.5, selection_coefficient=0.05, l_death_factor=0.1,
+                num_of_generations=200, growth_rate=1.5, init_birds_num=3000, carrying_capacity=10000)
+PANDEMIC_RATES = np.array([0.05, 0.1, 0.2])
+C_DEATH_FACTORS = np.array([0.2, 0.5])
+
+
+def test_product():
+    batch = ParamBatch.product(PARAMS, {ParamName.PANDEMIC_RATE: PANDEMIC_RATES,
+                                        ParamName.C_DEATH_FACTOR: C_DEATH_FACTORS})
+    assert batch.shape == (3, 2) and batch.size == 6 and len(batch) == 3
+    assert batch.pandemic_rate.shape == batch.growth_rate.shape == (3, 2)
+    assert batch.shift_factor is None
+    # C order - the last axis changes fastest
+    expected = [replace(PARAMS, pandemic_rate=pandemic_rate, c_death_factor=c_death_factor)
+                for pandemic_rate in PANDEMIC_RATES for c_death_factor in C_DEATH_FACTORS]
+    assert list(batch) == expected
+    assert batch[2, 1] == expected[-1]
+    assert batch[1].shape == (2,)
+
+
+def test_zip():
+    batch = ParamBatch.zip(PARAMS, {ParamName.PANDEMIC_RATE: PANDEMIC_RATES,
+                                    ParamName.C_DEATH_FACTOR: np.array([0.2, 0.5, 0.8])})
+    assert batch.shape == (3,)
+    assert [(params.pandemic_rate, params.c_death_factor) for params in batch] == [(0.05, 0.2), (0.1, 0.5), (0.2, 0.8)]
+    with pytest.raises(ValueError):
+        ParamBatch.zip(PARAMS, {ParamName.PANDEMIC_RATE: PANDEMIC_RATES, ParamName.C_DEATH_FACTOR: C_DEATH_FACTORS})
+
+
+def test_immutable():
+    batch = ParamBatch.product(PARAMS, {ParamName.PANDEMIC_RATE: PANDEMIC_RATES})
+    with pytest.raises(FrozenInstanceError):
+        batch.pandemic_rate = PANDEMIC_RATES
+    with pytest.raises(ValueError):
+        batch.pandemic_rate[0] = 1
+    with pytest.raises(AttributeError):
+        batch.unknown_parameter
+
+
+def test_pickle_round_trip():
+    batch = ParamBatch.product(PARAMS, {ParamName.PANDEMIC_RATE: PANDEMIC_RATES,
+                                        ParamName.C_DEATH_FACTOR: C_DEATH_FACTORS})
+    unpickled = pickle.loads(pickle.dumps(batch))
+    assert unpickled == batch and hash(unpickled) == hash(batch)
+    assert not unpickled.pandemic_rate.flags.writeable and not unpickled.growth_rate.flags.writeable
+    with pytest.raises(ValueError):
+        unpickled.c_death_factor[0, 0] = 1
+    assert unpickled != batch.with_values({ParamName.GROWTH_RATE: 1.})
+
+
+def test_to_params():
+    batch = ParamBatch.zip(PARAMS, {ParamName.PANDEMIC_RATE: PANDEMIC_RATES})
+    params = batch.to_params(num_of_runs=2)
+    np.testing.assert_array_equal(params.pandemic_rate, np.repeat(PANDEMIC_RATES, 2))
+    # Parameters that are the same for the whole batch stay scalars
+    assert params.growth_rate == PARAMS.growth_rate and params.num_of_generations == PARAMS.num_of_generations
+    mixed = ParamBatch.zip(PARAMS, {ParamName.NUM_OF_GENERATIONS: np.array([100, 200])})
+    with pytest.raises(ValueError):
+        mixed.to_params()
+
+
+@pytest.mark.parametrize("pandemic_function", [deterministic_pandemic_function, types_shift_model_deter_function])
+def test_ensemble_matches_logistic_growth_model(pandemic_function):
+    batch = ParamBatch.product(replace(PARAMS, shift_factor=0.01),
+                               {ParamName.PANDEMIC_RATE: PANDEMIC_RATES, ParamName.C_DEATH_FACTOR: C_DEATH_FACTORS})
+    colony_birds, lone_birds = ensemble_logistic_growth_model(batch, pandemic_function, 2)
+    assert colony_birds.shape == (batch.size * 2, PARAMS.num_of_generations)
+    for run, params in enumerate(batch):
+        expected_colony_birds, expected_lone_birds = logistic_growth_model(params, pandemic_function)
+        for replicate in (2 * run, 2 * run + 1):
+            np.testing.assert_allclose(colony_birds[replicate], expected_colony_birds, rtol=1e-12)
+            np.testing.assert_allclose(lone_birds[replicate], expected_lone_birds, rtol=1e-12)
@@ -0,0 +1,29 @@
+import numpy as np
+from dataclasses import replace
+from utils.Auxiliary import Params
+from discrete_model.grid_model import grid_pr_df_colony_fraction
+from discrete_model.pandemic_functions import deterministic_pandemic_function
+from discrete_model.period_map import period_map_pr_df_colony_fraction, pandemic_period
+
+# Long enough for the simulated trajectories of all the cells to reach the attractor the period map solves for
+PARAMS = Params(pandemic_rate=0, c_death_factor=0, selection_coefficient=0.05, l_death_factor=0,
+                num_of_generations=20000, growth_rate=1.5, init_birds_num=3000, carrying_capacity=10000)
+PANDEMIC_RATES = np.array([0, 0.02, 0.05, 0.1, 0.125, 0.2, 0.25, 0.5, 1])
+DEATH_FACTORS = np.linspace(0, 1, 15)
+
+
+def test_period_map_heatmap_matches_simulation():
+    for params in (PARAMS, replace(PARAMS, l_death_factor=0.1)):
+        expected = grid_pr_df_colony_fraction(params, deterministic_pandemic_function, PANDEMIC_RATES,
+                                              DEATH_FACTORS)
+        fractions = period_map_pr_df_colony_fraction(params, deterministic_pandemic_function, PANDEMIC_RATES,
+                                                     DEATH_FACTORS)
+        np.testing.assert_allclose(fractions, expected, rtol=0, atol=1e-8)
+
+
+def test_pandemic_period():
+    assert pandemic_period(replace(PARAMS, pandemic_rate=0.1)) == 10
+    assert pandemic_period(replace(PARAMS, pandemic_rate=0.4)) == 5
+    # No pandemic hits without pandemics, or when no generation is a multiple of 1 / pandemic_rate
+    assert pandemic_period(PARAMS) == 1
+    assert pandemic_period(replace(PARAMS, pandemic_rate=0.3)) == 1
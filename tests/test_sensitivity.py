@@ -0,0 +1,49 @@
+import numpy as np
+from utils.Auxiliary import Params, ParamName
+from discrete_model.pandemic_functions import deterministic_pandemic_function, deterministic_pandemic_mask
+from discrete_model.sensitivity import SensitivityProblem, sobol_design, sobol_estimates, sobol_indices, \
+    snap_pandemic_rate, simulate_metrics, COLONY_FRACTION, EXTINCTION_TIME
+
+PARAMS = Params(pandemic_rate=0.1, c_death_factor=0.5, selection_coefficient=0.05, l_death_factor=0.1,
+                num_of_generations=300, growth_rate=1.5, init_birds_num=3000, carrying_capacity=10000)
+
+
+def test_additive_function_indices():
+    # For f = sum(a_i * x_i) with independent uniform x_i, S1_i = ST_i = a_i ** 2 / sum(a ** 2)
+    coefficients = np.array([1., 2., 0.])
+    design = sobol_design(coefficients.size, 1024, np.random.default_rng(0))
+    values = np.stack([design @ coefficients, np.ones(design.shape[:2])], axis=-1)
+    first_order, total = sobol_estimates(values)
+
+    expected = coefficients ** 2 / np.sum(coefficients ** 2)
+    np.testing.assert_allclose(first_order[:, 0], expected, atol=0.02)
+    np.testing.assert_allclose(total[:, 0], expected, atol=0.02)
+    # A constant output has no variance to apportion
+    assert np.all(np.isnan(first_order[:, 1])) and np.all(np.isnan(total[:, 1]))
+
+
+def test_snap_pandemic_rate():
+    rates = snap_pandemic_rate(np.array([0, 0.3, 0.1, 0.0204, 1]))
+    assert rates[0] == 0
+    # There's no float whose reciprocal is 49, so 1 / 49 is snapped to the nearest period that has one
+    np.testing.assert_array_equal(1 / rates[1:], [3, 10, 48, 1])
+    # Every snapped rate makes the deterministic pandemics hit at its period
+    for rate in snap_pandemic_rate(np.linspace(0.001, 1, 200)):
+        assert deterministic_pandemic_mask(int(round(1 / rate)), rate)
+
+
+def test_deterministic_pandemic_rate_is_snapped():
+    metrics = simulate_metrics(PARAMS, deterministic_pandemic_function,
+                               {ParamName.PANDEMIC_RATE: np.array([0.3, 1 / 3])})
+    np.testing.assert_array_equal(metrics[0], metrics[1])
+
+
+def test_deterministic_sobol_indices():
+    ranges = {ParamName.PANDEMIC_RATE: (0.05, 0.5), ParamName.C_DEATH_FACTOR: (0.1, 0.9)}
+    problem = SensitivityProblem(PARAMS, ranges, deterministic_pandemic_function, seed=0)
+    result = sobol_indices(problem, 64)
+    first_order = result.index("S1", COLONY_FRACTION)
+    assert all(np.isfinite(index) for index in first_order.values())
+    assert first_order[ParamName.PANDEMIC_RATE] > 0.05
+    # Neither population goes extinct in these ranges, so the extinction time doesn't vary
+    assert all(np.isnan(index) for index in result.index("S1", EXTINCTION_TIME).values())
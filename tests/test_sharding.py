@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+from concurrent.futures import ProcessPoolExecutor
+from discrete_model.experiment import run_experiment, prepare_experiment, chunk_starts, load_results
+from discrete_model.sharding import plan_shards, run_shard, merge_shards, run_queue, parse_shard, DirectoryQueue, \
+    SQLiteQueue
+from tests.test_experiment import STOCHASTIC_SPEC
+
+CHUNK_SIZE = 2
+
+
+@pytest.fixture(scope="module")
+def expected(tmp_path_factory):
+    return run_experiment(STOCHASTIC_SPEC, str(tmp_path_factory.mktemp("single")), num_of_workers=1,
+                          chunk_size=CHUNK_SIZE)
+
+
+def test_plan_shards():
+    shards = plan_shards(STOCHASTIC_SPEC, 3, CHUNK_SIZE)
+    assert sorted(start for shard in shards for start in shard) == list(chunk_starts(STOCHASTIC_SPEC, CHUNK_SIZE))
+    assert max(map(len, shards)) - min(map(len, shards)) <= 1
+    assert parse_shard("2/3") == (1, 3)
+    with pytest.raises(ValueError):
+        parse_shard("4/3")
+
+
+def test_shard_then_merge(tmp_path, expected):
+    shard_dir_paths = [str(tmp_path / f"shard_{shard}") for shard in range(3)]
+    for shard, shard_dir_path in enumerate(shard_dir_paths):
+        run_shard(STOCHASTIC_SPEC, shard_dir_path, shard, 3, num_of_workers=1, chunk_size=CHUNK_SIZE)
+    np.testing.assert_array_equal(merge_shards(STOCHASTIC_SPEC, str(tmp_path / "merged"), shard_dir_paths), expected)
+
+
+@pytest.mark.parametrize("queue_type", [DirectoryQueue, SQLiteQueue])
+def test_queue_processes(tmp_path, expected, queue_type):
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(run_queue, STOCHASTIC_SPEC, str(tmp_path), queue_type, CHUNK_SIZE,
+                                   poll_interval=0.1) for _ in range(2)]
+        num_of_chunks = [future.result() for future in futures]
+    # A chunk may rarely be run twice
+    assert sum(num_of_chunks) >= len(chunk_starts(STOCHASTIC_SPEC, CHUNK_SIZE))
+    spec, chunks_dir, chunk_size = prepare_experiment(STOCHASTIC_SPEC, str(tmp_path))
+    np.testing.assert_array_equal(load_results(spec, chunks_dir, chunk_size), expected)
+
+
+@pytest.mark.parametrize("queue_type", [DirectoryQueue, SQLiteQueue])
+def test_expired_claim_is_taken_over(tmp_path, expected, queue_type):
+    spec, chunks_dir, chunk_size = prepare_experiment(STOCHASTIC_SPEC, str(tmp_path), CHUNK_SIZE)
+    starts = list(chunk_starts(spec, chunk_size))
+    # A node that claims a chunk and dies
+    abandoned = queue_type(chunks_dir, starts, chunk_size, lease=0.5).claim()
+    assert abandoned is not None
+    # Another node waits for the claim to expire, rather than stopping while it's live
+    assert run_queue(STOCHASTIC_SPEC, str(tmp_path), queue_type, CHUNK_SIZE, lease=0.5, poll_interval=0.1) == \
+        len(starts)
+    np.testing.assert_array_equal(load_results(spec, chunks_dir, chunk_size), expected)
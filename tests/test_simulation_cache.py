@@ -0,0 +1,79 @@
+import os
+import numpy as np
+import pytest
+from dataclasses import replace
+from utils import SimulationCache as simulation_cache
+from utils.Auxiliary import Params
+from utils.SimulationCache import SimulationCache
+from discrete_model.logistic_growth_model import logistic_growth_model
+from discrete_model.pandemic_functions import deterministic_pandemic_function, \
+    stochastic_at_death_factor_pandemic_function
+
+PARAMS = Params(pandemic_rate=0.1, c_death_factor=0.5, selection_coefficient=0.05, l_death_factor=0.1,
+                num_of_generations=200, growth_rate=1.5, init_birds_num=3000, carrying_capacity=10000)
+CALLS = []
+
+
+def engine(params: Params, pandemic_function, rng: np.random.Generator = None, num_of_workers: int = 1):
+    """
+    An engine that records the simulations it runs.
+    """
+    CALLS.append(params)
+    return logistic_growth_model(params, pandemic_function, rng)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    CALLS.clear()
+    return SimulationCache(str(tmp_path))
+
+
+def test_hit(cache):
+    first = cache.run(engine, PARAMS, deterministic_pandemic_function)
+    second = cache.run(engine, PARAMS, deterministic_pandemic_function)
+    assert len(CALLS) == 1
+    assert isinstance(second, tuple)
+    for first_array, second_array in zip(first, second):
+        np.testing.assert_array_equal(first_array, second_array)
+    # Neither the type of a numeric parameter nor the execution-only arguments change the key
+    cache.run(engine, replace(PARAMS, num_of_generations=200., init_birds_num=3000.), deterministic_pandemic_function)
+    cache.run(engine, PARAMS, deterministic_pandemic_function, num_of_workers=4)
+    assert len(CALLS) == 1
+
+
+def test_miss(cache):
+    cache.run(engine, PARAMS, deterministic_pandemic_function)
+    cache.run(engine, replace(PARAMS, c_death_factor=0.6), deterministic_pandemic_function)
+    cache.run(engine, PARAMS, stochastic_at_death_factor_pandemic_function, seed=1)
+    cache.run(engine, PARAMS, stochastic_at_death_factor_pandemic_function, seed=2)
+    assert len(CALLS) == 4
+    cache.run(engine, PARAMS, stochastic_at_death_factor_pandemic_function, seed=2)
+    assert len(CALLS) == 4
+
+
+def test_unseeded_stochastic_runs_are_not_cached(cache):
+    cache.run(engine, PARAMS, stochastic_at_death_factor_pandemic_function)
+    cache.run(engine, PARAMS, stochastic_at_death_factor_pandemic_function)
+    assert len(CALLS) == 2
+    assert not os.listdir(cache.cache_dir)
+
+
+def test_model_source_is_part_of_the_key(monkeypatch):
+    key = SimulationCache.key(logistic_growth_model, PARAMS, deterministic_pandemic_function)
+    monkeypatch.setattr(simulation_cache, "_model_source_hash", lambda: "changed")
+    assert SimulationCache.key(logistic_growth_model, PARAMS, deterministic_pandemic_function) != key
+
+
+def test_eviction(tmp_path):
+    result = np.zeros(1000)
+    cache = SimulationCache(str(tmp_path))
+    cache.put("first", result)
+    cache.max_size = 2.5 * os.path.getsize(cache._path("first"))
+    cache.put("second", result)
+    os.utime(cache._path("first"), (1, 1))
+    os.utime(cache._path("second"), (2, 2))
+    # Reading the first result makes it the most recently used, so the second one is evicted
+    assert cache.get("first") is not None
+    cache.put("third", result)
+    assert cache.get("second") is None
+    assert cache.get("first") is not None and cache.get("third") is not None
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from dataclasses import replace
+from utils.Auxiliary import Params
+from discrete_model.ensemble_model import ensemble_logistic_growth_model, reduce_ensemble
+from discrete_model.logistic_growth_model import logistic_growth_model
+from discrete_model.pandemic_functions import type_shift, type_shift_batch, types_shift_model_deter_function, \
+    types_shift_model_deter_function_batch, types_shift_model_stoch_function
+from discrete_model.reducers import TrailingMean
+
+PARAMS = Params(pandemic_rate=0.1, c_death_factor=0.5, selection_coefficient=0.05, l_death_factor=0.1,
+                num_of_generations=300, growth_rate=1.5, init_birds_num=3000, carrying_capacity=10000,
+                shift_factor=0.01)
+SHIFT_FACTORS = np.array([0., 0.001, 0.01, 0.1])
+
+
+def test_type_shift_batch_matches_type_shift():
+    # Populations for which the shift of one type or both is below one bird
+    colony_birds = np.array([50., 150., 5000., 99., 2000.])
+    lone_birds = np.array([5000., 90., 120., 101., 0.])
+    params = replace(PARAMS, shift_factor=0.01)
+    batch_colony_birds, batch_lone_birds = colony_birds.copy(), lone_birds.copy()
+    type_shift_batch(batch_colony_birds, batch_lone_birds, params)
+    for run in range(colony_birds.size):
+        expected_colony_birds, expected_lone_birds = colony_birds[run:run + 1].copy(), lone_birds[run:run + 1].copy()
+        type_shift(expected_colony_birds, expected_lone_birds, 0, params)
+        assert batch_colony_birds[run] == pytest.approx(expected_colony_birds[0], rel=1e-12)
+        assert batch_lone_birds[run] == pytest.approx(expected_lone_birds[0], rel=1e-12)
+
+
+@pytest.mark.parametrize("pandemic_function", [types_shift_model_deter_function,
+                                               types_shift_model_deter_function_batch])
+def test_batched_type_shift_model_matches_scalar_runs(pandemic_function):
+    colony_birds, lone_birds = ensemble_logistic_growth_model(replace(PARAMS, shift_factor=SHIFT_FACTORS),
+                                                              pandemic_function, SHIFT_FACTORS.size)
+    avg_fracs, = reduce_ensemble(replace(PARAMS, shift_factor=SHIFT_FACTORS), pandemic_function, [TrailingMean(50)],
+                                 SHIFT_FACTORS.size)
+    for run, shift_factor in enumerate(SHIFT_FACTORS):
+        expected_colony_birds, expected_lone_birds = logistic_growth_model(replace(PARAMS, shift_factor=shift_factor),
+                                                                           types_shift_model_deter_function)
+        np.testing.assert_allclose(colony_birds[run], expected_colony_birds, rtol=1e-12)
+        np.testing.assert_allclose(lone_birds[run], expected_lone_birds, rtol=1e-12)
+        expected = np.mean((expected_colony_birds / (expected_colony_birds + expected_lone_birds))[-50:])
+        assert avg_fracs[run] == pytest.approx(expected, rel=1e-12)
+
+
+def test_stochastic_type_shift_single_run_matches_scalar_run():
+    colony_birds, lone_birds = ensemble_logistic_growth_model(PARAMS, types_shift_model_stoch_function, 1,
+                                                              np.random.default_rng(3))
+    expected_colony_birds, expected_lone_birds = logistic_growth_model(PARAMS, types_shift_model_stoch_function,
+                                                                       np.random.default_rng(3))
+    np.testing.assert_allclose(colony_birds[0], expected_colony_birds, rtol=1e-12)
+    np.testing.assert_allclose(lone_birds[0], expected_lone_birds, rtol=1e-12)
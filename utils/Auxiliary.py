@@ -1,5 +1,6 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, fields, replace, FrozenInstanceError
 from enum import Enum
+from typing import Dict, Iterator, Tuple, Union
 import numpy as np
 
 
@@ -9,6 +10,7 @@ class Model(Enum):
     STOCHASTIC2 = 2
     STOCHASTIC3 = 3
     TYPE_SHIFT = 4
+    STOCHASTIC_TYPE_SHIFT = 5
 
 
 class ParamName(Enum):
@@ -41,10 +43,13 @@ class BirdsPopulations:
     def get_num_of_generations(self):
         return np.arange(len(self.colony_birds))
 
-@dataclass
+@dataclass(frozen=True)
 class Params:
     """
-    A dataclass that contains all the parameters for a simulation of the models.
+    An immutable dataclass that contains all the parameters for a simulation of the models. Use dataclasses.replace
+    to get parameters with some values changed. Params with scalar values are hashable, so they can key dicts and sets.
+    The batched engines also take Params whose values are arrays with one value per replicate - ParamBatch builds
+    those.
     """
     pandemic_rate: float
     c_death_factor: float
@@ -58,9 +63,7 @@ class Params:
     shift_factor: float = None
 
     def copy(self):
-        return Params(self.pandemic_rate, self.c_death_factor, self.selection_coefficient, self.l_death_factor,
-                      self.num_of_generations, self.growth_rate, self.init_birds_num, self.carrying_capacity,
-                      self.shift_factor)
+        return replace(self)
 
     def write_to_file(self, file_path):
 
@@ -78,10 +81,172 @@ class Params:
 
 MODEL_NAMES = {Model.DETER: "Deterministic_model", Model.STOCHASTIC1: "Stochastic1_model",
                Model.STOCHASTIC2: "Stochastic2_model", Model.STOCHASTIC3: "Stochastic3_model",
-               Model.TYPE_SHIFT: "Type_shift_model"}
+               Model.TYPE_SHIFT: "Type_shift_model", Model.STOCHASTIC_TYPE_SHIFT: "Stochastic_type_shift_model"}
 
 PARAM_NAMES = {ParamName.PANDEMIC_RATE: "Pandemic rate", ParamName.C_DEATH_FACTOR: "Colony death factor",
                ParamName.SELECTION_COEFFICIENT: "Selection coefficient", ParamName.L_DEATH_FACTOR: "Lone death factor",
                ParamName.NUM_OF_GENERATIONS: "Number of generations", ParamName.GROWTH_RATE: "Growth rate",
                ParamName.INIT_BIRDS_NUM: "Initial number of birds", ParamName.CARRYING_CAPACITY: "Carrying capacity",
                ParamName.SHIFT_FACTOR: "Shift factor"}
+
+# The name of the Params field that holds each parameter.
+PARAM_FIELDS = {ParamName.PANDEMIC_RATE: "pandemic_rate", ParamName.C_DEATH_FACTOR: "c_death_factor",
+                ParamName.SELECTION_COEFFICIENT: "selection_coefficient", ParamName.L_DEATH_FACTOR: "l_death_factor",
+                ParamName.NUM_OF_GENERATIONS: "num_of_generations", ParamName.GROWTH_RATE: "growth_rate",
+                ParamName.INIT_BIRDS_NUM: "init_birds_num", ParamName.CARRYING_CAPACITY: "carrying_capacity",
+                ParamName.SHIFT_FACTOR: "shift_factor"}
+
+
+class ParamBatch:
+    """
+    An immutable batch of parameter sets, stored as a struct of arrays - each parameter is a read-only array of the
+    shape of the batch, available as an attribute (batch.pandemic_rate). The batch is built by broadcasting values
+    together, as the Cartesian product of values of some parameters (ParamBatch.product), or by zipping them
+    (ParamBatch.zip). The batched engines take a batch instead of Params, and run every parameter set of it.
+    """
+
+    def __init__(self, params: Params, values: Dict[ParamName, np.ndarray] = None):
+        """
+        :param params: The values of the parameters. Array values are broadcast together with 'values'.
+        :param values: Maps parameters to their values, broadcast together to the shape of the batch.
+        """
+        field_values = {field.name: getattr(params, field.name) for field in fields(Params)}
+        for name, value in (values or {}).items():
+            field_values[PARAM_FIELDS[name]] = value
+        names = [name for name, value in field_values.items() if value is not None]
+        arrays = dict.fromkeys(field_values)
+        for name, array in zip(names, np.broadcast_arrays(*(np.asarray(field_values[name]) for name in names))):
+            arrays[name] = _read_only(np.array(array))
+        object.__setattr__(self, "_arrays", arrays)
+        object.__setattr__(self, "shape", arrays[names[0]].shape)
+
+    @classmethod
+    def product(cls, params: Params, axes: Dict[ParamName, np.ndarray]) -> "ParamBatch":
+        """
+        Creates the batch of every combination of the values of the axes.
+        :param params: The rest of the parameters.
+        :param axes: Maps each swept parameter to its values.
+        :return: A batch with one dimension per axis, in the order of 'axes'.
+        """
+        mesh = np.meshgrid(*(np.asarray(axis_values) for axis_values in axes.values()), indexing='ij')
+        return cls(params, dict(zip(axes, mesh)))
+
+    @classmethod
+    def zip(cls, params: Params, axes: Dict[ParamName, np.ndarray]) -> "ParamBatch":
+        """
+        Creates the batch of the i-th values of all the axes together, for each i.
+        :param params: The rest of the parameters.
+        :param axes: Maps each parameter to its values. All the axes must have the same number of values.
+        :return: A one dimensional batch.
+        """
+        axes = {name: np.ravel(axis_values) for name, axis_values in axes.items()}
+        sizes = {axis_values.size for axis_values in axes.values()}
+        if len(sizes) > 1:
+            raise ValueError(f"Can't zip axes of different sizes {sorted(sizes)}")
+        return cls(params, axes)
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape))
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    def with_values(self, values: Dict[ParamName, np.ndarray]) -> "ParamBatch":
+        """
+        :return: A batch with the given values, broadcast together with the values of this batch.
+        """
+        return ParamBatch(Params(**self._arrays), values)
+
+    def reshape(self, *shape) -> "ParamBatch":
+        return ParamBatch(Params(**{name: None if array is None else array.reshape(*shape)
+                                    for name, array in self._arrays.items()}))
+
+    def ravel(self) -> "ParamBatch":
+        return self.reshape(-1)
+
+    def to_params(self, num_of_runs: int = 1) -> Params:
+        """
+        Converts the batch to the Params the batched engines run, with one value per replicate. Parameters that are
+        the same for the whole batch stay scalars.
+        :param num_of_runs: The number of replicates of each parameter set. The replicates of a set are consecutive.
+        :return: Params with arrays of size batch.size * num_of_runs, in C order of the batch.
+        """
+        values = {}
+        for name, array in self._arrays.items():
+            if array is None or array.size == 0:
+                values[name] = array
+            elif np.all(array == array.flat[0]):
+                values[name] = array.flat[0].item()
+            elif name == PARAM_FIELDS[ParamName.NUM_OF_GENERATIONS]:
+                raise ValueError("All the parameter sets of a batch must have the same number of generations")
+            else:
+                values[name] = np.repeat(array.ravel(), num_of_runs)
+        return Params(**values)
+
+    def __getattr__(self, name: str) -> np.ndarray:
+        if name.startswith("_") or name not in self._arrays:
+            raise AttributeError(f"{type(self).__name__} has no attribute {name}")
+        return self._arrays[name]
+
+    def __setattr__(self, name: str, value) -> None:
+        raise FrozenInstanceError(f"cannot assign to field '{name}'")
+
+    def __getitem__(self, index) -> Union[Params, "ParamBatch"]:
+        """
+        :return: The parameter set at the index, or the sub batch of a slice.
+        """
+        values = {name: None if array is None else array[index] for name, array in self._arrays.items()}
+        if all(np.ndim(value) == 0 for value in values.values()):
+            return Params(**{name: None if value is None else value.item() for name, value in values.items()})
+        return ParamBatch(Params(**values))
+
+    def __iter__(self) -> Iterator[Params]:
+        """
+        Iterates over the parameter sets of the batch, in C order.
+        """
+        for index in np.ndindex(*self.shape):
+            yield self[index]
+
+    def __len__(self) -> int:
+        return self.shape[0] if self.shape else 1
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, ParamBatch) and self.shape == other.shape and \
+            all(np.array_equal(array, other._arrays[name]) if array is not None else other._arrays[name] is None
+                for name, array in self._arrays.items())
+
+    def __hash__(self) -> int:
+        return hash((self.shape, tuple((name, None if array is None else array.tobytes())
+                                       for name, array in self._arrays.items())))
+
+    def __repr__(self) -> str:
+        values = ", ".join(f"{name}={array!r}" for name, array in self._arrays.items())
+        return f"ParamBatch(shape={self.shape}, {values})"
+
+    def __getstate__(self) -> Dict:
+        return dict(self.__dict__)
+
+    def __setstate__(self, state: Dict) -> None:
+        # Unpickled arrays are writeable again
+        object.__setattr__(self, "_arrays", {name: None if array is None else _read_only(array)
+                                             for name, array in state["_arrays"].items()})
+        object.__setattr__(self, "shape", state["shape"])
+
+
+def batch_params(params: Union[Params, ParamBatch], num_of_runs: int = 1) -> Tuple[Params, int]:
+    """
+    Lets the batched engines take a ParamBatch as their params.
+    :param params: Params, or a batch of parameter sets.
+    :param num_of_runs: The number of replicates (of each parameter set of a batch).
+    :return: Params with one value per replicate, and the total number of replicates.
+    """
+    if isinstance(params, ParamBatch):
+        return params.to_params(num_of_runs), params.size * num_of_runs
+    return params, num_of_runs
+
+
+def _read_only(array: np.ndarray) -> np.ndarray:
+    array.flags.writeable = False
+    return array
@@ -1,8 +1,15 @@
 import os
+import zipfile
+from dataclasses import astuple, fields
 from datetime import datetime
-import pandas as pd
 import numpy as np
 from utils.Auxiliary import Params, BirdsPopulations
+from utils.Instrumentation import timed, SAVE
+from typing import List, Tuple
+
+RUN_STORE_SUFFIX = ".npz"
+# The columns of the parameters in a run store, one per Params field. A missing shift factor is stored as NaN.
+PARAMS_DTYPE = np.dtype([(field.name, np.int64 if field.type is int else np.float64) for field in fields(Params)])
 
 
 def mk_dir_for_stoch_avg(dir_path: str, params: Params, model_name: str):
@@ -63,13 +70,17 @@ def make_new_dir(dir_path, dir_name):
     return new_dir
 
 
+@timed(SAVE)
 def save_heatmap_data(dir_path, x_axis, y_axis, data, map_name=""):
+    # pandas is imported where it's used, so that the simulation paths don't load it
+    import pandas as pd
 
     data_file_path = os.path.join(dir_path, f'{map_name}_heatmap_data.csv')
     df = pd.DataFrame(data=data, index=y_axis, columns=x_axis)
     df.to_csv(data_file_path)
 
 
+@timed(SAVE)
 def save_single_run(dir_path: str, params: Params, birds_populations: BirdsPopulations, model_name: str):
 
     # Creating new directory for the run
@@ -80,6 +91,7 @@ def save_single_run(dir_path: str, params: Params, birds_populations: BirdsPopul
     # Creating header file
     make_header_file(new_dir_path, model_name, date_time, params)
     # Creating data file and saving data
+    import pandas as pd
     data_file_path = os.path.join(new_dir_path, f'{model_name}_run_data_{date_time}.csv')
     generations = [i for i in range(1, params.num_of_generations+1)]
     columns = ["Total population", "Colony birds population", "Lone birds population", "Colony birds fraction"]
@@ -90,6 +102,7 @@ def save_single_run(dir_path: str, params: Params, birds_populations: BirdsPopul
 
 
 def data_extractor(path):
+    import pandas as pd
 
     df = pd.read_csv(path)
     data = df.iloc[:, 1:].to_numpy()
@@ -98,13 +111,116 @@ def data_extractor(path):
     return data, death_factors, pandemic_rates
 
 
+def mk_run_store(dir_path: str, experiment_name: str, dtype=np.float32, compress: bool = True):
+    """
+    Creates a new run store file for an experiment.
+    :param dir_path: Path to directory in which to save the file.
+    :param experiment_name: The name of the experiment, the file name is the name and the date and time.
+    :param dtype: The data type of the stored populations.
+    :param compress: Whether to compress the stored populations.
+    :return: The run store.
+    """
+    os.makedirs(dir_path, exist_ok=True)
+    date_time = datetime.now().strftime("%Y-%m-%d_%H-%M-%S-%f")
+    return RunStore(os.path.join(dir_path, f"{experiment_name}_{date_time}{RUN_STORE_SUFFIX}"), dtype, compress)
 
 
+class RunStore:
+    """
+    Stores many runs of an experiment in a single file. Each appended batch of runs is a chunk of three arrays:
+    the parameters of the runs (one column per Params field), and the colony and lone birds populations
+    (one row per run). The file is a zip of .npy arrays, so it can also be opened with np.load.
+    All the runs in a store must have the same number of generations.
+    """
 
-
-
-
-
-
-
-
+    def __init__(self, file_path: str, dtype=np.float32, compress: bool = True):
+        """
+        :param file_path: The path of the store file. Runs are appended to it if it already exists.
+        :param dtype: The data type of the stored populations.
+        :param compress: Whether to compress the stored populations.
+        """
+        self.file_path = file_path
+        self.dtype = dtype
+        self.compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+
+    @timed(SAVE)
+    def append(self, params: List[Params], colony_birds: np.ndarray, lone_birds: np.ndarray) -> None:
+        """
+        Appends a batch of runs to the store as a new chunk.
+        :param params: The parameters of each run.
+        :param colony_birds: The colony birds populations, of shape (number of runs, number of generations).
+        :param lone_birds: The lone birds populations, of the same shape.
+        """
+        colony_birds, lone_birds = np.atleast_2d(colony_birds), np.atleast_2d(lone_birds)
+        if not len(params) == colony_birds.shape[0] == lone_birds.shape[0]:
+            raise ValueError("The number of parameters and of populations rows must be the same")
+        records = np.array([tuple(np.nan if value is None else value for value in astuple(run_params))
+                            for run_params in params], dtype=PARAMS_DTYPE)
+
+        chunk = len(self._chunk_names())
+        with zipfile.ZipFile(self.file_path, mode='a', compression=self.compression) as store:
+            for name, array in ((self._member(chunk, "params"), records),
+                                (self._member(chunk, "colony"), colony_birds.astype(self.dtype)),
+                                (self._member(chunk, "lone"), lone_birds.astype(self.dtype))):
+                with store.open(name, mode='w', force_zip64=True) as member:
+                    np.lib.format.write_array(member, array, allow_pickle=False)
+
+    def read_params(self) -> np.ndarray:
+        """
+        Reads the parameters of all the runs, without their populations.
+        :return: A structured array with a column for each Params field.
+        """
+        with zipfile.ZipFile(self.file_path) as store:
+            chunks = [self._read_member(store, self._member(chunk, "params")) for chunk in self._chunk_names()]
+        return np.concatenate(chunks) if chunks else np.empty(0, dtype=PARAMS_DTYPE)
+
+    def read(self, **conditions) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Reads the runs whose parameters match all the conditions. Only the chunks with matching runs are read.
+        :param conditions: Params field names mapped to a value (compared with np.isclose), or to a function that
+        gets the column and returns a boolean mask.
+        :return: The parameters (a structured array), colony birds and lone birds populations of the matching runs.
+        """
+        params, colony_birds, lone_birds = [], [], []
+        with zipfile.ZipFile(self.file_path) as store:
+            for chunk in self._chunk_names():
+                records = self._read_member(store, self._member(chunk, "params"))
+                mask = np.ones(records.size, dtype=bool)
+                for name, condition in conditions.items():
+                    mask &= condition(records[name]) if callable(condition) else np.isclose(records[name], condition)
+                if np.any(mask):
+                    params.append(records[mask])
+                    colony_birds.append(self._read_member(store, self._member(chunk, "colony"))[mask])
+                    lone_birds.append(self._read_member(store, self._member(chunk, "lone"))[mask])
+
+        if not params:
+            return np.empty(0, dtype=PARAMS_DTYPE), np.empty((0, 0), self.dtype), np.empty((0, 0), self.dtype)
+        return np.concatenate(params), np.concatenate(colony_birds), np.concatenate(lone_birds)
+
+    def __len__(self):
+        return self.read_params().size
+
+    def _chunk_names(self) -> List[str]:
+        if not os.path.exists(self.file_path):
+            return []
+        with zipfile.ZipFile(self.file_path) as store:
+            return sorted({name.split("_")[1] for name in store.namelist() if name.startswith("chunk_")})
+
+    @staticmethod
+    def _member(chunk, array_name: str) -> str:
+        return f"chunk_{int(chunk):06d}_{array_name}.npy"
+
+    @staticmethod
+    def _read_member(store: zipfile.ZipFile, name: str) -> np.ndarray:
+        with store.open(name) as member:
+            return np.lib.format.read_array(member, allow_pickle=False)
+
+
+def params_from_record(record) -> Params:
+    """
+    Converts a row of the parameters of a run store back to Params.
+    """
+    values = {name: record[name].item() for name in PARAMS_DTYPE.names}
+    if np.isnan(values["shift_factor"]):
+        values["shift_factor"] = None
+    return Params(**values)
@@ -0,0 +1,174 @@
+import os
+import io
+import time
+import pstats
+import cProfile
+import functools
+from contextlib import contextmanager, nullcontext
+from collections import defaultdict
+from typing import Callable, Dict
+
+# Setting this environment variable to "1" enables the instrumentation at import, "profile" enables cProfile too.
+INSTRUMENTATION_ENV_VAR = "BIRDS_INSTRUMENTATION"
+PROFILE_ENV_VALUE = "profile"
+# Stage names
+SIMULATION, RNG, SWEEP, SAVE, PLOT = "simulation", "rng", "sweep", "save", "plot"
+# Counter names
+GENERATIONS, RNG_DRAWS = "generations simulated", "rng draws"
+PROFILE_LINES = 25
+_DISABLED_TIMER = nullcontext()
+
+
+class _State:
+    """
+    The instrumentation state. When disabled, timers and counters only check the 'enabled' flag.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.profiler = None
+        self.reset()
+
+    def reset(self):
+        self.total_times = defaultdict(float)
+        self.self_times = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        # The number of running timers of each stage, so a stage nested in itself is timed once
+        self.running = defaultdict(int)
+        # The time spent in the timers nested in each running timer
+        self.stack = []
+        self.start_time = time.perf_counter()
+
+
+_STATE = _State()
+
+
+def enable(profile: bool = False) -> None:
+    """
+    Enables the timers and counters, and resets them.
+    :param profile: Whether to capture a cProfile profile too.
+    """
+    _STATE.reset()
+    _STATE.enabled = True
+    if profile:
+        _STATE.profiler = cProfile.Profile()
+        _STATE.profiler.enable()
+
+
+def disable() -> None:
+    _STATE.enabled = False
+    if _STATE.profiler is not None:
+        _STATE.profiler.disable()
+
+
+def is_enabled() -> bool:
+    return _STATE.enabled
+
+
+def count(name: str, amount: int = 1) -> None:
+    """
+    Increases a counter, if the instrumentation is enabled.
+    """
+    if _STATE.enabled:
+        _STATE.counters[name] += amount
+
+
+def timer(name: str):
+    """
+    A context manager that adds the time of its block to the named stage, if the instrumentation is enabled.
+    Timers may be nested - the self time of a stage excludes the time of the stages nested in it.
+    """
+    if not _STATE.enabled:
+        return _DISABLED_TIMER
+    return _timer(name)
+
+
+def timed(name: str) -> Callable:
+    """
+    A decorator that adds the time of every call of the function to the named stage.
+    """
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _STATE.enabled:
+                return function(*args, **kwargs)
+            with _timer(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def stage_times() -> Dict[str, Dict[str, float]]:
+    """
+    :return: The total time, self time and number of calls of each stage.
+    """
+    return {name: {"total": _STATE.total_times[name], "self": _STATE.self_times[name], "calls": _STATE.calls[name]}
+            for name in _STATE.total_times}
+
+
+def counters() -> Dict[str, int]:
+    return dict(_STATE.counters)
+
+
+def report() -> str:
+    """
+    Creates the per stage breakdown of the time since the instrumentation was enabled, the counters and the profile.
+    """
+    wall_time = time.perf_counter() - _STATE.start_time
+    lines = [f"Wall time: {wall_time:.3f}s",
+             f"{'Stage':<30}{'Calls':>10}{'Total [s]':>12}{'Self [s]':>12}{'Self %':>8}"]
+    for name, times in sorted(stage_times().items(), key=lambda item: -item[1]["self"]):
+        lines.append(f"{name:<30}{times['calls']:>10}{times['total']:>12.3f}{times['self']:>12.3f}"
+                     f"{100 * times['self'] / wall_time:>8.1f}")
+    for name, value in sorted(_STATE.counters.items()):
+        lines.append(f"{name}: {value}")
+    if _STATE.profiler is not None:
+        stream = io.StringIO()
+        pstats.Stats(_STATE.profiler, stream=stream).sort_stats("cumulative").print_stats(PROFILE_LINES)
+        lines.append(stream.getvalue())
+    return "\n".join(lines)
+
+
+def print_report() -> None:
+    """
+    Prints the report at the end of a script, if the instrumentation is enabled.
+    """
+    if _STATE.enabled:
+        print(report())
+
+
+@contextmanager
+def instrumented(profile: bool = False):
+    """
+    Enables the instrumentation for a block and prints the report at its end.
+    """
+    enable(profile)
+    try:
+        yield
+    finally:
+        disable()
+        print(report())
+
+
+@contextmanager
+def _timer(name: str):
+    _STATE.stack.append(0.)
+    _STATE.running[name] += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        nested_time = _STATE.stack.pop()
+        if _STATE.stack:
+            _STATE.stack[-1] += elapsed
+        _STATE.running[name] -= 1
+        if _STATE.running[name] == 0:
+            _STATE.total_times[name] += elapsed
+        _STATE.self_times[name] += elapsed - nested_time
+        _STATE.calls[name] += 1
+
+
+if os.environ.get(INSTRUMENTATION_ENV_VAR):
+    enable(profile=os.environ[INSTRUMENTATION_ENV_VAR] == PROFILE_ENV_VALUE)
@@ -1,36 +1,102 @@
+import os
 import numpy as np
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
+from concurrent.futures import ProcessPoolExecutor
 from utils.Auxiliary import Params, BirdsPopulations
-from typing import List, Tuple
+from utils.Instrumentation import timed, PLOT
+from typing import List, Tuple, TYPE_CHECKING
+# plotly is imported in the plotting functions, so that importing the Plotter doesn't load it
+if TYPE_CHECKING:
+    import plotly.graph_objects as go
 
 DEFAULT_FONT = 'Calibri'
 DEFAULT_FONT_SIZE = 28
 STYLE_CONFIG = {'family': DEFAULT_FONT, 'size': DEFAULT_FONT_SIZE}
 GENERATIONS_STR, COLONY_BIRDS_STR, LONE_BIRDS_STR = "Generations", "Colony birds", "Lone birds"
+# Export formats
+HTML, PNG, SVG = "html", "png", "svg"
+# Setting this environment variable to a directory makes the plots export their figures there instead of showing them.
+FIGURES_DIR_ENV_VAR = "BIRDS_FIGURES_DIR"
 
 
 class Plotter:
     """
     A Plotter object that creates different plots by using static methods.
+    By default the figures are shown. After start_export the figures are collected instead, and finish_export writes
+    them all to files in parallel, without a browser.
     """
+    # The export settings, export_dir is None when the figures are shown
+    export_dir = None
+    export_formats = (HTML,)
+    # The maximal number of points of a population trace, None for all of them
+    max_points = None
+    _pending_figures = []
+
+    @staticmethod
+    def start_export(dir_path: str, formats: Tuple[str, ...] = (HTML,), max_points: int = None) -> None:
+        """
+        Starts collecting the figures for export instead of showing them.
+        :param dir_path: The directory of the figure files, created if it doesn't exist.
+        :param formats: The file formats of each figure - HTML, PNG and/or SVG. PNG and SVG require kaleido.
+        :param max_points: If given, the population traces are downsampled to this number of points.
+        """
+        os.makedirs(dir_path, exist_ok=True)
+        Plotter.export_dir, Plotter.export_formats, Plotter.max_points = dir_path, tuple(formats), max_points
+        Plotter._pending_figures = []
+
+    @staticmethod
+    def finish_export(num_of_workers: int = None) -> List[str]:
+        """
+        Writes the collected figures to files, split between worker processes, and returns to showing the figures.
+        The HTML files load plotly.js from a CDN, to keep them small.
+        :param num_of_workers: The number of worker processes, defaults to the number of CPUs.
+        :return: The paths of the written files.
+        """
+        pending, formats = Plotter._pending_figures, Plotter.export_formats
+        Plotter.export_dir, Plotter.max_points, Plotter._pending_figures = None, None, []
+        if num_of_workers == 1 or len(pending) <= 1:
+            written = [_write_figure(figure_json, base_path, formats) for figure_json, base_path in pending]
+        else:
+            with ProcessPoolExecutor(max_workers=num_of_workers) as executor:
+                written = list(executor.map(_write_figure, *zip(*pending), [formats] * len(pending)))
+        return [path for paths in written for path in paths]
+
     @staticmethod
-    def plot_birds_numbers_scatter_plot(colony_birds, lone_birds, model_name):
+    def show(fig: "go.Figure", name: str = "figure") -> None:
+        """
+        Shows the figure, or collects it for export.
+        :param name: The name of the figure files, prefixed by their index.
+        """
+        if Plotter.export_dir is None:
+            fig.show()
+            return
+        base_path = os.path.join(Plotter.export_dir, f"{len(Plotter._pending_figures):04d}_{name}")
+        Plotter._pending_figures.append((fig.to_json(), base_path))
+
+    @staticmethod
+    @timed(PLOT)
+    def plot_birds_numbers_scatter_plot(colony_birds, lone_birds, model_name, max_points: int = None):
         """
         Plots the number of birds of each type as a function of generations of the simulation.
         :param model_name: The models' name to enter the plot title.
         :param colony_birds: The numbers of colony birds in each generation.
         :param lone_birds: The numbers of lone birds in each generation.
-        :return: None.
+        :param max_points: If given, each trace is downsampled to this number of points. Defaults to max_points of
+        the export settings.
+        :return: The figure.
         """
+        import plotly.graph_objects as go
         generations = np.arange(len(colony_birds))
-        return go.Figure(data=[go.Scatter(x=generations, y=lone_birds, name="Lone birds"),
-                        go.Scatter(x=generations, y=colony_birds, name="Colony birds")],
+        max_points = Plotter.max_points if max_points is None else max_points
+        lone_x, lone_y = downsample_lttb(generations, np.asarray(lone_birds), max_points)
+        colony_x, colony_y = downsample_lttb(generations, np.asarray(colony_birds), max_points)
+        return go.Figure(data=[go.Scatter(x=lone_x, y=lone_y, name="Lone birds"),
+                        go.Scatter(x=colony_x, y=colony_y, name="Colony birds")],
                         layout={"xaxis": {"title": "Generations"}, "yaxis": {"title": "Number of birds"},
                           "title": f"{model_name}", "font":STYLE_CONFIG})
 
 
     @staticmethod
+    @timed(PLOT)
     def plot_average_fraction_of_wins(pandemic_chances, wins_fractions_arr, title):
         """
         Plots the average fraction of gathering birds win as a function of the chance for a pandemic each year.
@@ -38,27 +104,37 @@ class Plotter:
         :param wins_fractions_arr: The average fractions array.
         :return: None.
         """
-        go.Figure(data=[go.Scatter(x=pandemic_chances, y=wins_fractions_arr)],
+        import plotly.graph_objects as go
+        Plotter.show(go.Figure(data=[go.Scatter(x=pandemic_chances, y=wins_fractions_arr)],
                   layout={"xaxis": {"title": "parameter"}, "yaxis": {"title": "Fraction of colony birds"},
-                  "title": title}).show()
+                  "title": title}), "average_fraction_of_wins")
 
     @staticmethod
+    @timed(PLOT)
     def plot_heatmap(mat: np.ndarray, stats1: np.ndarray, stats2: np.ndarray,
                      title_text: str = None, xaxis_title: str = None,
                      yaxis_title: str = None, legend_title=None):
+        import plotly.graph_objects as go
 
         fig = go.Figure(data=[go.Heatmap(x=stats1, y=stats2, z=mat,
                                    colorbar=dict(title=legend_title), colorscale="darkmint")],
           layout={"xaxis": {"title": xaxis_title}, "yaxis": {"title": yaxis_title},
                   "title": title_text})
         fig.update_layout(font=STYLE_CONFIG)
-        fig.show()
+        Plotter.show(fig, "heatmap")
 
     @staticmethod
-    def plot_scatter_subplots(num_rows: int, num_cols: int, data: List[BirdsPopulations], subplot_titles: Tuple):
+    @timed(PLOT)
+    def plot_scatter_subplots(num_rows: int, num_cols: int, data: List[BirdsPopulations], subplot_titles: Tuple,
+                              max_points: int = None):
         """
         data: [ [colony_birds, lone_birds], [colony_birds, lone_birds],  ... ]
+        max_points: If given, each trace is downsampled to this number of points. Defaults to max_points of the
+        export settings.
         """
+        import plotly.graph_objects as go
+        from plotly.subplots import make_subplots
+        max_points = Plotter.max_points if max_points is None else max_points
         font = "Calibri"
         font_size = 22
         fig = make_subplots(rows=num_rows, cols=num_cols, shared_xaxes=False, x_title=GENERATIONS_STR,
@@ -70,22 +146,28 @@ class Plotter:
             for j in range(num_cols):
                 if j != 0 or i != 0:
                     show_legend = False
-                fig.add_trace(go.Scatter(x=data[i+j].get_num_of_generations(), y=data[i+j].colony_birds,
+                generations = data[i + j].get_num_of_generations()
+                colony_x, colony_y = downsample_lttb(generations, np.asarray(data[i + j].colony_birds), max_points)
+                lone_x, lone_y = downsample_lttb(generations, np.asarray(data[i + j].lone_birds), max_points)
+                fig.add_trace(go.Scatter(x=colony_x, y=colony_y,
                                          marker=dict(color=color1), name=COLONY_BIRDS_STR, showlegend=show_legend),
                               row=i + 1, col=j + 1)
-                fig.add_trace(go.Scatter(x=data[i + j].get_num_of_generations(), y=data[i + j].lone_birds,
+                fig.add_trace(go.Scatter(x=lone_x, y=lone_y,
                                          marker=dict(color=color2), name=LONE_BIRDS_STR, showlegend=show_legend),
                               row=i + 1, col=j + 1)
         fig.update_layout(font=dict(family=font, size=font_size-2))
-        fig.show()
+        Plotter.show(fig, "scatter_subplots")
 
     @staticmethod
+    @timed(PLOT)
     def plot_heatmap_subplots(num_rows, num_cols, data, params, subplot_titles, param_names=None):
         """
         params: [ [params0], [params1] ]
         data: [ matrix1, matrix2, ... ]
         param_names: (param0, param1)
         """
+        import plotly.graph_objects as go
+        from plotly.subplots import make_subplots
         font = "Calibri"
         font_size = 20
         fig = make_subplots(rows=num_rows, cols=num_cols, subplot_titles=subplot_titles, x_title=param_names[0],
@@ -103,15 +185,78 @@ class Plotter:
 
         fig.update_layout(height=500)
 
-        fig.show()
+        Plotter.show(fig, "heatmap_subplots")
 
     @staticmethod
+    @timed(PLOT)
     def plot_bar_plot(x_values, y_values, x_title, y_title, plot_title):
         """
         Creates a bar plot with the given values.
         """
+        import plotly.graph_objects as go
         fig = go.Figure(data=[go.Bar(x=x_values, y=y_values)],
                         layout={"xaxis": {"title": x_title}, "yaxis": {"title": y_title}, "title": plot_title})
-        fig.show()
+        Plotter.show(fig, "bar_plot")
+
+    @staticmethod
+    @timed(PLOT)
+    def plot_line_plot(x_values, y_values, x_title, y_title, plot_title):
+        """
+        Creates a line plot with the given values.
+        """
+        import plotly.graph_objects as go
+        fig = go.Figure(data=[go.Scatter(x=x_values, y=y_values, mode="lines+markers")],
+                        layout={"xaxis": {"title": x_title}, "yaxis": {"title": y_title}, "title": plot_title})
+        fig.update_layout(font=STYLE_CONFIG)
+        Plotter.show(fig, "line_plot")
+
+
+def downsample_lttb(x: np.ndarray, y: np.ndarray, num_of_points: int = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Downsamples a trace with the largest-triangle-three-buckets algorithm, which keeps the visual shape - the peaks
+    and drops of the pandemics are kept. The first and last points are always kept, and one point is picked from
+    each bucket of the rest - the one forming the largest triangle with the previously picked point and the average
+    of the next bucket.
+    :param x: The x values, increasing.
+    :param y: The y values.
+    :param num_of_points: The number of points to keep. If None, or not smaller than the number of points, the trace
+    is returned as it is.
+    :return: The x and y values of the kept points.
+    """
+    if num_of_points is None or num_of_points >= len(x) or num_of_points < 3:
+        return x, y
+    # The bounds of the buckets of the inner points
+    bounds = np.floor(np.linspace(1, len(x) - 1, num_of_points - 1)).astype(int)
+    picked = np.empty(num_of_points, dtype=int)
+    picked[0], picked[-1] = 0, len(x) - 1
+    for bucket in range(num_of_points - 2):
+        start, end = bounds[bucket], bounds[bucket + 1]
+        next_end = bounds[bucket + 2] if bucket + 2 < len(bounds) else len(x)
+        next_x, next_y = x[end:next_end].mean(), y[end:next_end].mean()
+        previous_x, previous_y = x[picked[bucket]], y[picked[bucket]]
+        areas = np.abs((previous_x - next_x) * (y[start:end] - previous_y) -
+                       (previous_x - x[start:end]) * (next_y - previous_y))
+        picked[bucket + 1] = start + np.argmax(areas)
+    return x[picked], y[picked]
+
+
+def _write_figure(figure_json: str, base_path: str, formats: Tuple[str, ...]) -> List[str]:
+    """
+    Writes a figure in each of the formats.
+    :return: The paths of the written files.
+    """
+    import plotly.io as pio
+    fig = pio.from_json(figure_json)
+    paths = []
+    for file_format in formats:
+        path = f"{base_path}.{file_format}"
+        if file_format == HTML:
+            fig.write_html(path, include_plotlyjs="cdn")
+        else:
+            fig.write_image(path, format=file_format)
+        paths.append(path)
+    return paths
 
 
+if os.environ.get(FIGURES_DIR_ENV_VAR):
+    Plotter.start_export(os.environ[FIGURES_DIR_ENV_VAR])
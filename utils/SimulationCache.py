@@ -0,0 +1,213 @@
+import os
+import json
+import hashlib
+import inspect
+import tempfile
+import numpy as np
+from dataclasses import asdict, fields
+from enum import Enum
+from functools import lru_cache
+from typing import Callable
+from utils.Auxiliary import Params, ParamBatch
+from discrete_model.pandemic_functions import DETERMINISTIC_PANDEMIC_FUNCTIONS
+
+# Bump to invalidate all the cached results, e.g. after a change in the model equations.
+CACHE_VERSION = 1
+DEFAULT_MAX_SIZE = 2 ** 30  # 1 GB
+CACHE_FILE_SUFFIX = ".npz"
+TUPLE_FLAG = "__tuple__"
+# Engine arguments that only change how a simulation is executed, not its result, so they are left out of the key
+NON_SEMANTIC_KWARGS = {"num_of_workers", "chunk_size"}
+# The packages of the model code. Their source is part of every key, so a change in any function an engine calls
+# invalidates its cached results.
+MODEL_PACKAGES = ("discrete_model", "differential_model", "utils")
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class SimulationCache:
+    """
+    A persistent, content-addressed cache of simulation results. A result is stored under a hash of everything it
+    depends on: the parameters, the engine and the pandemic function (their identities and source code), the source
+    of the model packages (MODEL_PACKAGES), the rest of the engine arguments and the random seed. The least recently
+    used results are evicted once the cache exceeds its size cap.
+    """
+
+    def __init__(self, cache_dir: str, max_size: int = DEFAULT_MAX_SIZE):
+        """
+        :param cache_dir: The directory of the cache, created if it doesn't exist.
+        :param max_size: The maximal total size of the cached results, in bytes.
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def run(self, engine: Callable, params: Params, pandemic_function: Callable, seed: int = None, **kwargs):
+        """
+        Returns the result of the engine, simulating only if it's not cached. Runs of a stochastic pandemic function
+        without a seed are not reproducible, so they are never cached.
+        :param engine: A simulation function that takes 'params' and 'pandemic_function' keyword arguments, such as
+        logistic_growth_model, logistic_growth_diff or the grid engine. It should return a numpy array or a tuple of
+        numpy arrays.
+        :param params: A dataclass containing all the relevant parameters.
+        :param pandemic_function: The model pandemic function.
+        :param seed: Seed for the engine - passed as an 'rng' generator or as a 'seed', whichever the engine takes.
+        :param kwargs: The rest of the engine arguments.
+        :return: The result of the engine.
+        """
+        if seed is None and pandemic_function not in DETERMINISTIC_PANDEMIC_FUNCTIONS:
+            return _run_engine(engine, params, pandemic_function, seed, **kwargs)
+
+        key = self.key(engine, params, pandemic_function, seed, **kwargs)
+        result = self.get(key)
+        if result is None:
+            result = _run_engine(engine, params, pandemic_function, seed, **kwargs)
+            self.put(key, result)
+        return result
+
+    @staticmethod
+    def key(engine: Callable, params: Params, pandemic_function: Callable, seed: int = None, **kwargs) -> str:
+        """
+        Calculates the canonical hash of a simulation. The arguments in NON_SEMANTIC_KWARGS are ignored.
+        """
+        kwargs = {name: value for name, value in kwargs.items() if name not in NON_SEMANTIC_KWARGS}
+        description = {"cache_version": CACHE_VERSION, "model_source": _model_source_hash(),
+                       "engine": _canonical(engine), "params": _canonical(params),
+                       "pandemic_function": _canonical(pandemic_function), "seed": seed,
+                       "kwargs": _canonical(kwargs)}
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    def get(self, key: str):
+        """
+        Loads a cached result and marks it as recently used.
+        :return: The result, or None if it's not cached.
+        """
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                arrays = [data[f"arr_{i}"] for i in range(len(data.files) - 1)]
+                is_tuple = bool(data[TUPLE_FLAG])
+        except (FileNotFoundError, OSError, ValueError, KeyError):
+            return None
+        os.utime(path)
+        return tuple(arrays) if is_tuple else arrays[0]
+
+    def put(self, key: str, result) -> None:
+        """
+        Stores a result, then evicts the least recently used results if the cache is over its size cap.
+        """
+        is_tuple = isinstance(result, tuple)
+        arrays = result if is_tuple else (result,)
+        file_descriptor, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(file_descriptor, "wb") as file:
+            np.savez(file, *arrays, **{TUPLE_FLAG: is_tuple})
+        os.replace(temp_path, self._path(key))
+        self._evict()
+
+    def clear(self) -> None:
+        """
+        Removes all the cached results.
+        """
+        for entry in self._entries():
+            os.remove(entry.path)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + CACHE_FILE_SUFFIX)
+
+    def _entries(self):
+        return [entry for entry in os.scandir(self.cache_dir) if entry.name.endswith(CACHE_FILE_SUFFIX)]
+
+    def _evict(self) -> None:
+        entries = sorted(self._entries(), key=lambda entry: entry.stat().st_mtime)
+        total_size = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if total_size <= self.max_size:
+                break
+            total_size -= entry.stat().st_size
+            os.remove(entry.path)
+
+
+def run_cached(cache: SimulationCache, engine: Callable, params: Params, pandemic_function: Callable,
+               seed: int = None, **kwargs):
+    """
+    Runs the engine through the cache, or directly if there is no cache. See SimulationCache.run.
+    """
+    if cache is not None:
+        return cache.run(engine, params, pandemic_function, seed, **kwargs)
+    return _run_engine(engine, params, pandemic_function, seed, **kwargs)
+
+
+def _run_engine(engine: Callable, params: Params, pandemic_function: Callable, seed: int, **kwargs):
+    """
+    Runs the engine, passing the seed as an 'rng' generator or as a 'seed', whichever the engine takes.
+    """
+    engine_arguments = inspect.signature(engine).parameters
+    if seed is not None and "rng" in engine_arguments:
+        kwargs["rng"] = np.random.default_rng(seed)
+    elif seed is not None and "seed" in engine_arguments:
+        kwargs["seed"] = seed
+    return engine(params=params, pandemic_function=pandemic_function, **kwargs)
+
+
+def _canonical(value):
+    """
+    Converts a value to a JSON serializable description that identifies it.
+    """
+    if isinstance(value, Params):
+        return _canonical(_as_float(asdict(value)))
+    if isinstance(value, ParamBatch):
+        return _canonical(_as_float({field.name: getattr(value, field.name) for field in fields(Params)}))
+    if isinstance(value, Enum):
+        return f"{type(value).__name__}.{value.name}"
+    if isinstance(value, dict):
+        return {str(_canonical(name)): _canonical(item) for name, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(item) for item in value]
+    if isinstance(value, np.ndarray):
+        return {"dtype": str(value.dtype), "shape": value.shape,
+                "sha256": hashlib.sha256(np.ascontiguousarray(value).tobytes()).hexdigest()}
+    if isinstance(value, (np.generic, float)):
+        return repr(float(value)) if isinstance(value, (np.floating, float)) else value.item()
+    if callable(value):
+        return {"name": f"{value.__module__}.{value.__qualname__}", "version": _source_hash(value)}
+    return value
+
+
+def _as_float(values: dict) -> dict:
+    """
+    Casts the numeric parameters to float, so that e.g. 1000 and 1000.0 give the same key.
+    """
+    return {name: _float_value(value) for name, value in values.items()}
+
+
+def _float_value(value):
+    if isinstance(value, (bool, np.bool_)):
+        return value
+    if isinstance(value, np.ndarray) and value.dtype.kind in "iuf":
+        return value.astype(float)
+    if isinstance(value, (int, float, np.number)):
+        return float(value)
+    return value
+
+
+@lru_cache(maxsize=None)
+def _model_source_hash() -> str:
+    """
+    :return: A hash of the source files of the model packages, computed once per process.
+    """
+    digest = hashlib.sha256()
+    for package in MODEL_PACKAGES:
+        package_dir = os.path.join(ROOT_DIR, package)
+        for file_name in sorted(os.listdir(package_dir)):
+            if file_name.endswith(".py"):
+                digest.update(f"{package}/{file_name}".encode())
+                with open(os.path.join(package_dir, file_name), "rb") as file:
+                    digest.update(file.read())
+    return digest.hexdigest()
+
+
+def _source_hash(function: Callable) -> str:
+    try:
+        source = inspect.getsource(function)
+    except (OSError, TypeError):
+        return None
+    return hashlib.sha256(source.encode()).hexdigest()